@@ -0,0 +1,7 @@
+"""
+Benchmarks for bukkit.
+
+Each module can be run on its own, e.g. `python -m benchmarks.roundtrip`,
+and prints its results as JSON. `python -m benchmarks.run` runs the standard
+suite defined in `benchmarks.suite`.
+"""
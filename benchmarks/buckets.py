@@ -0,0 +1,31 @@
+"""
+Measure the cost of a single `consume` call for each kind of token bucket.
+"""
+
+import json
+import sys
+import timeit
+
+from bukkit.bucket import MonotonicTokenBucket, TokenBucket
+
+
+def per_call(bucket_class, number):
+    """
+    Return the mean number of nanoseconds taken by `consume`.
+    """
+    bucket = bucket_class(rate=1000000, limit=1000000)
+    timer = timeit.Timer('consume(1)', globals={'consume': bucket.consume})
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e9
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    results = {
+        cls.__name__: {'consume_ns': per_call(cls, number)}
+        for cls in (TokenBucket, MonotonicTokenBucket)
+    }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
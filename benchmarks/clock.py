@@ -0,0 +1,73 @@
+"""
+Measure how much a `CoarseClock` speeds up `Collection.consume` compared
+with reading `time.time` on every call, and how far behind the real time
+its readings fall, at several resolutions.
+"""
+
+import json
+import sys
+import time
+import timeit
+
+from bukkit.bucket import Collection
+from bukkit.clock import CoarseClock
+
+from benchmarks.suite import REPEAT, uniform_keys
+
+
+RESOLUTIONS = (0.0001, 0.001, 0.01)
+
+
+def throughput(clock, keys):
+    """
+    Time consuming from a collection, returning nanoseconds per call.
+    """
+    def run():
+        consume = Collection(
+            rate=100, limit=1000, timeout=60, clock=clock).consume
+        for key in keys:
+            consume(key, 1)
+    elapsed = min(timeit.repeat(run, repeat=REPEAT, number=1))
+    return elapsed / len(keys) * 1e9
+
+
+def error(clock, n_samples=100000):
+    """
+    Sample how far the clock lags `time.time`, returning the mean and
+    largest lag in milliseconds.
+    """
+    lags = []
+    for _ in range(n_samples):
+        lags.append(time.time() - clock())
+    return sum(lags) / len(lags) * 1e3, max(lags) * 1e3
+
+
+def main():
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    keys = uniform_keys(10000, n_samples)
+    baseline = throughput(time.time, keys)
+    results = {
+        'calls': n_samples,
+        'time.time': {'ns_per_call': baseline},
+        'coarse': [],
+    }
+    for resolution in RESOLUTIONS:
+        clock = CoarseClock(resolution=resolution)
+        clock.start()
+        try:
+            ns_per_call = throughput(clock.now, keys)
+            mean_lag, max_lag = error(clock.now)
+        finally:
+            clock.stop()
+        results['coarse'].append({
+            'resolution': resolution,
+            'ns_per_call': ns_per_call,
+            'speedup_pct': (baseline - ns_per_call) / baseline * 100,
+            'mean_lag_ms': mean_lag,
+            'max_lag_ms': max_lag,
+        })
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure `ShardedCollection` throughput as the number of threads and shards
+varies, to help size the shard count.
+"""
+
+import json
+import sys
+import threading
+import time
+
+from bukkit import ShardedCollection
+
+
+THREAD_COUNTS = (1, 2, 4, 8, 16, 32)
+SHARD_COUNTS = (1, 4, 16, 64)
+
+
+def run(n_threads, n_shards, ops_per_thread, n_keys=10000):
+    """
+    Hammer a collection from `n_threads` threads and return the aggregate
+    number of operations per second.
+    """
+    buckets = ShardedCollection(
+        rate=100, limit=1000, timeout=60, shards=n_shards)
+    keys = ['key:%d' % i for i in range(n_keys)]
+    start_line = threading.Event()
+
+    def worker(offset):
+        consume = buckets.consume
+        start_line.wait()
+        for i in range(ops_per_thread):
+            consume(keys[(offset + i * 7919) % n_keys], 1)
+
+    threads = [
+        threading.Thread(target=worker, args=(i * 104729,))
+        for i in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    started = time.time()
+    start_line.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return n_threads * ops_per_thread / elapsed
+
+
+def main():
+    ops_per_thread = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    results = []
+    for n_shards in SHARD_COUNTS:
+        for n_threads in THREAD_COUNTS:
+            results.append({
+                'shards': n_shards,
+                'threads': n_threads,
+                'ops_per_sec': run(n_threads, n_shards, ops_per_thread),
+            })
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare the throughput of charging tokens over the server's datagram socket,
+without waiting for replies, against consuming them over a stream, one
+request at a time and pipelined. Charges are sent as fast as they can be, so
+the server may fall behind and some be dropped; `dropped` counts those, and
+`lost` any others that never arrived.
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bukkit.client import Client
+
+from benchmarks.roundtrip import pipelined, single
+
+
+N_KEYS = 1000
+
+
+def start_server(path, datagram_path):
+    """
+    Run a server listening on both sockets in a child process, waiting until
+    it's listening.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'bukkit.server', path,
+         '--datagram', datagram_path])
+    while not (os.path.exists(path) and os.path.exists(datagram_path)):
+        time.sleep(0.01)
+    return proc
+
+
+def charged(client, n_requests):
+    started = time.time()
+    for i in range(n_requests):
+        client.charge('bench', 'key:%d' % (i % N_KEYS), 1)
+    client.flush()
+    return time.time() - started
+
+
+def consumed(client, names, limit):
+    """
+    The total number of tokens taken from the named buckets.
+    """
+    return sum(
+        limit - available for available, _ in client.query('bench', names))
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_datagram = int(sys.argv[2]) if len(sys.argv) > 2 else 8192
+    names = ['key:%d' % i for i in range(N_KEYS)]
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+    datagram_path = os.path.join(tmpdir, 'bukkit.dgram')
+    proc = start_server(path, datagram_path)
+    try:
+        with Client(
+                path, datagram_path=datagram_path,
+                max_datagram=max_datagram) as client:
+            # Nothing refills or runs out, so every token taken shows up.
+            limit = float(n_requests * 10)
+            client.create(rate=0, limit=limit, timeout=600, collection='bench')
+            results = []
+            elapsed = single(client, n_requests)
+            results.append({
+                'mode': 'stream_single',
+                'requests': n_requests,
+                'ops_per_sec': n_requests / elapsed,
+            })
+            elapsed = pipelined(client, n_requests, 100)
+            results.append({
+                'mode': 'stream_pipelined',
+                'depth': 100,
+                'requests': n_requests,
+                'ops_per_sec': n_requests / elapsed,
+            })
+
+            before = consumed(client, names, limit)
+            started = time.time()
+            elapsed = charged(client, n_requests)
+            # Sending is done once the last datagram's out, but the server
+            # may still be applying them. Charges dropped for want of room
+            # never arrive.
+            sent = n_requests - client.dropped
+            deadline = started + elapsed + 10
+            while True:
+                taken = consumed(client, names, limit) - before
+                if taken >= sent or time.time() > deadline:
+                    break
+                time.sleep(0.001)
+            applied_in = time.time() - started
+            results.append({
+                'mode': 'datagram',
+                'max_datagram': max_datagram,
+                'requests': n_requests,
+                'ops_per_sec': n_requests / elapsed,
+                'applied_ops_per_sec': taken / applied_in,
+                'dropped': client.dropped,
+                'lost': n_requests - taken,
+            })
+    finally:
+        # Interrupt rather than terminate, so the server cleans up.
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+        shutil.rmtree(tmpdir)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
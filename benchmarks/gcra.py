@@ -0,0 +1,67 @@
+"""
+Compare the throughput and memory per key of `Collection` with each bucket
+class, including `GCRABucket`.
+"""
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+from bukkit.bucket import (
+    Collection, GCRABucket, MonotonicTokenBucket, TokenBucket)
+
+from benchmarks.suite import REPEAT, uniform_keys
+
+
+BUCKET_CLASSES = (TokenBucket, MonotonicTokenBucket, GCRABucket)
+
+
+def throughput(bucket_class, keys):
+    """
+    Time consuming from a collection, returning nanoseconds per call.
+    """
+    def run():
+        consume = Collection(
+            rate=100, limit=1000, timeout=60,
+            bucket_class=bucket_class).consume
+        for key in keys:
+            consume(key, 1)
+    elapsed = min(timeit.repeat(run, repeat=REPEAT, number=1))
+    return elapsed / len(keys) * 1e9
+
+
+def memory(bucket_class, n_keys):
+    """
+    Populate a collection with `n_keys` buckets, returning the bytes
+    allocated per key. The keys are created beforehand, so aren't counted.
+    """
+    keys = ['key:%d' % i for i in range(n_keys)]
+    tracemalloc.start()
+    try:
+        collection = Collection(
+            rate=100, limit=1000, timeout=60, bucket_class=bucket_class)
+        for key in keys:
+            collection.consume(key, 1)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del collection
+    return float(current) / n_keys
+
+
+def main():
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    keys = uniform_keys(100000, n_samples)
+    results = {}
+    for bucket_class in BUCKET_CLASSES:
+        results[bucket_class.__name__] = {
+            'calls': n_samples,
+            'ns_per_call': throughput(bucket_class, keys),
+            'bytes_per_key': memory(bucket_class, 100000),
+        }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
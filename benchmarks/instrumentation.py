@@ -0,0 +1,68 @@
+"""
+Measure the overhead of metrics collection, both on `Collection.consume`
+and on the server's handling of consume requests.
+"""
+
+import json
+import sys
+import timeit
+
+from bukkit.bucket import Collection
+from bukkit.server import Handler, Registry
+
+from benchmarks.suite import REPEAT, uniform_keys
+
+
+def collection_consume(keys, metrics):
+    """
+    Time one pass of consuming from a collection, in nanoseconds per call.
+    """
+    def run():
+        consume = Collection(
+            rate=100, limit=1000, timeout=60, metrics=metrics).consume
+        for key in keys:
+            consume(key, 1)
+    return timeit.timeit(run, number=1) / len(keys) * 1e9
+
+
+def server_consume(keys, metrics):
+    """
+    Time one pass of the server handling consume requests, without the
+    network, in nanoseconds per request.
+    """
+    requests = [
+        ("C\nc=bench\nb=%s\nt=1" % key).encode('utf-8') for key in keys]
+
+    def run():
+        handler = Handler(Registry(metrics=metrics))
+        handler.registry.create('bench', rate=100, limit=1000, timeout=60)
+        handle = handler.handle
+        for request in requests:
+            handle(request)
+    return timeit.timeit(run, number=1) / len(keys) * 1e9
+
+
+def main():
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    keys = uniform_keys(10000, n_samples)
+    results = {}
+    for name, func in [('collection_consume', collection_consume),
+                       ('server_consume', server_consume)]:
+        # Alternate between the two so that both see the same conditions.
+        timings = {False: [], True: []}
+        for _ in range(REPEAT):
+            for metrics in (False, True):
+                timings[metrics].append(func(keys, metrics))
+        off = min(timings[False])
+        on = min(timings[True])
+        results[name] = {
+            'calls': n_samples,
+            'ns_per_call_off': off,
+            'ns_per_call_on': on,
+            'overhead_pct': (on - off) / off * 100,
+        }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
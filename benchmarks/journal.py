@@ -0,0 +1,95 @@
+"""
+Compare server request throughput with journaling off, with batched syncs,
+and with a sync after every write, and time replaying the journal each
+leaves behind.
+"""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bukkit.client import Client
+from bukkit.journal import Journal
+from bukkit.server import Registry
+
+from benchmarks.roundtrip import pipelined, single
+
+
+MODES = (
+    ('off', None),
+    ('batched', 0.1),
+    ('per_write', 0.0),
+)
+
+
+def start_server(path, journal_path, sync_interval):
+    """
+    Run a server in a child process, journaling if `journal_path` is given,
+    and wait until it's listening.
+    """
+    args = [sys.executable, '-m', 'bukkit.server', path]
+    if journal_path is not None:
+        args += [
+            '--journal', journal_path,
+            '--sync-interval', str(sync_interval)]
+    proc = subprocess.Popen(args)
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    return proc
+
+
+def replay(journal_path):
+    """
+    Time replaying a journal, returning the seconds taken and the number of
+    records replayed.
+    """
+    started = time.perf_counter()
+    count = Journal(journal_path).replay(Registry())
+    return time.perf_counter() - started, count
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    results = []
+    for mode, sync_interval in MODES:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'bukkit.sock')
+        journal_path = None
+        if sync_interval is not None:
+            journal_path = os.path.join(tmpdir, 'journal')
+        proc = start_server(path, journal_path, sync_interval)
+        try:
+            with Client(path) as client:
+                client.create(
+                    rate=1000, limit=1000, timeout=60, collection='bench')
+                elapsed_single = single(client, n_requests)
+                elapsed_pipelined = pipelined(client, n_requests, 100)
+            # Interrupt rather than terminate, so pending records are synced.
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
+            result = {
+                'mode': mode,
+                'requests': n_requests,
+                'single_ops_per_sec': n_requests / elapsed_single,
+                'pipelined_ops_per_sec': n_requests / elapsed_pipelined,
+            }
+            if journal_path is not None:
+                elapsed, count = replay(journal_path)
+                result['journal_bytes'] = os.path.getsize(journal_path)
+                result['replay_records'] = count
+                result['replay_records_per_sec'] = count / elapsed
+            results.append(result)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(tmpdir)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare the memory used per key by `Collection`, with both `TokenBucket` and
+`GCRABucket` buckets, `LeanCollection` and `ArrayCollection`, and how quickly
+each consumes from existing buckets, one at a time and in batches with
+`consume_many`.
+
+Requires Python 3.4+ for `tracemalloc`, and NumPy.
+"""
+
+import json
+import sys
+import timeit
+import tracemalloc
+
+from bukkit.arrays import ArrayCollection
+from bukkit.bucket import Collection, GCRABucket
+from bukkit.lean import LeanCollection
+
+from benchmarks.suite import REPEAT
+
+
+def measure(factory, n_keys):
+    """
+    Populate a collection with `n_keys` buckets and return the number of
+    bytes allocated per key.
+    """
+    keys = ['key:%d' % i for i in range(n_keys)]
+    tracemalloc.start()
+    try:
+        collection = factory()
+        for key in keys:
+            collection.consume(key, 1)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del collection
+    return float(current) / n_keys
+
+
+def throughput(factory, n_keys, batch=None):
+    """
+    Populate a collection with `n_keys` buckets, then time consuming from
+    each of them again, returning nanoseconds per request. Requests are
+    made one at a time, or `batch` at a time with `consume_many`.
+    """
+    keys = ['key:%d' % i for i in range(n_keys)]
+    collection = factory()
+    for key in keys:
+        collection.consume(key, 1)
+
+    if batch is None:
+        def run():
+            for key in keys:
+                collection.consume(key, 1)
+    else:
+        batches = [
+            [(key, 1) for key in keys[i:i + batch]]
+            for i in range(0, n_keys, batch)]
+
+        def run():
+            for pairs in batches:
+                collection.consume_many(pairs)
+    elapsed = min(timeit.repeat(run, repeat=REPEAT, number=1))
+    return elapsed / n_keys * 1e9
+
+
+def main():
+    n_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    batch = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    factories = {
+        'Collection': lambda: Collection(rate=1, limit=10, timeout=60),
+        'Collection/GCRABucket': lambda: Collection(
+            rate=1, limit=10, timeout=60, bucket_class=GCRABucket),
+        'LeanCollection': lambda: LeanCollection(rate=1, limit=10, timeout=60),
+        'ArrayCollection': lambda: ArrayCollection(
+            rate=1, limit=10, timeout=60),
+    }
+    results = {'keys': n_keys, 'batch': batch}
+    for name, factory in factories.items():
+        results[name] = {
+            'bytes_per_key': measure(factory, n_keys),
+            'ns_per_consume': throughput(factory, n_keys),
+            'ns_per_batched_consume': throughput(factory, n_keys, batch),
+        }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compare how quickly the server's handler parses and dispatches requests in
+the text and binary protocols, without any socket I/O.
+"""
+
+import json
+import sys
+import time
+
+from bukkit import binary
+from bukkit.client import _build_stanza
+from bukkit.server import Handler, Registry
+
+
+class NullTransport(object):
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def run(handshake, create, consume, n_requests, batch=100):
+    """
+    Feed `n_requests` consume requests to a handler in batches of `batch`
+    and return the number handled per second.
+    """
+    handler = Handler(Registry())
+    handler.connection_made(NullTransport())
+    handler.data_received(handshake + create)
+    chunks = [
+        b"".join(consume('bench', 'key:%d' % (j % 1000))
+                 for j in range(i, i + batch))
+        for i in range(0, n_requests, batch)]
+    started = time.time()
+    for chunk in chunks:
+        handler.data_received(chunk)
+    return n_requests / (time.time() - started)
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    results = {
+        'requests': n_requests,
+        'text_ops_per_sec': run(
+            b"",
+            _build_stanza('B', {'r': 1000, 'l': 1000, 't': 60, 'c': 'bench'}),
+            lambda c, b: _build_stanza('C', {'c': c, 'b': b, 't': 1}),
+            n_requests),
+        'binary_ops_per_sec': run(
+            binary.HANDSHAKE,
+            binary.pack_create(1000, 1000, 60, 'bench'),
+            lambda c, b: binary.pack_consume(c, b, 1),
+            n_requests),
+    }
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare round-trip latency and throughput of single and pipelined requests
+against a local server.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bukkit.client import Client
+
+
+def start_server(path):
+    """
+    Run a server in a child process, waiting until it's listening.
+    """
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'bukkit.server', path])
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    return proc
+
+
+def single(client, n_requests):
+    started = time.time()
+    for i in range(n_requests):
+        client.consume('bench', 'key:%d' % (i % 1000), 1)
+    return time.time() - started
+
+
+def pipelined(client, n_requests, depth):
+    started = time.time()
+    for i in range(0, n_requests, depth):
+        with client.pipeline() as pipe:
+            for j in range(i, min(i + depth, n_requests)):
+                pipe.consume('bench', 'key:%d' % (j % 1000), 1)
+    return time.time() - started
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+    proc = start_server(path)
+    try:
+        with Client(path) as client:
+            client.create(
+                rate=1000, limit=1000, timeout=60, collection='bench')
+            results = []
+            elapsed = single(client, n_requests)
+            results.append({
+                'mode': 'single',
+                'depth': 1,
+                'requests': n_requests,
+                'ops_per_sec': n_requests / elapsed,
+                'round_trip_us': elapsed / n_requests * 1e6,
+            })
+            for depth in (10, 100, 1000):
+                elapsed = pipelined(client, n_requests, depth)
+                batches = (n_requests + depth - 1) // depth
+                results.append({
+                    'mode': 'pipelined',
+                    'depth': depth,
+                    'requests': n_requests,
+                    'ops_per_sec': n_requests / elapsed,
+                    'round_trip_us': elapsed / batches * 1e6,
+                })
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(tmpdir)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Run the benchmark suite and write the results as JSON.
+
+    python -m benchmarks.run [--full] [--output FILE] [--compare FILE]
+                             [NAME...]
+
+With `--compare`, the ratio of each timing to that in an earlier results
+file is printed to stderr, so regressions between commits stand out.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.suite import SUITE
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    """
+    Flatten nested results into a dictionary of dotted paths to numbers.
+    """
+    flat = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        items = ((str(i), value) for i, value in enumerate(results))
+    else:
+        return {prefix: results}
+    for key, value in items:
+        flat.update(flatten(value, prefix + '.' + key if prefix else key))
+    return flat
+
+
+def compare(old, new, out):
+    """
+    Print the ratio of every timing in `new` to the same one in `old`.
+    """
+    old_flat = flatten(old['results'])
+    for path, value in sorted(flatten(new['results']).items()):
+        if not (path.endswith('secs') or path.endswith('_call') or
+                path.endswith('_request')):
+            continue
+        if old_flat.get(path):
+            out.write('%-60s %7.3fx\n' % (path, value / old_flat[path]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the benchmark suite.")
+    parser.add_argument(
+        'names', nargs='*', metavar='NAME',
+        help="benchmarks to run (default: all of %s)" % ', '.join(SUITE))
+    parser.add_argument(
+        '--full', action='store_true', help="use larger, slower sizes")
+    parser.add_argument(
+        '--output', metavar='FILE', help="write results to FILE")
+    parser.add_argument(
+        '--compare', metavar='FILE', help="compare against earlier results")
+    args = parser.parse_args(argv)
+
+    for name in args.names:
+        if name not in SUITE:
+            parser.error("unknown benchmark: %s" % name)
+    names = args.names or list(SUITE)
+
+    results = {}
+    for name in names:
+        sys.stderr.write('%s...\n' % name)
+        results[name] = SUITE[name](args.full)
+    document = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'full': args.full,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(json.load(fh), document, sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
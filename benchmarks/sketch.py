@@ -0,0 +1,110 @@
+"""
+Compare `SketchCollection` with the exact `Collection` under a scraping
+attack: a stream of mostly one-off keys, mixed with a few heavy hitters.
+
+For each sketch size, this reports the memory held once the stream has been
+consumed and the fraction of the requests the exact collection allowed that
+the sketch denied. As a check that the sketch never lets a key exceed its
+limit, the requests it allowed are replayed through an exact collection,
+and any that collection denies are counted as violations; only rounding
+error should produce any.
+"""
+
+import json
+import random
+import sys
+import tracemalloc
+
+from bukkit.bucket import Collection
+from bukkit.sketch import SketchCollection
+
+
+SEED = 42
+WIDTHS = (1024, 16384, 65536)
+
+
+def workload(n_requests, n_heavy=100, heavy_fraction=0.2):
+    """
+    Generate `(timestamp, key)` pairs at 10,000 requests per second, where
+    `heavy_fraction` of requests come from `n_heavy` keys and the rest are
+    each from a distinct key.
+    """
+    rng = random.Random(SEED)
+    requests = []
+    for i in range(n_requests):
+        if rng.random() < heavy_fraction:
+            key = 'heavy:%d' % rng.randrange(n_heavy)
+        else:
+            key = 'scraper:%d' % i
+        requests.append((i / 10000.0, key))
+    return requests
+
+
+def violations(settings, requests, outcomes):
+    """
+    Count the allowed requests that an exact collection would deny, given
+    only those requests.
+    """
+    ticks = [0.0]
+    collection = Collection(clock=lambda: ticks[0], **settings)
+    count = 0
+    for (ts, key), allowed in zip(requests, outcomes):
+        if allowed:
+            ticks[0] = ts
+            if not collection.consume(key, 1):
+                count += 1
+    return count
+
+
+def run(factory, requests):
+    """
+    Feed the requests through a collection, returning the bytes it holds
+    at the end and the outcome of each request.
+    """
+    ticks = [0.0]
+    results = [None] * len(requests)
+    tracemalloc.start()
+    try:
+        collection = factory(lambda: ticks[0])
+        for i, (ts, key) in enumerate(requests):
+            ticks[0] = ts
+            results[i] = collection.consume(key, 1)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current, results
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    requests = workload(n_requests)
+    settings = {'rate': 10, 'limit': 20, 'timeout': 60}
+    exact_bytes, expected = run(
+        lambda clock: Collection(clock=clock, **settings), requests)
+    n_allowed = sum(expected)
+    results = {
+        'requests': n_requests,
+        'distinct_keys': len(set(key for _, key in requests)),
+        'exact': {'bytes': exact_bytes, 'allowed': n_allowed},
+        'sketch': [],
+    }
+    for width in WIDTHS:
+        sketch_bytes, outcomes = run(
+            lambda clock: SketchCollection(
+                clock=clock, width=width, depth=4, max_exact=1000,
+                **settings),
+            requests)
+        false_denies = sum(
+            1 for want, got in zip(expected, outcomes) if want and not got)
+        results['sketch'].append({
+            'width': width,
+            'depth': 4,
+            'bytes': sketch_bytes,
+            'false_deny_rate': false_denies / n_allowed,
+            'violations': violations(settings, requests, outcomes),
+        })
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Compare saving and restoring a collection as a snapshot and as a pickle.
+"""
+
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+from bukkit import snapshot
+from bukkit.bucket import Collection
+
+
+def populate(n_buckets):
+    buckets = Collection(rate=1, limit=100, timeout=3600)
+    for i in range(n_buckets):
+        buckets.consume('key:%d' % i, i % 100)
+    return buckets
+
+
+def timed(func, *args):
+    started = time.time()
+    result = func(*args)
+    return time.time() - started, result
+
+
+def dump_pickle(buckets, path):
+    with open(path, 'wb') as fh:
+        pickle.dump(buckets, fh, pickle.HIGHEST_PROTOCOL)
+
+
+def load_pickle(path):
+    with open(path, 'rb') as fh:
+        return pickle.load(fh)
+
+
+def run(n_buckets, tmpdir):
+    buckets = populate(n_buckets)
+    pickle_path = os.path.join(tmpdir, 'buckets.pickle')
+    snapshot_path = os.path.join(tmpdir, 'buckets.snapshot')
+    return {
+        'buckets': n_buckets,
+        'pickle_save_secs': timed(dump_pickle, buckets, pickle_path)[0],
+        'pickle_load_secs': timed(load_pickle, pickle_path)[0],
+        'pickle_bytes': os.path.getsize(pickle_path),
+        'snapshot_save_secs': timed(snapshot.save, buckets, snapshot_path)[0],
+        'snapshot_load_secs': timed(snapshot.load, snapshot_path)[0],
+        'snapshot_bytes': os.path.getsize(snapshot_path),
+    }
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = [run(n_buckets, tmpdir) for n_buckets in sizes]
+    finally:
+        shutil.rmtree(tmpdir)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+The standard benchmark suite, covering the hot paths of the library and the
+server.
+
+Every benchmark takes a `full` flag, which selects larger, slower sizes, and
+returns a dictionary of results. Timings are the best of several runs, and
+all randomness is seeded, so results are comparable between runs.
+"""
+
+import bisect
+import itertools
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import timeit
+
+from bukkit.bucket import Collection, TokenBucket
+from bukkit.client import Client
+
+from benchmarks import roundtrip
+
+
+SUITE = {}
+
+REPEAT = 5
+SEED = 42
+
+
+def benchmark(func):
+    """
+    Register a function as part of the suite.
+    """
+    SUITE[func.__name__] = func
+    return func
+
+
+def best_of(func, repeat=REPEAT):
+    """
+    Run `func` `repeat` times, returning the shortest time taken.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def zipf_keys(n_keys, n_samples, s=1.1):
+    """
+    Draw keys from a Zipfian distribution over `n_keys` keys.
+    """
+    rng = random.Random(SEED)
+    weights = list(itertools.accumulate(
+        1.0 / (rank ** s) for rank in range(1, n_keys + 1)))
+    total = weights[-1]
+    return [
+        'key:%d' % bisect.bisect_left(weights, rng.random() * total)
+        for _ in range(n_samples)]
+
+
+def uniform_keys(n_keys, n_samples):
+    rng = random.Random(SEED)
+    return ['key:%d' % rng.randrange(n_keys) for _ in range(n_samples)]
+
+
+@benchmark
+def token_bucket_consume(full):
+    number = 1000000 if full else 200000
+    bucket = TokenBucket(rate=1000000, limit=1000000)
+    timer = timeit.Timer('consume(1)', globals={'consume': bucket.consume})
+    elapsed = min(timer.repeat(repeat=REPEAT, number=number))
+    return {'calls': number, 'ns_per_call': elapsed / number * 1e9}
+
+
+def _collection_consume(keys):
+    def run():
+        consume = Collection(rate=100, limit=1000, timeout=60).consume
+        for key in keys:
+            consume(key, 1)
+    elapsed = best_of(run)
+    return {
+        'calls': len(keys),
+        'distinct_keys': len(set(keys)),
+        'ns_per_call': elapsed / len(keys) * 1e9,
+    }
+
+
+@benchmark
+def collection_consume_uniform(full):
+    n_samples = 1000000 if full else 200000
+    return _collection_consume(uniform_keys(100000, n_samples))
+
+
+@benchmark
+def collection_consume_zipf(full):
+    n_samples = 1000000 if full else 200000
+    return _collection_consume(zipf_keys(100000, n_samples))
+
+
+@benchmark
+def collection_purge(full):
+    n_buckets = 1000000 if full else 100000
+    results = []
+    for fraction in (0.0, 0.1, 0.5, 0.9, 1.0):
+        n_expired = int(n_buckets * fraction)
+        timings = []
+        for _ in range(REPEAT):
+            ticks = [0]
+            buckets = Collection(
+                rate=1, limit=10, timeout=60, clock=lambda: ticks[0])
+            for i in range(n_buckets):
+                if i == n_expired:
+                    ticks[0] = 100
+                buckets.consume('key:%d' % i, 1)
+            ticks[0] = 100
+            started = time.perf_counter()
+            buckets.purge()
+            timings.append(time.perf_counter() - started)
+            assert len(buckets.node_map) == n_buckets - n_expired
+        results.append({
+            'buckets': n_buckets,
+            'expired_fraction': fraction,
+            'secs': min(timings),
+        })
+    return {'runs': results}
+
+
+@benchmark
+def collection_pickle(full):
+    sizes = (10 ** 4, 10 ** 5)
+    if full:
+        sizes += (10 ** 6, 10 ** 7)
+    results = []
+    for n_buckets in sizes:
+        buckets = Collection(rate=1, limit=100, timeout=3600)
+        for i in range(n_buckets):
+            buckets.consume('key:%d' % i, 1)
+        repeat = 1 if n_buckets >= 10 ** 6 else REPEAT
+        state = [None]
+
+        def dump():
+            state[0] = pickle.dumps(buckets, pickle.HIGHEST_PROTOCOL)
+
+        dump_secs = best_of(dump, repeat)
+        load_secs = best_of(lambda: pickle.loads(state[0]), repeat)
+        results.append({
+            'buckets': n_buckets,
+            'bytes': len(state[0]),
+            'getstate_secs': dump_secs,
+            'setstate_secs': load_secs,
+        })
+    return {'runs': results}
+
+
+@benchmark
+def server_round_trip(full):
+    n_requests = 50000 if full else 10000
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+    proc = roundtrip.start_server(path)
+    try:
+        with Client(path) as client:
+            client.create(
+                rate=1000, limit=1000, timeout=60, collection='bench')
+            single = roundtrip.single(client, n_requests)
+            pipelined = roundtrip.pipelined(client, n_requests, 100)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(tmpdir)
+    return {
+        'requests': n_requests,
+        'single_us_per_request': single / n_requests * 1e6,
+        'pipelined_us_per_request': pipelined / n_requests * 1e6,
+    }
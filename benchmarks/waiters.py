@@ -0,0 +1,93 @@
+"""
+Compare `AsyncLimiter`, which queues waiters and wakes only those a refill
+can satisfy, against every task polling with `Collection.acquire_async`.
+
+All the tasks wait for one token each from a single bucket that starts out
+empty, so the k-th token can be granted no earlier than `k / rate` seconds
+after they start waiting. The bucket's limit is 10ms worth of refill: event
+loop timers are only accurate to around a millisecond, and a smaller limit
+would lose tokens to that jitter. For each approach, this reports how many
+consume attempts were made, how many times tasks were woken, and how late
+each grant was compared to that ideal.
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from bukkit.aio import AsyncLimiter
+from bukkit.bucket import Collection
+
+
+class CountingCollection(Collection):
+    """
+    A collection that counts consume attempts.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attempts = 0
+
+    def consume(self, key, tokens):
+        self.attempts += 1
+        return super().consume(key, tokens)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def _run(n_tasks, rate, fair):
+    # The clock stands still until every task is waiting, so no tokens
+    # arrive while they're being started.
+    origin = [float('inf')]
+    limit = rate / 100
+    buckets = CountingCollection(
+        rate=rate, limit=limit, timeout=60,
+        clock=lambda: max(0.0, time.perf_counter() - origin[0]))
+    buckets.consume('hot', limit)
+    limiter = AsyncLimiter(buckets)
+    acquire = limiter.acquire if fair else buckets.acquire_async
+    granted = []
+
+    async def waiter():
+        assert await acquire('hot', 1)
+        granted.append(time.perf_counter())
+
+    tasks = [asyncio.ensure_future(waiter()) for _ in range(n_tasks)]
+    await asyncio.sleep(0)
+    buckets.attempts = 0
+    origin[0] = time.perf_counter()
+    await asyncio.gather(*tasks)
+    latencies = [
+        ts - origin[0] - (k + 1) / rate for k, ts in enumerate(granted)]
+    return {
+        'tasks': n_tasks,
+        'consume_attempts': buckets.attempts,
+        'wakeups': limiter.wakeups if fair else buckets.attempts,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1e3,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1e3,
+        'latency_max_ms': max(latencies) * 1e3,
+    }
+
+
+def run(n_tasks, rate, fair):
+    return asyncio.run(_run(n_tasks, rate, fair))
+
+
+def main():
+    n_tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    # Polling wakes every sleeping task on each refill, so it's quadratic in
+    # the number of tasks; keep its run to a manageable size.
+    n_polling = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rate = 5000
+    print(json.dumps({
+        'fair_queue': run(n_tasks, rate, True),
+        'polling': run(n_polling, rate, False),
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,23 @@
-from bukkit.bucket import TokenBucket, Collection
-from bukkit.client import Client, ProtocolError
+from bukkit.bucket import (
+    Collection, GCRABucket, MonotonicTokenBucket, Policy, PrefixResolver,
+    TokenBucket, consume_chain)
+from bukkit.client import Client, ClientPool, MultiClient, ProtocolError
+from bukkit.lean import LeanCollection
+from bukkit.sharded import ShardedCollection
 
 
 __all__ = (
     'Client',
+    'ClientPool',
     'Collection',
+    'GCRABucket',
+    'LeanCollection',
+    'MonotonicTokenBucket',
+    'MultiClient',
+    'Policy',
+    'PrefixResolver',
     'ProtocolError',
+    'ShardedCollection',
     'TokenBucket',
+    'consume_chain',
 )
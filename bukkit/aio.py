@@ -0,0 +1,142 @@
+"""
+Fair asyncio rate limiting over a keyed collection of token buckets.
+"""
+
+import asyncio
+import collections
+
+
+__all__ = (
+    'AsyncLimiter',
+)
+
+
+class AsyncLimiter(object):
+    """
+    Lets coroutines wait for tokens from the buckets in a `Collection`.
+
+    Waiters for each key are queued and served strictly in arrival order,
+    so a large request at the head of a queue can't be starved by smaller
+    ones arriving after it. Rather than each waiter polling, a single timer
+    per key fires when the bucket will have refilled enough for the waiter
+    at the head of the queue, and only the waiters the bucket can then
+    satisfy are woken. `wakeups` counts them.
+    """
+
+    __slots__ = (
+        'collection',
+        'queues',
+        'timers',
+        'wakeups',
+    )
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.queues = {}
+        self.timers = {}
+        self.wakeups = 0
+
+    async def acquire(self, key, tokens, timeout=None):
+        """
+        Consume tokens from the bucket identified by `key`, waiting in line
+        until enough are available, for at most `timeout` seconds. Returns
+        `False` if the timeout runs out first, or if there will never be
+        enough, otherwise `True`.
+        """
+        queue = self.queues.get(key)
+        if not queue:
+            if self.collection.consume(key, tokens):
+                return True
+            if self.collection.time_until(key, tokens) is None:
+                return False
+        if queue is None:
+            queue = self.queues[key] = collections.deque()
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append((tokens, waiter))
+        if len(queue) == 1:
+            self._schedule(key)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                self._withdraw(key, waiter)
+
+    def _withdraw(self, key, waiter):
+        """
+        Remove a waiter that gave up from its queue.
+
+        For internal use only.
+        """
+        queue = self.queues.get(key)
+        if queue is None:
+            return
+        was_head = queue[0][1] is waiter
+        for i, (_, queued) in enumerate(queue):
+            if queued is waiter:
+                del queue[i]
+                break
+        if was_head:
+            self._cancel_timer(key)
+            self._wake(key)
+
+    def _cancel_timer(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _schedule(self, key):
+        """
+        Arrange to wake the queue when the bucket can satisfy the waiter at
+        its head. Waiters that can never be satisfied are failed.
+
+        For internal use only.
+        """
+        queue = self.queues[key]
+        while queue:
+            tokens, waiter = queue[0]
+            delay = self.collection.time_until(key, tokens)
+            if delay is not None:
+                self.timers[key] = asyncio.get_running_loop().call_later(
+                    delay, self._wake, key)
+                return
+            queue.popleft()
+            if not waiter.done():
+                waiter.set_result(False)
+        del self.queues[key]
+
+    def _wake(self, key):
+        """
+        Grant tokens to as many waiters at the head of the queue as the
+        bucket can now satisfy, then reschedule for the rest.
+
+        For internal use only.
+        """
+        self.timers.pop(key, None)
+        queue = self.queues.get(key)
+        if queue is None:
+            return
+        while queue:
+            tokens, waiter = queue[0]
+            if waiter.done():
+                queue.popleft()
+            elif self.collection.consume(key, tokens):
+                queue.popleft()
+                waiter.set_result(True)
+                self.wakeups += 1
+            else:
+                break
+        self._schedule(key)
+
+    def purge(self):
+        """
+        Purge expired buckets from the collection. Any queue whose bucket
+        was purged is re-evaluated straight away against a fresh bucket.
+        """
+        self.collection.purge()
+        for key in list(self.queues):
+            if key not in self.collection:
+                self._cancel_timer(key)
+                self._wake(key)
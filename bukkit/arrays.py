@@ -0,0 +1,221 @@
+"""
+Keyed collection of token buckets stored as NumPy arrays.
+
+Rather than allocating a `Node` and a `TokenBucket` per key, bucket state is
+kept in contiguous arrays with one slot per live bucket, and a dictionary
+maps each key to its slot. Slots freed by `purge` are reused by new buckets.
+`consume_many` refills every bucket in a batch, and decides requests against
+distinct buckets, with whole-array operations rather than slot by slot.
+
+This module requires NumPy, which is an optional dependency of bukkit.
+"""
+
+import time
+
+import numpy
+
+
+__all__ = (
+    'ArrayCollection',
+)
+
+
+class BucketView(object):
+    """
+    A read-only view onto a single slot of an `ArrayCollection`, exposing
+    the same `ts` and `tokens` attributes as a `TokenBucket`.
+
+    Views are only valid until the bucket they refer to is purged, after
+    which the slot may be reused by another key.
+    """
+
+    __slots__ = (
+        'collection',
+        'slot',
+    )
+
+    def __init__(self, collection, slot):
+        self.collection = collection
+        self.slot = slot
+
+    @property
+    def ts(self):
+        """
+        When the bucket was last refilled.
+        """
+        return self.collection.ts[self.slot]
+
+    @property
+    def tokens(self):
+        """
+        The number of tokens available in the bucket.
+        """
+        return self.collection.refill_slot(self.slot, self.collection.clock())
+
+
+class ArrayCollection(object):
+    """
+    A keyed collection of token buckets with struct-of-arrays storage.
+
+    This has the same interface as `bukkit.bucket.Collection`.
+    """
+
+    __slots__ = (
+        'rate', 'limit',
+        'timeout',
+        'clock',
+        'index', 'keys', 'free',
+        'ts', 'available', 'used',
+    )
+
+    def __init__(self, rate, limit, timeout, clock=time.time, capacity=1024):
+        self.rate = rate
+        self.limit = limit
+        self.timeout = timeout
+        self.clock = clock
+        self.index = {}
+        self.keys = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.ts = numpy.zeros(capacity, dtype=numpy.float64)
+        self.available = numpy.zeros(capacity, dtype=numpy.float64)
+        self.used = numpy.zeros(capacity, dtype=numpy.bool_)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        if key in self.index:
+            return BucketView(self, self.index[key])
+        raise IndexError("No such bucket: '%s'" % key)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _grow(self):
+        """
+        Double the capacity of the slot arrays, or give them a first slot if
+        they have none.
+
+        For internal use only.
+        """
+        capacity = len(self.keys)
+        grown = max(2 * capacity, 1)
+        self.keys.extend([None] * (grown - capacity))
+        self.free.extend(range(grown - 1, capacity - 1, -1))
+        for attr in ('ts', 'available', 'used'):
+            old = getattr(self, attr)
+            new = numpy.zeros(grown, dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, attr, new)
+
+    def _allocate(self, key, ts):
+        """
+        Assign a slot to a new, full bucket.
+
+        For internal use only.
+        """
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.index[key] = slot
+        self.keys[slot] = key
+        self.ts[slot] = ts
+        self.available[slot] = self.limit
+        self.used[slot] = True
+        return slot
+
+    def refill_slot(self, slot, ts):
+        """
+        Bring the bucket in the given slot up to date as of `ts` and return
+        the number of tokens it now holds.
+        """
+        # Python floats, as arithmetic on NumPy scalars is slow.
+        available = self.available.item(slot)
+        if available < self.limit:
+            available += min(
+                (ts - self.ts.item(slot)) * self.rate,
+                self.limit - available)
+            self.available[slot] = available
+        self.ts[slot] = ts
+        return available
+
+    def _refill_slots(self, slots, ts):
+        """
+        Bring the buckets in an array of slots up to date as of `ts`.
+
+        For internal use only.
+        """
+        available = self.available[slots]
+        refilled = numpy.minimum(
+            available + (ts - self.ts[slots]) * self.rate, self.limit)
+        self.available[slots] = numpy.where(
+            available < self.limit, refilled, available)
+        self.ts[slots] = ts
+
+    def consume(self, key, tokens):
+        """
+        Attempt to consume the given number of token in the bucket identified
+        by `key`. Returns `True` if succeeds, otherwise `False`.
+        """
+        ts = self.clock()
+        slot = self.index.get(key)
+        if slot is None:
+            slot = self._allocate(key, ts)
+        if 0 <= tokens <= self.refill_slot(slot, ts):
+            self.available[slot] -= tokens
+            return True
+        return False
+
+    def consume_many(self, pairs):
+        """
+        Attempt to consume tokens from many buckets against a single reading
+        of the clock. `pairs` is an iterable of `(key, tokens)` pairs, and a
+        list of booleans giving the outcome of each is returned.
+        """
+        ts = self.clock()
+        index = self.index
+        slots = []
+        amounts = []
+        for key, tokens in pairs:
+            slot = index.get(key)
+            if slot is None:
+                slot = self._allocate(key, ts)
+            slots.append(slot)
+            amounts.append(tokens)
+        if not slots:
+            return []
+        slots = numpy.array(slots)
+        touched = numpy.unique(slots)
+        self._refill_slots(touched, ts)
+        if len(touched) == len(slots):
+            # Each bucket is asked once, so the requests are independent.
+            amounts = numpy.array(amounts, dtype=numpy.float64)
+            available = self.available[slots]
+            granted = (amounts >= 0) & (amounts <= available)
+            self.available[slots] = available - numpy.where(
+                granted, amounts, 0)
+            return granted.tolist()
+        # Later requests against a bucket depend on the earlier ones.
+        levels = dict(zip(touched.tolist(), self.available[touched].tolist()))
+        results = []
+        for slot, tokens in zip(slots.tolist(), amounts):
+            level = levels[slot]
+            if 0 <= tokens <= level:
+                levels[slot] = level - tokens
+                results.append(True)
+            else:
+                results.append(False)
+        self.available[touched] = [levels[slot] for slot in touched.tolist()]
+        return results
+
+    def purge(self):
+        """
+        Purge all expired buckets, freeing their slots for reuse.
+        """
+        cutoff = self.clock() - self.timeout
+        expired = numpy.flatnonzero(self.used & (self.ts <= cutoff))
+        self.used[expired] = False
+        for slot in expired.tolist():
+            del self.index[self.keys[slot]]
+            self.keys[slot] = None
+            self.free.append(slot)
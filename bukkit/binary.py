@@ -0,0 +1,323 @@
+"""
+Compact binary framing for the bukkit protocol.
+
+A client selects the binary protocol by sending `HANDSHAKE` as the very first
+byte on a connection; otherwise, the text stanza protocol is used. The binary
+protocol carries the same requests and responses as the text protocol, but in
+fixed-layout frames that can be decoded without splitting strings. All
+integers and floats are big-endian.
+
+Requests are a 32-bit body length followed by the body, which starts with an
+opcode byte:
+
+  B: opcode, rate, limit, timeout (doubles), collection length (uint16),
+     collection
+  C: opcode, tokens (double), collection length (uint16), bucket length
+     (uint16), collection, bucket
+  S: opcode, collection length (uint16), collection
+  Q: opcode, collection length (uint16), bucket count (uint16), collection,
+     then for each bucket, its length (uint16) and the bucket
+  H: opcode, tokens (double), level count (uint16), then for each level,
+     collection length (uint16), bucket length (uint16), collection, bucket
+  T: opcode, rate, limit (doubles), collection length (uint16), prefix
+     length (uint16), collection, prefix
+
+Responses are a status byte ('+', '-', '=', or '!'), a 16-bit payload length,
+and the payload. For errors, the payload is the message; for '-', it's the
+number of seconds to wait before retrying, as a double; for '=', it's the
+attributes of the text protocol's '=' response as `<name>=<value>` lines; for
+'+', it's empty.
+"""
+
+import struct
+
+from bukkit.exceptions import ProtocolError
+
+
+__all__ = (
+    'HANDSHAKE',
+    'pack_attrs',
+    'pack_chain',
+    'pack_create',
+    'pack_consume',
+    'pack_denied',
+    'pack_query',
+    'pack_response',
+    'pack_stats',
+    'pack_tier',
+    'read_response',
+    'unpack_request',
+)
+
+
+HANDSHAKE = b"\x00"
+
+OP_CREATE = ord('B')
+OP_CONSUME = ord('C')
+OP_STATS = ord('S')
+OP_QUERY = ord('Q')
+OP_CHAIN = ord('H')
+OP_TIER = ord('T')
+
+LENGTH = struct.Struct('!I')
+_CREATE = struct.Struct('!BdddH')
+_CONSUME = struct.Struct('!BdHH')
+_STATS = struct.Struct('!BH')
+_QUERY = struct.Struct('!BHH')
+_NAME_LENGTH = struct.Struct('!H')
+_CHAIN = struct.Struct('!BdH')
+_LEVEL = struct.Struct('!HH')
+_TIER = struct.Struct('!BddHH')
+_RESPONSE = struct.Struct('!cH')
+_RETRY_AFTER = struct.Struct('!d')
+
+
+def _encode(name):
+    encoded = name.encode('utf-8')
+    if len(encoded) > 0xFFFF:
+        raise ProtocolError("Name too long: '%s...'" % name[:32])
+    return encoded
+
+
+def _decode(view, start, end):
+    try:
+        return str(view[start:end], 'utf-8')
+    except UnicodeDecodeError:
+        raise ProtocolError("Name is not valid UTF-8")
+
+
+def _frame(body):
+    return LENGTH.pack(len(body)) + body
+
+
+def pack_create(rate, limit, timeout, collection):
+    """
+    Build a frame creating a bucket collection.
+    """
+    collection = _encode(collection)
+    return _frame(
+        _CREATE.pack(OP_CREATE, rate, limit, timeout, len(collection)) +
+        collection)
+
+
+def pack_consume(collection, name, tokens):
+    """
+    Build a frame consuming tokens from a bucket.
+    """
+    collection = _encode(collection)
+    name = _encode(name)
+    return _frame(
+        _CONSUME.pack(OP_CONSUME, tokens, len(collection), len(name)) +
+        collection + name)
+
+
+def pack_stats(collection):
+    """
+    Build a frame fetching statistics about a bucket collection.
+    """
+    collection = _encode(collection)
+    return _frame(_STATS.pack(OP_STATS, len(collection)) + collection)
+
+
+def pack_query(collection, names):
+    """
+    Build a frame querying the state of buckets without consuming from them.
+    """
+    collection = _encode(collection)
+    names = [_encode(name) for name in names]
+    if len(names) > 0xFFFF:
+        raise ProtocolError("Too many buckets in one query")
+    return _frame(b"".join(
+        [_QUERY.pack(OP_QUERY, len(collection), len(names)), collection] +
+        [_NAME_LENGTH.pack(len(name)) + name for name in names]))
+
+
+def pack_chain(levels, tokens):
+    """
+    Build a frame consuming tokens from a chain of buckets, given as
+    `(collection, bucket)` pairs.
+    """
+    parts = []
+    for collection, name in levels:
+        collection = _encode(collection)
+        name = _encode(name)
+        parts.append(_LEVEL.pack(len(collection), len(name)))
+        parts.append(collection)
+        parts.append(name)
+    if len(parts) // 3 > 0xFFFF:
+        raise ProtocolError("Too many levels in one chain")
+    return _frame(
+        _CHAIN.pack(OP_CHAIN, tokens, len(parts) // 3) + b"".join(parts))
+
+
+def pack_tier(collection, prefix, rate, limit):
+    """
+    Build a frame defining a tier of buckets in a collection.
+    """
+    collection = _encode(collection)
+    prefix = _encode(prefix)
+    return _frame(
+        _TIER.pack(OP_TIER, rate, limit, len(collection), len(prefix)) +
+        collection + prefix)
+
+
+def pack_response(status, message=b''):
+    """
+    Build a response frame.
+    """
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    if len(message) > 0xFFFF:
+        raise ProtocolError("Response too large")
+    return _RESPONSE.pack(status.encode('ascii'), len(message)) + message
+
+
+def pack_denied(retry_after):
+    """
+    Build a '-' response frame with the number of seconds to wait before
+    retrying.
+    """
+    return pack_response('-', _RETRY_AFTER.pack(retry_after))
+
+
+def pack_attrs(attrs):
+    """
+    Build a '=' response frame carrying a dictionary of attributes.
+    """
+    return pack_response('=', "".join(
+        "%s=%s\n" % (key, value) for key, value in attrs.items()))
+
+
+def read_response(rfile):
+    """
+    Read a response frame from a binary file object, returning the status
+    and attributes in the same form as `bukkit.client._read_stanza`.
+    """
+    header = rfile.read(_RESPONSE.size)
+    if len(header) < _RESPONSE.size:
+        raise ProtocolError("Connection closed mid-response")
+    status, length = _RESPONSE.unpack(header)
+    message = rfile.read(length)
+    if len(message) < length:
+        raise ProtocolError("Connection closed mid-response")
+    status = status.decode('ascii')
+    if status == '!':
+        return status, {'m': message.decode('utf-8')}
+    if status == '-':
+        if length != _RETRY_AFTER.size:
+            raise ProtocolError("Bad retry delay")
+        return status, {'r': _RETRY_AFTER.unpack(message)[0]}
+    if status == '=':
+        stats = {}
+        for line in message.decode('utf-8').splitlines():
+            key, sep, value = line.partition('=')
+            if not sep:
+                raise ProtocolError("'%s' is not an attribute line" % line)
+            stats[key] = value
+        return status, stats
+    if status != '+':
+        raise ProtocolError("'%s' is not recognised" % status)
+    return status, {}
+
+
+def unpack_request(view, start, end):
+    """
+    Decode the body of a request frame occupying `view[start:end]`. Returns
+    `('B', collection, rate, limit, timeout)`,
+    `('C', collection, bucket, tokens)`, `('S', collection)`,
+    `('Q', collection, buckets)`, `('H', levels, tokens)`, where `levels`
+    is a list of `(collection, bucket)` pairs, or
+    `('T', collection, prefix, rate, limit)`.
+    """
+    if end - start < 1:
+        raise ProtocolError("Empty request")
+    opcode = view[start]
+    if opcode == OP_CONSUME:
+        if end - start < _CONSUME.size:
+            raise ProtocolError("Truncated request")
+        _, tokens, collection_len, name_len = _CONSUME.unpack_from(
+            view, start)
+        offset = start + _CONSUME.size
+        if offset + collection_len + name_len != end:
+            raise ProtocolError("Bad request length")
+        split = offset + collection_len
+        return (
+            'C',
+            _decode(view, offset, split),
+            _decode(view, split, end),
+            tokens)
+    if opcode == OP_CREATE:
+        if end - start < _CREATE.size:
+            raise ProtocolError("Truncated request")
+        _, rate, limit, timeout, collection_len = _CREATE.unpack_from(
+            view, start)
+        offset = start + _CREATE.size
+        if offset + collection_len != end:
+            raise ProtocolError("Bad request length")
+        return 'B', _decode(view, offset, end), rate, limit, timeout
+    if opcode == OP_STATS:
+        if end - start < _STATS.size:
+            raise ProtocolError("Truncated request")
+        _, collection_len = _STATS.unpack_from(view, start)
+        offset = start + _STATS.size
+        if offset + collection_len != end:
+            raise ProtocolError("Bad request length")
+        return 'S', _decode(view, offset, end)
+    if opcode == OP_QUERY:
+        if end - start < _QUERY.size:
+            raise ProtocolError("Truncated request")
+        _, collection_len, count = _QUERY.unpack_from(view, start)
+        offset = start + _QUERY.size + collection_len
+        if offset > end:
+            raise ProtocolError("Bad request length")
+        collection = _decode(view, offset - collection_len, offset)
+        names = []
+        for _ in range(count):
+            if offset + _NAME_LENGTH.size > end:
+                raise ProtocolError("Bad request length")
+            (name_len,) = _NAME_LENGTH.unpack_from(view, offset)
+            offset += _NAME_LENGTH.size
+            if offset + name_len > end:
+                raise ProtocolError("Bad request length")
+            names.append(_decode(view, offset, offset + name_len))
+            offset += name_len
+        if offset != end:
+            raise ProtocolError("Bad request length")
+        return 'Q', collection, names
+    if opcode == OP_CHAIN:
+        if end - start < _CHAIN.size:
+            raise ProtocolError("Truncated request")
+        _, tokens, count = _CHAIN.unpack_from(view, start)
+        offset = start + _CHAIN.size
+        levels = []
+        for _ in range(count):
+            if offset + _LEVEL.size > end:
+                raise ProtocolError("Bad request length")
+            collection_len, name_len = _LEVEL.unpack_from(view, offset)
+            offset += _LEVEL.size
+            split = offset + collection_len
+            if split + name_len > end:
+                raise ProtocolError("Bad request length")
+            levels.append((
+                _decode(view, offset, split),
+                _decode(view, split, split + name_len)))
+            offset = split + name_len
+        if offset != end:
+            raise ProtocolError("Bad request length")
+        return 'H', levels, tokens
+    if opcode == OP_TIER:
+        if end - start < _TIER.size:
+            raise ProtocolError("Truncated request")
+        _, rate, limit, collection_len, prefix_len = _TIER.unpack_from(
+            view, start)
+        offset = start + _TIER.size
+        if offset + collection_len + prefix_len != end:
+            raise ProtocolError("Bad request length")
+        split = offset + collection_len
+        return (
+            'T',
+            _decode(view, offset, split),
+            _decode(view, split, end),
+            rate,
+            limit)
+    raise ProtocolError("Opcode %d is not recognised" % opcode)
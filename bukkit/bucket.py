@@ -3,13 +3,333 @@ Keyed collections of token buckets.
 """
 
 
+import asyncio
+import functools
 import time
+import weakref
 
+from bukkit.metrics import Metrics
 
+
+def _acquisition(consume, time_until, clock, ticks_per_second, timeout):
+    """
+    Generator behind the `acquire` methods. It repeatedly attempts to
+    consume tokens, yielding how many seconds to sleep for in between
+    attempts, and returns whether the tokens were acquired before the
+    timeout, in seconds, expired. Sleeps are cut short at the timeout, so
+    that a last attempt is made then.
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = clock() + timeout * ticks_per_second
+    while not consume():
+        wait = time_until()
+        if wait is None:
+            return False
+        if deadline is not None:
+            remaining = (deadline - clock()) / ticks_per_second
+            if remaining <= 0:
+                return False
+            wait = min(wait, remaining)
+        yield wait
+    return True
+
+
+def _acquire(steps):
+    """
+    Drive an acquisition, sleeping the thread in between attempts.
+    """
+    try:
+        while True:
+            time.sleep(next(steps))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _acquire_async(steps):
+    """
+    Drive an acquisition, sleeping the task in between attempts.
+    """
+    try:
+        while True:
+            await asyncio.sleep(next(steps))
+    except StopIteration as stop:
+        return stop.value
+
+
+class Policy(object):
+    """
+    The rate, limit and clock of a `TokenBucket`. Buckets refer to a policy
+    rather than each holding their own copy of its settings, so buckets with
+    the same settings can share one. Policies are treated as immutable, and
+    `Policy.intern` returns the one shared policy for a set of settings.
+    """
+
+    __slots__ = (
+        'rate',
+        'limit',
+        'clock',
+        '__weakref__',
+    )
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, rate, limit, clock=time.time):
+        self.rate = rate
+        self.limit = limit
+        self.clock = clock
+
+    @classmethod
+    def intern(cls, rate, limit, clock=time.time):
+        """
+        The shared policy with the given settings, created if none is in
+        use.
+        """
+        key = (rate, limit, clock)
+        policy = cls._interned.get(key)
+        if policy is None:
+            policy = cls(rate, limit, clock)
+            cls._interned[key] = policy
+        return policy
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Policy) and
+            (self.rate, self.limit, self.clock) ==
+            (other.rate, other.limit, other.clock))
+
+    def __hash__(self):
+        return hash((self.rate, self.limit, self.clock))
+
+    def __reduce__(self):
+        return (Policy.intern, (self.rate, self.limit, self.clock))
+
+
+class PrefixResolver(object):
+    """
+    Resolves keys to policies by prefix, for use as the `resolver` of a
+    `Collection`. The policy of the longest prefix a key starts with is
+    used, and keys matching no prefix are left to the collection's own
+    policy.
+    """
+
+    __slots__ = (
+        'policies',
+        'lengths',
+    )
+
+    def __init__(self, policies=()):
+        self.policies = {}
+        self.lengths = []
+        for prefix, policy in dict(policies).items():
+            self.add(prefix, policy)
+
+    def add(self, prefix, policy):
+        """
+        Resolve keys starting with `prefix` to `policy`, replacing any
+        policy previously given for that prefix.
+        """
+        self.policies[prefix] = policy
+        self.lengths = sorted(
+            set(len(prefix) for prefix in self.policies), reverse=True)
+
+    def __call__(self, key):
+        policies = self.policies
+        for length in self.lengths:
+            policy = policies.get(key[:length])
+            if policy is not None:
+                return policy
+        return None
+
+
+@functools.total_ordering
 class TokenBucket(object):
     """
-    A token bucket.
+    A token bucket. Buckets compare by when they were last used.
+
+    The rate, limit and clock are held in a `Policy`, which is shared
+    between buckets with the same settings. A new bucket starts full as of
+    `ts`, which defaults to the current time.
+    """
+
+    # The clock used when none is given, and how many of its ticks make up
+    # a second.
+    default_clock = staticmethod(time.time)
+    ticks_per_second = 1
+
+    __slots__ = (
+        'policy',
+        'ts',
+        '_available',
+    )
+
+    def __init__(self, rate, limit, clock=time.time, policy=None, ts=None):
+        if policy is None:
+            policy = Policy.intern(rate, limit, clock)
+        self.policy = policy
+        self.ts = policy.clock() if ts is None else ts
+        self._available = policy.limit
+
+    @classmethod
+    def factory(cls, rate, limit, clock):
+        """
+        A callable that creates new buckets sharing one policy. `Collection`
+        uses this to create its buckets.
+        """
+        policy = Policy.intern(rate, limit, clock)
+        return functools.partial(cls, rate, limit, clock, policy)
+
+    @property
+    def rate(self):
+        return self.policy.rate
+
+    @property
+    def limit(self):
+        return self.policy.limit
+
+    @property
+    def clock(self):
+        return self.policy.clock
+
+    def consume(self, tokens):
+        """
+        Attempt to remove the given number of tokens from this bucket. If
+        there are enough tokens in the bucket to fulfil the request, we
+        return `True`, otherwise `False`.
+        """
+        return self.consume_at(tokens, self.policy.clock())
+
+    def consume_at(self, tokens, ts):
+        """
+        Like `consume`, but the bucket is refilled as of the timestamp `ts`
+        rather than by reading the clock. This allows a batch of decisions
+        to be made against a single clock reading.
+        """
+        if 0 <= tokens <= self.refill(ts):
+            self._available -= tokens
+            return True
+        return False
+
+    def refund(self, tokens):
+        """
+        Put back tokens taken from the bucket, such as for a request that
+        went on to be refused elsewhere. The bucket never holds more than
+        its limit.
+        """
+        self._available = min(self._available + tokens, self.policy.limit)
+
+    def refill(self, ts):
+        """
+        Refill the bucket as of the timestamp `ts`, returning the number of
+        tokens it now holds.
+        """
+        policy = self.policy
+        if self._available < policy.limit:
+            self._available += min(
+                (ts - self.ts) * policy.rate,
+                policy.limit - self._available)
+        self.ts = ts
+        return self._available
+
+    def peek(self, ts):
+        """
+        The number of tokens the bucket would hold as of the timestamp `ts`,
+        without refilling it or otherwise changing it.
+        """
+        policy = self.policy
+        if self._available < policy.limit:
+            return self._available + min(
+                (ts - self.ts) * policy.rate,
+                policy.limit - self._available)
+        return self._available
+
+    @property
+    def tokens(self):
+        """
+        The number of tokens available in this bucket.
+        """
+        return self.refill(self.clock())
+
+    def time_until(self, tokens):
+        """
+        The number of seconds until the given number of tokens will be
+        available, or `None` if they never will be. This doesn't change the
+        bucket.
+        """
+        if not 0 <= tokens <= self.limit:
+            return None
+        available = self.peek(self.clock())
+        if tokens <= available:
+            return 0.0
+        if self.rate <= 0:
+            return None
+        return (tokens - available) / self.rate / self.ticks_per_second
+
+    def _acquisition(self, tokens, timeout):
+        return _acquisition(
+            lambda: self.consume(tokens), lambda: self.time_until(tokens),
+            self.clock, self.ticks_per_second, timeout)
+
+    def acquire(self, tokens, timeout=None):
+        """
+        Consume the given number of tokens, sleeping until enough are
+        available, for at most `timeout` seconds in all. Returns `False` if
+        there still aren't enough once the timeout is up, or if there will
+        never be enough, otherwise `True`.
+        """
+        return _acquire(self._acquisition(tokens, timeout))
+
+    async def acquire_async(self, tokens, timeout=None):
+        """
+        Like `acquire`, but sleeps the current task rather than the thread.
+        """
+        return await _acquire_async(self._acquisition(tokens, timeout))
+
+    def __eq__(self, other):
+        return self.ts == other.ts
+
+    def __lt__(self, other):
+        return self.ts < other.ts
+
+    __hash__ = object.__hash__
+
+    def __getstate__(self):
+        return dict(zip(
+            self.__slots__,
+            [getattr(self, attr) for attr in self.__slots__]))
+
+    def __setstate__(self, state):
+        if 'policy' not in state:
+            # Pickled before buckets shared their settings.
+            state = dict(state, policy=Policy.intern(
+                state['rate'], state['limit'], state['clock']))
+        for k in self.__slots__:
+            setattr(self, k, state[k])
+
+
+def _fixed(amount, scale):
+    """
+    Convert an amount to an integer number of units of `1 / scale`.
     """
+    if isinstance(amount, int):
+        return amount * scale
+    return int(round(amount * scale))
+
+
+@functools.total_ordering
+class MonotonicTokenBucket(object):
+    """
+    A token bucket driven by `time.monotonic_ns`, so it's unaffected by
+    adjustments to the wall clock. Token counts are kept as integers in
+    units of `1 / SCALE` of a token, so refilling never accumulates rounding
+    error. Otherwise, it behaves like a `TokenBucket`, though `ts` is in
+    nanoseconds.
+    """
+
+    SCALE = 10 ** 18
+
+    default_clock = staticmethod(time.monotonic_ns)
+    ticks_per_second = 10 ** 9
 
     __slots__ = (
         'clock',
@@ -17,14 +337,19 @@ class TokenBucket(object):
         'rate',
         'limit',
         '_available',
+        '_capacity',
+        '_step',
     )
 
-    def __init__(self, rate, limit, clock=time.time):
+    def __init__(self, rate, limit, clock=time.monotonic_ns, ts=None):
         self.clock = clock
-        self.ts = self.clock()
+        self.ts = self.clock() if ts is None else ts
         self.rate = rate
         self.limit = limit
-        self._available = limit
+        self._capacity = _fixed(limit, self.SCALE)
+        # Units added per nanosecond.
+        self._step = _fixed(rate, self.SCALE // self.ticks_per_second)
+        self._available = self._capacity
 
     def consume(self, tokens):
         """
@@ -32,26 +357,89 @@ class TokenBucket(object):
         there are enough tokens in the bucket to fulfil the request, we
         return `True`, otherwise `False`.
         """
-        if 0 <= tokens <= self.tokens:
-            self._available -= tokens
+        return self.consume_at(tokens, self.clock())
+
+    def consume_at(self, tokens, ts):
+        """
+        Like `consume`, but the bucket is refilled as of the timestamp `ts`.
+        """
+        needed = _fixed(tokens, self.SCALE)
+        if 0 <= needed <= self._refill(ts):
+            self._available -= needed
             return True
         return False
 
+    def refund(self, tokens):
+        """
+        Put back tokens taken from the bucket, as with `TokenBucket.refund`.
+        """
+        self._available = min(
+            self._available + _fixed(tokens, self.SCALE), self._capacity)
+
+    def _refill(self, ts):
+        if self._available < self._capacity:
+            self._available = min(
+                self._available + (ts - self.ts) * self._step,
+                self._capacity)
+        self.ts = ts
+        return self._available
+
+    def refill(self, ts):
+        """
+        Refill the bucket as of the timestamp `ts`, returning the number of
+        tokens it now holds.
+        """
+        return self._refill(ts) / self.SCALE
+
+    def _peek(self, ts):
+        if self._available < self._capacity:
+            return min(
+                self._available + (ts - self.ts) * self._step,
+                self._capacity)
+        return self._available
+
+    def peek(self, ts):
+        """
+        The number of tokens the bucket would hold as of the timestamp `ts`,
+        without refilling it or otherwise changing it.
+        """
+        return self._peek(ts) / self.SCALE
+
     @property
     def tokens(self):
         """
         The number of tokens available in this bucket.
         """
-        ts = self.clock()
-        if self._available < self.limit:
-            self._available += min(
-                (ts - self.ts) * self.rate,
-                self.limit - self._available)
-        self.ts = ts
-        return self._available
+        return self.refill(self.clock())
+
+    def time_until(self, tokens):
+        """
+        The number of seconds until the given number of tokens will be
+        available, or `None` if they never will be. This doesn't change the
+        bucket.
+        """
+        needed = _fixed(tokens, self.SCALE)
+        if not 0 <= needed <= self._capacity:
+            return None
+        available = self._peek(self.clock())
+        if needed <= available:
+            return 0.0
+        if self._step <= 0:
+            return None
+        ticks = -(-(needed - available) // self._step)
+        return ticks / self.ticks_per_second
+
+    _acquisition = TokenBucket._acquisition
+    acquire = TokenBucket.acquire
+    acquire_async = TokenBucket.acquire_async
 
-    def __cmp__(self, other):
-        return cmp(self.ts, other.ts)
+    def __eq__(self, other):
+        return self.ts == other.ts
+
+    def __lt__(self, other):
+        return self.ts < other.ts
+
+    __hash__ = object.__hash__
 
     def __getstate__(self):
         return dict(zip(
@@ -63,6 +451,195 @@ class TokenBucket(object):
             setattr(self, k, state[k])
 
 
+class GCRAParams(object):
+    """
+    The settings shared by every `GCRABucket` with the same rate, limit and
+    clock. As with `Policy`, `GCRAParams.intern` returns the one shared
+    instance for a set of settings.
+
+    For internal use only.
+    """
+
+    __slots__ = (
+        'rate',
+        'limit',
+        'clock',
+        'interval',
+        'tolerance',
+        '__weakref__',
+    )
+
+    _interned = weakref.WeakValueDictionary()
+
+    def __init__(self, rate, limit, clock):
+        if rate <= 0:
+            raise ValueError("GCRA needs a positive rate")
+        self.rate = rate
+        self.limit = limit
+        self.clock = clock
+        # Seconds each token takes to be replaced, and how far ahead of now
+        # the theoretical arrival time may run: the burst allowance.
+        self.interval = 1.0 / rate
+        self.tolerance = limit * self.interval
+
+    @classmethod
+    def intern(cls, rate, limit, clock):
+        """
+        The shared settings with the given rate, limit and clock, created if
+        none are in use.
+        """
+        key = (rate, limit, clock)
+        params = cls._interned.get(key)
+        if params is None:
+            params = cls(rate, limit, clock)
+            cls._interned[key] = params
+        return params
+
+    def __reduce__(self):
+        return (GCRAParams.intern, (self.rate, self.limit, self.clock))
+
+
+@functools.total_ordering
+class GCRABucket(object):
+    """
+    A rate limiter using the generic cell rate algorithm, which makes the
+    same decisions as a `TokenBucket` but decides them from a single
+    number: the theoretical arrival time at which the bucket would next be
+    full. A request for tokens is allowed if the arrival time it would push
+    forward stays within the burst allowance of the current time, so no
+    refilling is needed.
+
+    The rate, limit and clock are held in a `GCRAParams` object, which
+    buckets with the same settings share. The rate must be positive.
+
+    The arrival time is never behind the bucket's last use, and never more
+    than `limit / rate` seconds ahead of it, so it stands in for the last
+    use as `ts`, which a collection goes by to expire its buckets. Buckets
+    thus expire once they've been full for the timeout, which is at most
+    `limit / rate` seconds later than they would otherwise.
+    """
+
+    default_clock = staticmethod(time.time)
+    ticks_per_second = 1
+
+    __slots__ = (
+        'params',
+        '_tat',
+    )
+
+    def __init__(self, rate, limit, clock=time.time, params=None, ts=None):
+        if params is None:
+            params = GCRAParams.intern(rate, limit, clock)
+        self.params = params
+        self._tat = params.clock() if ts is None else ts
+
+    @classmethod
+    def factory(cls, rate, limit, clock):
+        """
+        A callable that creates new buckets sharing one set of settings.
+        `Collection` uses this to create its buckets.
+        """
+        params = GCRAParams.intern(rate, limit, clock)
+        return functools.partial(cls, rate, limit, clock, params)
+
+    @property
+    def ts(self):
+        return self._tat
+
+    @property
+    def rate(self):
+        return self.params.rate
+
+    @property
+    def limit(self):
+        return self.params.limit
+
+    @property
+    def clock(self):
+        return self.params.clock
+
+    def consume(self, tokens):
+        """
+        Attempt to remove the given number of tokens from this bucket. If
+        there are enough tokens in the bucket to fulfil the request, we
+        return `True`, otherwise `False`.
+        """
+        return self.consume_at(tokens, self.params.clock())
+
+    def consume_at(self, tokens, ts):
+        """
+        Like `consume`, but as of the timestamp `ts`.
+        """
+        params = self.params
+        tat = self._tat
+        if tat < ts:
+            # The bucket's full. Even a refused request counts as a use, so
+            # bring the arrival time up to now either way.
+            tat = self._tat = ts
+        tat += tokens * params.interval
+        if tokens >= 0 and tat - ts <= params.tolerance:
+            self._tat = tat
+            return True
+        return False
+
+    def refund(self, tokens):
+        """
+        Put back tokens taken from the bucket, as with `TokenBucket.refund`.
+        An arrival time in the past already means a full bucket, so this
+        needs no cap.
+        """
+        self._tat -= tokens * self.params.interval
+
+    def peek(self, ts):
+        """
+        The number of tokens the bucket holds as of the timestamp `ts`.
+        """
+        params = self.params
+        return params.limit - max(self._tat - ts, 0) * params.rate
+
+    refill = peek
+
+    @property
+    def tokens(self):
+        """
+        The number of tokens available in this bucket.
+        """
+        return self.peek(self.params.clock())
+
+    def time_until(self, tokens):
+        """
+        The number of seconds until the given number of tokens will be
+        available, or `None` if they never will be. This doesn't change the
+        bucket.
+        """
+        params = self.params
+        if not 0 <= tokens <= params.limit:
+            return None
+        now = params.clock()
+        wait = (max(self._tat, now) + tokens * params.interval -
+                now - params.tolerance)
+        return max(wait, 0.0)
+
+    _acquisition = TokenBucket._acquisition
+    acquire = TokenBucket.acquire
+    acquire_async = TokenBucket.acquire_async
+
+    def __eq__(self, other):
+        return self._tat == other._tat
+
+    def __lt__(self, other):
+        return self._tat < other._tat
+
+    __hash__ = object.__hash__
+
+    def __getstate__(self):
+        return {'params': self.params, 'tat': self._tat}
+
+    def __setstate__(self, state):
+        self.params = state['params']
+        self._tat = state['tat']
+
+
 class Node(object):
     """
     Linked list node.
@@ -149,6 +726,30 @@ class Node(object):
 class Collection(object):
     """
     A keyed collection of token buckets.
+
+    Expired buckets are only removed when `purge` is called, unless
+    `purge_step` is given, in which case each call to `consume` also evicts
+    up to that many expired buckets from the tail of the cache. If
+    `max_buckets` is given, the least recently used bucket is evicted
+    whenever a new bucket would exceed that cap. The `expired` and
+    `evicted` counters record how many buckets were removed for having
+    expired and for exceeding the cap respectively.
+
+    Buckets are instances of `bucket_class`, which may be `TokenBucket`,
+    `MonotonicTokenBucket` or `GCRABucket`. The clock defaults to that of
+    `bucket_class`, and `timeout` is always in seconds.
+
+    If `metrics` is true, the collection also counts the requests it allows
+    and denies, the buckets it creates, and how long full purges take, in a
+    `bukkit.metrics.Metrics` object. `stats` summarises all of these.
+
+    Keys can be given different rates and limits, such as for free and paid
+    tiers, by passing a `resolver`: a callable that's given the key of each
+    new bucket and returns the `Policy` it should use, or `None` for the
+    collection's own `rate` and `limit`. Policies should use the collection's
+    clock; `policy` makes them. Every tier shares the one cache order and
+    purge, and expires after the same `timeout`. Resolvers need
+    `TokenBucket` buckets.
     """
 
     __slots__ = (
@@ -156,18 +757,35 @@ class Collection(object):
         'rate', 'limit',
         'timeout',
         'clock',
+        'bucket_class', 'new_bucket',
+        'resolver',
+        'purge_step', 'max_buckets',
+        'expired', 'evicted',
+        'metrics',
     )
 
-    def __init__(self, rate, limit, timeout, clock=time.time):
+    def __init__(self, rate, limit, timeout, clock=None,
+                 purge_step=0, max_buckets=None, bucket_class=TokenBucket,
+                 metrics=False, resolver=None):
         self.head_node = Node(None)
         self.tail_node = Node(None)
         self.tail_node.insert_after(self.head_node)
         self.node_map = {}
         self.key_map = {}
+        if resolver is not None and bucket_class is not TokenBucket:
+            raise ValueError("Resolvers need TokenBucket buckets")
         self.rate = rate
         self.limit = limit
         self.timeout = timeout
-        self.clock = clock
+        self.clock = bucket_class.default_clock if clock is None else clock
+        self.bucket_class = bucket_class
+        self.new_bucket = self._factory()
+        self.resolver = resolver
+        self.purge_step = purge_step
+        self.max_buckets = max_buckets
+        self.expired = 0
+        self.evicted = 0
+        self.metrics = Metrics() if metrics else None
 
     def __del__(self):
         node = self.tail_node.next_node
@@ -189,25 +807,140 @@ class Collection(object):
             return self.node_map[key].obj
         raise IndexError("No such bucket: '%s'" % key)
 
-    def _detach(self, key):
+    def __len__(self):
+        return len(self.node_map)
+
+    def _lookup(self, key, ts=None):
         """
-        Detach the named token bucket from the collection for order cache
-        order reassignment. It will also create a new token bucket if none
-        match the name given in `key`.
+        Fetch the node for the named token bucket, creating a new token
+        bucket if none match the name given in `key`. A new bucket starts
+        as of `ts`, if given, rather than reading the clock.
 
         For internal use only.
         """
-        node = self.node_map[key] if key in self.node_map else None
+        node = self.node_map.get(key)
         if node is None:
-            node = Node(
-                TokenBucket(
-                    rate=self.rate, limit=self.limit, clock=self.clock))
+            if (self.max_buckets is not None and
+                    len(self.node_map) >= self.max_buckets):
+                self._evict_lru()
+            if self.resolver is None:
+                node = Node(self.new_bucket(ts=ts))
+            else:
+                node = Node(self._resolved_bucket(key, ts))
             self.node_map[key] = node
             self.key_map[node] = key
-        else:
-            node.detach()
+            if self.metrics is not None:
+                self.metrics.created += 1
         return node
 
+    def policy(self, rate, limit):
+        """
+        The shared policy with the given rate and limit and the collection's
+        clock, for a `resolver` to return.
+        """
+        return Policy.intern(rate, limit, self.clock)
+
+    def _resolved_bucket(self, key, ts=None):
+        """
+        Create a bucket using the policy the resolver gives for `key`.
+
+        For internal use only.
+        """
+        policy = self.resolver(key)
+        if policy is None:
+            return self.new_bucket(ts=ts)
+        return TokenBucket(policy.rate, policy.limit, policy=policy, ts=ts)
+
+    def _limit_for(self, key):
+        """
+        The limit a new bucket for `key` would have.
+
+        For internal use only.
+        """
+        if self.resolver is not None:
+            policy = self.resolver(key)
+            if policy is not None:
+                return policy.limit
+        return self.limit
+
+    def _factory(self):
+        """
+        Build the callable used to create new buckets. Bucket classes may
+        provide a `factory` class method to share state between buckets.
+
+        For internal use only.
+        """
+        factory = getattr(self.bucket_class, 'factory', None)
+        if factory is not None:
+            return factory(self.rate, self.limit, self.clock)
+        return functools.partial(
+            self.bucket_class,
+            rate=self.rate, limit=self.limit, clock=self.clock)
+
+    def _detach(self, key, ts=None):
+        """
+        Detach the named token bucket from the collection for order cache
+        order reassignment. It will also create a new token bucket if none
+        match the name given in `key`, as of `ts` if given.
+
+        For internal use only.
+        """
+        node = self._lookup(key, ts)
+        node.detach()
+        return node
+
+    def _remove(self, node):
+        """
+        Remove a node from the cache and forget its key.
+
+        For internal use only.
+        """
+        node.detach()
+        if node in self.key_map:
+            key = self.key_map[node]
+            del self.key_map[node]
+            del self.node_map[key]
+
+    def _evict_lru(self):
+        """
+        Evict the least recently used bucket to make room for a new one.
+
+        For internal use only.
+        """
+        node = self.tail_node.next_node
+        if node is not self.head_node:
+            self._remove(node)
+            self.evicted += 1
+
+    def _cutoff(self, ts):
+        """
+        The time at or before which a bucket last used has expired, given
+        the current time `ts`.
+
+        For internal use only.
+        """
+        return ts - self.timeout * self.bucket_class.ticks_per_second
+
+    def _purge(self, limit, max_nodes=None):
+        """
+        Remove buckets last used at or before `limit` from the tail of the
+        cache, stopping after `max_nodes` if given. Returns the number of
+        buckets removed.
+
+        For internal use only.
+        """
+        removed = 0
+        node = self.tail_node.next_node
+        while node is not self.head_node and node.obj.ts <= limit:
+            if max_nodes is not None and removed >= max_nodes:
+                break
+            next_node = node.next_node
+            self._remove(node)
+            removed += 1
+            node = next_node
+        self.expired += removed
+        return removed
+
     def _move_to_head(self, node):
         """
         Attach the named token bucket at the head of the cache.
@@ -222,23 +955,111 @@ class Collection(object):
         node = self._detach(key)
         result = node.obj.consume(tokens)
         self._move_to_head(node)
+        if self.purge_step:
+            self._purge(self._cutoff(self.clock()), self.purge_step)
+        if self.metrics is not None:
+            if result:
+                self.metrics.allowed += 1
+            else:
+                self.metrics.denied += 1
         return result
 
+    def consume_many(self, pairs):
+        """
+        Attempt to consume tokens from many buckets at once. `pairs` is an
+        iterable of `(key, tokens)` pairs, and a list of booleans is
+        returned giving the outcome of each, in order.
+
+        Every decision is made against a single reading of the clock, and a
+        key may appear more than once, in which case each attempt sees the
+        tokens left by the previous one. Each attempt moves its bucket to
+        the head of the cache as it's made, so `max_buckets` is enforced,
+        and evictions chosen, just as with a series of calls to `consume`.
+        """
+        ts = self.clock()
+        results = []
+        for key, tokens in pairs:
+            node = self._detach(key, ts)
+            results.append(node.obj.consume_at(tokens, ts))
+            self._move_to_head(node)
+        if self.purge_step:
+            self._purge(self._cutoff(ts), self.purge_step)
+        if self.metrics is not None:
+            allowed = sum(results)
+            self.metrics.allowed += allowed
+            self.metrics.denied += len(results) - allowed
+        return results
+
+    def time_until(self, key, tokens):
+        """
+        The number of seconds until the given number of tokens will be
+        available in the bucket identified by `key`, or `None` if they never
+        will be. This doesn't count as a use of the bucket.
+        """
+        if key in self.node_map:
+            return self.node_map[key].obj.time_until(tokens)
+        return 0.0 if 0 <= tokens <= self._limit_for(key) else None
+
+    def peek(self, key):
+        """
+        The number of tokens available in the bucket identified by `key`,
+        and when it was last used, as a tuple. A bucket that doesn't exist
+        would be full, and its last use is `None`. For a `GCRABucket`, its
+        arrival time stands in for its last use. This neither changes the
+        bucket nor counts as a use of it.
+        """
+        node = self.node_map.get(key)
+        if node is None:
+            return self._limit_for(key), None
+        bucket = node.obj
+        return bucket.peek(self.clock()), bucket.ts
+
+    def _acquisition(self, key, tokens, timeout):
+        return _acquisition(
+            lambda: self.consume(key, tokens),
+            lambda: self.time_until(key, tokens),
+            self.clock, self.bucket_class.ticks_per_second, timeout)
+
+    def acquire(self, key, tokens, timeout=None):
+        """
+        Consume the given number of tokens from the bucket identified by
+        `key`, sleeping until enough are available, for at most `timeout`
+        seconds in all. Returns `False` if there still aren't enough once
+        the timeout is up, or if there will never be enough, otherwise
+        `True`.
+        """
+        return _acquire(self._acquisition(key, tokens, timeout))
+
+    async def acquire_async(self, key, tokens, timeout=None):
+        """
+        Like `acquire`, but sleeps the current task rather than the thread.
+        """
+        return await _acquire_async(self._acquisition(key, tokens, timeout))
+
     def purge(self):
         """
         Purge all expired buckets.
         """
-        limit = self.clock() - self.timeout
-        node = self.tail_node.next_node
-        while node is not self.head_node and node.obj.ts <= limit:
-            next_node = node.next_node
-            node.detach()
-            if node in self.key_map:
-                key = self.key_map[node]
-                del self.key_map[node]
-                del self.node_map[key]
-            del node
-            node = next_node
+        if self.metrics is None:
+            self._purge(self._cutoff(self.clock()))
+        else:
+            started = time.perf_counter()
+            self._purge(self._cutoff(self.clock()))
+            self.metrics.record_purge(time.perf_counter() - started)
+
+    def stats(self):
+        """
+        Summarise the collection: the number of live buckets, how many have
+        been expired and evicted, and its metrics, if any.
+        """
+        result = {
+            'buckets': len(self.node_map),
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
+        if self.metrics is not None:
+            result.update(self.metrics.as_dict())
+        return result
 
     def __getstate__(self):
         buckets = []
@@ -251,12 +1072,25 @@ class Collection(object):
             'limit': self.limit,
             'timeout': self.timeout,
             'clock': self.clock,
+            'bucket_class': self.bucket_class,
+            'resolver': self.resolver,
+            'purge_step': self.purge_step,
+            'max_buckets': self.max_buckets,
+            'metrics': self.metrics is not None,
             'buckets': buckets,
         }
 
     def __setstate__(self, state):
         for k in ('rate', 'limit', 'timeout', 'clock'):
             setattr(self, k, state[k])
+        self.bucket_class = state.get('bucket_class', TokenBucket)
+        self.purge_step = state.get('purge_step', 0)
+        self.max_buckets = state.get('max_buckets')
+        self.new_bucket = self._factory()
+        self.resolver = state.get('resolver')
+        self.expired = 0
+        self.evicted = 0
+        self.metrics = Metrics() if state.get('metrics') else None
         self.head_node = Node(None)
         self.tail_node = Node(None)
         self.tail_node.insert_after(self.head_node)
@@ -267,3 +1101,57 @@ class Collection(object):
             self.node_map[k] = node
             self.key_map[node] = k
             node.insert_after(self.head_node)
+
+
+def consume_chain(levels, tokens):
+    """
+    Atomically consume the given number of tokens from each of a chain of
+    buckets, such as a user's, their tenant's, and a global one. `levels`
+    is an iterable of `(collection, key)` pairs. Returns `True` if every
+    bucket had enough tokens, in which case they're taken from all of them,
+    otherwise `False`, in which case none are taken.
+
+    Each attempt counts as a use of every bucket in the chain. Should one
+    bucket be short, the tokens already taken from those before it are
+    refunded. Every bucket is looked up before any are consumed from, each
+    moving to the head of its cache as it's found, so a collection's
+    `max_buckets` evicts other buckets to make room for the chain's. A
+    `ValueError` is raised, with nothing consumed, if a collection can't
+    hold all of the chain's buckets at once. Collections with a
+    `purge_step` purge just as they do on `consume`.
+    """
+    levels = list(levels)
+    resolved = []
+    for collection, key in levels:
+        ts = collection.clock()
+        node = collection._detach(key, ts)
+        collection._move_to_head(node)
+        resolved.append((node, ts))
+    for (collection, _), (node, _) in zip(levels, resolved):
+        if node not in collection.key_map:
+            raise ValueError("Too many buckets in the chain for max_buckets")
+
+    taken = []
+    result = True
+    for node, ts in resolved:
+        bucket = node.obj
+        if not result:
+            # Consuming nothing still refills the bucket and marks it used.
+            bucket.consume_at(0, ts)
+        elif bucket.consume_at(tokens, ts):
+            taken.append(bucket)
+        else:
+            result = False
+    if not result:
+        for bucket in taken:
+            bucket.refund(tokens)
+
+    for (collection, _), (_, ts) in zip(levels, resolved):
+        if collection.purge_step:
+            collection._purge(collection._cutoff(ts), collection.purge_step)
+        if collection.metrics is not None:
+            if result:
+                collection.metrics.allowed += 1
+            else:
+                collection.metrics.denied += 1
+    return result
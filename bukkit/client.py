@@ -1,69 +1,856 @@
 """
+Client for the bukkit server.
 """
 
+import contextlib
+import queue
 import socket
+import threading
+import time
+
+from bukkit import binary as _binary
+from bukkit.exceptions import ProtocolError
+from bukkit.ring import HashRing
 
 
 __all__ = (
     'ProtocolError',
     'Client',
+    'ClientPool',
+    'MultiClient',
+    'Pipeline',
 )
 
 
-class ProtocolError(Exception):
+_RESPS = {
+    # Success.
+    '+': [],
+    # Action failed without an error, e.g. bucket exhausted; 'r' attribute
+    # contains the number of seconds to wait before retrying.
+    # -;r=<seconds>
+    '-': ['r'],
+    # Error; 'm' attribute contains error message.
+    # !;m=<msg>
+    '!': ['m'],
+    # Data, such as statistics or the results of a query; any number of
+    # attributes, each a named number.
+    # =;<name>=<value>;...
+    '=': None,
+}
+
+
+def _read_stanza(rfile, allowed):
     """
+    Read a single stanza, up to and including its terminating blank line,
+    from a binary file object.
     """
+    lines = []
+    while True:
+        line = rfile.readline()
+        if line == b"":
+            raise ProtocolError("Connection closed mid-stanza")
+        if line == b"\n":
+            break
+        lines.append(line)
+    return _parse_stanza(b"".join(lines)[:-1], allowed)
 
 
-def _read_stanza(rfile, allowed):
-    stanza_type = rfile.readline().rstrip("\n")
+def _parse_stanza(data, allowed):
+    """
+    Parse a complete stanza, less its terminating blank line, into its type
+    and a dictionary of its attributes. Every attribute the stanza type
+    allows must be present. If the allowed attributes are `None`, any are
+    accepted.
+    """
+    try:
+        lines = data.decode('utf-8').split("\n")
+    except UnicodeDecodeError:
+        raise ProtocolError("Stanza is not valid UTF-8")
+    stanza_type = lines[0]
     if stanza_type not in allowed:
         raise ProtocolError("'%s' is not recognised" % stanza_type)
 
     attrs = allowed[stanza_type]
     collected = {}
-    for line in rfile:
-        line = line.rstrip("\n")
-        if len(line) == 0:
-            break
-        if len(collected) > len(attrs):
+    for line in lines[1:]:
+        if attrs is not None and len(collected) >= len(attrs):
             raise ProtocolError("Too many attributes; max is %d" % len(attrs))
-        parts = line.split(1, '=')
+        parts = line.split('=', 1)
         if len(parts) != 2:
             raise ProtocolError("'%s' is not an attribute line" % line)
         key, value = parts
         if key in collected:
             raise ProtocolError("'%s' provided multiple times" % key)
-        if key not in attrs:
+        if attrs is not None and key not in attrs:
             raise ProtocolError("'%s' is not a valid attribute" % key)
         collected[key] = value
+    for key in attrs or ():
+        if key not in collected:
+            raise ProtocolError("'%s' is missing" % key)
 
-    return stanza_type, attrs
+    return stanza_type, collected
 
 
 def _build_stanza(stanza_type, attrs=None):
     if attrs is None:
         attrs = {}
-    return "\n".join(
+    return ("\n".join(
         [stanza_type] +
-        [key + '=' + value for key, value in attrs.iteritems()]) + "\n\n"
+        [key + '=' + str(value) for key, value in attrs.items()]) +
+        "\n\n").encode('utf-8')
+
+
+def _check(stanza_type, attrs):
+    """
+    Turn a response into whether the request succeeded and how many seconds
+    to wait before retrying, raising any error it carries.
+    """
+    if stanza_type == '!':
+        raise ProtocolError(attrs['m'])
+    if stanza_type == '+':
+        return True, 0.0
+    return False, float(attrs['r'])
+
+
+def _stat_value(value):
+    """
+    Parse a statistic, which is an integer if it can be.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        raise ProtocolError("'%s' is not a number" % value)
+
+
+def _acquire(try_consume, timeout):
+    """
+    Repeatedly attempt to consume tokens, sleeping for as long as the
+    server says to in between attempts, but no later than the timeout, when
+    a last attempt is made.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        succeeded, retry_after = try_consume()
+        if succeeded:
+            return True
+        if retry_after == float('inf'):
+            return False
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            retry_after = min(retry_after, remaining)
+        time.sleep(retry_after)
+
+
+class _DatagramBuffer(object):
+    """
+    Buffers binary frames bound for a server's datagram socket, sending
+    them as one datagram once adding another would take it past `max_size`
+    bytes, or `flush_interval` seconds after the first was buffered.
+
+    The socket doesn't block: if the server has fallen so far behind that
+    its socket's buffer is full, the datagram is dropped rather than
+    holding up the caller, and its frames are counted in `dropped`.
+
+    For internal use only.
+    """
+
+    __slots__ = (
+        'path',
+        'sock',
+        'max_size',
+        'flush_interval',
+        'frames',
+        'size',
+        'timer',
+        'lock',
+        'dropped',
+    )
+
+    def __init__(self, path, max_size, flush_interval):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.frames = []
+        self.size = 0
+        self.timer = None
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, frame):
+        """
+        Buffer a frame, sending what's already buffered first if there's no
+        room left for it.
+        """
+        with self.lock:
+            if self.frames and self.size + len(frame) > self.max_size:
+                self._send()
+            self.frames.append(frame)
+            self.size += len(frame)
+            if self.timer is None and self.flush_interval is not None:
+                self.timer = threading.Timer(
+                    self.flush_interval, self._flush_quietly)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _send(self):
+        """
+        Send the buffered frames. The lock must be held.
+
+        For internal use only.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.frames:
+            frames = self.frames
+            self.frames = []
+            self.size = 0
+            try:
+                self.sock.sendto(b"".join(frames), self.path)
+            except BlockingIOError:
+                self.dropped += len(frames)
+
+    def flush(self):
+        """
+        Send any buffered frames now.
+        """
+        with self.lock:
+            self._send()
+
+    def _flush_quietly(self):
+        # Nobody's waiting on a flush from the timer to hear how it went,
+        # and losing the odd batch is the point of sending datagrams.
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Send any buffered frames and close the socket.
+        """
+        try:
+            self.flush()
+        finally:
+            self.sock.close()
 
 
 class Client(object):
+    """
+    A connection to a bukkit server listening on a Unix socket. If `binary`
+    is true, the compact binary protocol is used rather than the text one.
+
+    If `datagram_path` is given, `charge` sends consume requests, without
+    waiting for replies, to the server's datagram socket at that path. They
+    are buffered and sent together once `max_datagram` bytes have built up
+    or `flush_interval` seconds after the first, whichever is sooner. They
+    are never waited on: any the server has no room for are dropped, and
+    counted by `dropped`.
+    """
 
-    __all__ = (
+    __slots__ = (
         'sock',
+        'rfile',
+        'binary',
+        'datagrams',
     )
 
-    def __init__(self, path):
+    def __init__(self, path, binary=False, datagram_path=None,
+                 max_datagram=8192, flush_interval=0.05):
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+        self.binary = binary
+        if binary:
+            self.sock.sendall(_binary.HANDSHAKE)
+        self.datagrams = None
+        if datagram_path is not None:
+            self.datagrams = _DatagramBuffer(
+                datagram_path, max_datagram, flush_interval)
+
+    def close(self):
+        """
+        Close the connection, first sending any buffered charges.
+        """
+        try:
+            if self.datagrams is not None:
+                self.datagrams.close()
+        finally:
+            self.rfile.close()
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _create_request(self, rate, limit, timeout, collection):
+        if self.binary:
+            return _binary.pack_create(rate, limit, timeout, collection)
+        return _build_stanza(
+            'B', {'r': rate, 'l': limit, 't': timeout, 'c': collection})
+
+    def _tier_request(self, collection, prefix, rate, limit):
+        if self.binary:
+            return _binary.pack_tier(collection, prefix, rate, limit)
+        return _build_stanza(
+            'T', {'c': collection, 'p': prefix, 'r': rate, 'l': limit})
+
+    def _consume_request(self, collection, name, tokens):
+        if self.binary:
+            return _binary.pack_consume(collection, name, tokens)
+        return _build_stanza('C', {'c': collection, 'b': name, 't': tokens})
+
+    def _chain_request(self, levels, tokens):
+        if self.binary:
+            return _binary.pack_chain(levels, tokens)
+        attrs = {'t': tokens}
+        for i, (collection, name) in enumerate(levels):
+            attrs['c.%d' % i] = collection
+            attrs['b.%d' % i] = name
+        return _build_stanza('H', attrs)
+
+    def _stats_request(self, collection):
+        if self.binary:
+            return _binary.pack_stats(collection)
+        return _build_stanza('S', {'c': collection})
+
+    def _query_request(self, collection, names):
+        if self.binary:
+            return _binary.pack_query(collection, names)
+        attrs = {'c': collection}
+        for i, name in enumerate(names):
+            attrs['b.%d' % i] = name
+        return _build_stanza('Q', attrs)
+
+    def _read_stanza(self):
+        """
+        Read a single response as its type and attributes.
+        """
+        if self.binary:
+            return _binary.read_response(self.rfile)
+        return _read_stanza(self.rfile, _RESPS)
+
+    def _read_response(self):
+        """
+        Read a single response, returning whether the request succeeded and
+        how long to wait before retrying.
+        """
+        return _check(*self._read_stanza())
+
+    def _request(self, request):
+        """
+        Send a request and wait for the response.
+        """
+        self.sock.sendall(request)
+        return self._read_response()
+
+    def create(self, rate, limit, timeout, collection):
+        """
+        Create a bucket collection, replacing any of the same name.
+        """
+        self._request(
+            self._create_request(rate, limit, timeout, collection))
+
+    def define_tier(self, collection, prefix, rate, limit):
+        """
+        Give buckets created from now on in the named collection whose names
+        start with `prefix` their own rate and limit.
+        """
+        self._request(self._tier_request(collection, prefix, rate, limit))
+
+    def consume(self, collection, name, tokens):
+        """
+        Attempt to consume tokens from the named bucket in the named
+        collection. Returns `True` if succeeds, otherwise `False`.
+        """
+        return self.try_consume(collection, name, tokens)[0]
+
+    def try_consume(self, collection, name, tokens):
+        """
+        Attempt to consume tokens from the named bucket in the named
+        collection. Returns whether the attempt succeeded and, if not, how
+        many seconds until it would, which is infinite if it never will.
+        """
+        return self._request(self._consume_request(collection, name, tokens))
+
+    def acquire(self, collection, name, tokens, timeout=None):
+        """
+        Consume tokens from the named bucket in the named collection,
+        sleeping until enough are available, for at most `timeout` seconds
+        in all. Returns `False` if there still aren't enough once the
+        timeout is up, or if there will never be enough, otherwise `True`.
+        """
+        return _acquire(
+            lambda: self.try_consume(collection, name, tokens), timeout)
+
+    def consume_chain(self, levels, tokens):
+        """
+        Attempt to consume tokens from every bucket in a chain, given as
+        `(collection, name)` pairs. The tokens are only taken if every
+        bucket has enough. Returns `True` if succeeds, otherwise `False`.
+        """
+        return self.try_consume_chain(levels, tokens)[0]
+
+    def try_consume_chain(self, levels, tokens):
+        """
+        Like `consume_chain`, but also returns how many seconds until the
+        attempt would succeed, as with `try_consume`.
+        """
+        return self._request(self._chain_request(levels, tokens))
+
+    def charge(self, collection, name, tokens):
+        """
+        Consume tokens from the named bucket in the named collection without
+        waiting to hear whether there were enough. The request is buffered
+        and sent over the datagram socket, so it may be delayed or, if the
+        server is overwhelmed, dropped.
+        """
+        if self.datagrams is None:
+            raise ValueError("No datagram socket given")
+        self.datagrams.add(_binary.pack_consume(collection, name, tokens))
+
+    def flush(self):
+        """
+        Send any buffered charges now.
+        """
+        if self.datagrams is not None:
+            self.datagrams.flush()
+
+    @property
+    def dropped(self):
+        """
+        The number of charges dropped because the server had no room for
+        them.
+        """
+        return 0 if self.datagrams is None else self.datagrams.dropped
 
-    def _send(self, cmd, attrs):
-        self.sock.sendall(_build_stanza(cmd, attrs))
+    def _data_request(self, request):
+        """
+        Send a request answered with a '=' response, and return the
+        response's attributes as numbers.
+        """
+        self.sock.sendall(request)
+        stanza_type, attrs = self._read_stanza()
+        if stanza_type == '!':
+            raise ProtocolError(attrs['m'])
+        if stanza_type != '=':
+            raise ProtocolError("Unexpected '%s' response" % stanza_type)
+        return dict((key, _stat_value(value)) for key, value in attrs.items())
+
+    def stats(self, collection):
+        """
+        Fetch statistics about the named collection, and the server's
+        request latencies if it's collecting metrics, as a dictionary.
+        """
+        return self._data_request(self._stats_request(collection))
+
+    def query(self, collection, names):
+        """
+        Fetch the state of the named buckets in the named collection
+        without consuming from them. Returns a list with a tuple for each
+        bucket giving the tokens available in it and when it was last used,
+        which is `None` if the bucket doesn't exist yet.
+        """
+        names = list(names)
+        attrs = self._data_request(self._query_request(collection, names))
+        return [
+            (attrs['a.%d' % i], attrs.get('s.%d' % i))
+            for i in range(len(names))]
+
+    def peek(self, collection, name):
+        """
+        Fetch the state of a single bucket, as with `query`.
+        """
+        return self.query(collection, [name])[0]
+
+    def pipeline(self):
+        """
+        Start a pipeline for sending many requests in one go.
+        """
+        return Pipeline(self)
+
+
+class Pipeline(object):
+    """
+    Queues up requests and sends them to the server together, reading all
+    the responses back in one go. Used as a context manager, the requests
+    are sent on leaving the block and the outcomes left in `results`::
+
+        with client.pipeline() as pipe:
+            for name in names:
+                pipe.consume('users', name, 1)
+        allowed = pipe.results
+    """
+
+    __slots__ = (
+        'client',
+        'requests',
+        'results',
+    )
+
+    def __init__(self, client):
+        self.client = client
+        self.requests = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def create(self, rate, limit, timeout, collection):
+        """
+        Queue up the creation of a bucket collection.
+        """
+        self.requests.append(self.client._create_request(
+            rate, limit, timeout, collection))
+
+    def define_tier(self, collection, prefix, rate, limit):
+        """
+        Queue up the definition of a tier of buckets.
+        """
+        self.requests.append(self.client._tier_request(
+            collection, prefix, rate, limit))
+
+    def consume(self, collection, name, tokens):
+        """
+        Queue up an attempt to consume tokens from a bucket.
+        """
+        self.requests.append(self.client._consume_request(
+            collection, name, tokens))
+
+    def consume_chain(self, levels, tokens):
+        """
+        Queue up an attempt to consume tokens from a chain of buckets.
+        """
+        self.requests.append(self.client._chain_request(levels, tokens))
+
+    def execute(self):
+        """
+        Send all queued requests and return a list of their outcomes. If
+        any of them failed with an error, all the responses are still read
+        before the first error is raised.
+        """
+        requests, self.requests = self.requests, []
+        self.client.sock.sendall(b"".join(requests))
+        error = None
+        self.results = []
+        for _ in requests:
+            try:
+                self.results.append(self.client._read_response()[0])
+            except ProtocolError as exc:
+                self.results.append(None)
+                if error is None:
+                    error = exc
+        if error is not None:
+            raise error
+        return self.results
+
+
+class ClientPool(object):
+    """
+    A thread-safe pool of up to `size` connections to a bukkit server.
+    Connections are opened as needed, and threads wait for one to be
+    returned once `size` are in use.
+    """
+
+    __slots__ = (
+        'path',
+        'binary',
+        'idle',
+        'slots',
+    )
+
+    def __init__(self, path, size=8, binary=False):
+        self.path = path
+        self.binary = binary
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a `with` block. Should the
+        block raise an exception, the connection is assumed to be unusable
+        and is closed rather than being returned to the pool.
+        """
+        self.slots.acquire()
+        try:
+            try:
+                client = self.idle.get_nowait()
+            except queue.Empty:
+                client = Client(self.path, binary=self.binary)
+            try:
+                yield client
+            except BaseException:
+                client.close()
+                raise
+            self.idle.put(client)
+        finally:
+            self.slots.release()
+
+    def create(self, rate, limit, timeout, collection):
+        """
+        Create a bucket collection using a pooled connection.
+        """
+        with self.connection() as client:
+            client.create(rate, limit, timeout, collection)
+
+    def define_tier(self, collection, prefix, rate, limit):
+        """
+        Define a tier of buckets using a pooled connection.
+        """
+        with self.connection() as client:
+            client.define_tier(collection, prefix, rate, limit)
+
+    def consume(self, collection, name, tokens):
+        """
+        Attempt to consume tokens using a pooled connection.
+        """
+        with self.connection() as client:
+            return client.consume(collection, name, tokens)
+
+    def try_consume(self, collection, name, tokens):
+        """
+        Attempt to consume tokens using a pooled connection, as with
+        `Client.try_consume`.
+        """
+        with self.connection() as client:
+            return client.try_consume(collection, name, tokens)
+
+    def consume_chain(self, levels, tokens):
+        """
+        Attempt to consume tokens from a chain of buckets using a pooled
+        connection, as with `Client.consume_chain`.
+        """
+        with self.connection() as client:
+            return client.consume_chain(levels, tokens)
+
+    def try_consume_chain(self, levels, tokens):
+        """
+        Attempt to consume tokens from a chain of buckets using a pooled
+        connection, as with `Client.try_consume_chain`.
+        """
+        with self.connection() as client:
+            return client.try_consume_chain(levels, tokens)
+
+    def acquire(self, collection, name, tokens, timeout=None):
+        """
+        Consume tokens, sleeping until enough are available, as with
+        `Client.acquire`. The connection is returned to the pool while
+        sleeping.
+        """
+        return _acquire(
+            lambda: self.try_consume(collection, name, tokens), timeout)
+
+    def stats(self, collection):
+        """
+        Fetch statistics about a collection using a pooled connection.
+        """
+        with self.connection() as client:
+            return client.stats(collection)
+
+    def query(self, collection, names):
+        """
+        Query the state of buckets using a pooled connection, as with
+        `Client.query`.
+        """
+        with self.connection() as client:
+            return client.query(collection, names)
+
+    def peek(self, collection, name):
+        """
+        Query the state of a single bucket using a pooled connection.
+        """
+        with self.connection() as client:
+            return client.peek(collection, name)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class MultiClient(object):
+    """
+    Connections to several bukkit servers, each listening on one of the
+    Unix sockets in `paths`, with buckets spread across them.
+
+    Servers are known by node names, which fix where they sit on the hash
+    ring. `paths` may map names to paths; if it's a plain sequence, each
+    path also serves as its server's name. Naming servers keeps buckets
+    where they are should a server move to another path.
+
+    Each bucket is routed to a server by consistent hashing of its
+    collection and name, using `replicas` virtual nodes per server, so
+    adding a server moves only about 1/N of the buckets. Creating a
+    collection or defining a tier does so on every server, including any
+    added later.
+    """
+
+    __slots__ = (
+        'binary',
+        'ring',
+        'clients',
+        'collections',
+        'tiers',
+    )
+
+    def __init__(self, paths, binary=False, replicas=100):
+        self.binary = binary
+        self.ring = HashRing(replicas=replicas)
+        self.clients = {}
+        self.collections = {}
+        self.tiers = {}
+        if not hasattr(paths, 'items'):
+            paths = dict((path, path) for path in paths)
+        try:
+            for node, path in paths.items():
+                self.add_node(path, node)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Close the connections to every server.
+        """
+        for client in self.clients.values():
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_node(self, path, node=None):
+        """
+        Connect to another server, creating every collection and tier
+        created so far on it, and route its share of the buckets to it.
+        The server is known by `node`, or by its path if that's not given.
+        """
+        if node is None:
+            node = path
+        client = Client(path, binary=self.binary)
+        try:
+            for collection, settings in self.collections.items():
+                client.create(*settings, collection=collection)
+                for prefix, (rate, limit) in self.tiers[collection].items():
+                    client.define_tier(collection, prefix, rate, limit)
+        except BaseException:
+            client.close()
+            raise
+        self.ring.add(node)
+        self.clients[node] = client
+
+    def remove_node(self, node):
+        """
+        Stop routing buckets to a server and close the connection to it.
+        """
+        self.ring.remove(node)
+        self.clients.pop(node).close()
+
+    def node_for(self, collection, name):
+        """
+        The name of the server holding the named bucket.
+        """
+        return self.ring.node_for(collection + "\n" + name)
+
+    def client_for(self, collection, name):
+        """
+        The connection to the server holding the named bucket.
+        """
+        return self.clients[self.node_for(collection, name)]
 
     def create(self, rate, limit, timeout, collection):
-        self._send('B', {'r': rate, 'l': limit, 't': timeout, 'c': collection})
+        """
+        Create a bucket collection on every server, replacing any of the
+        same name.
+        """
+        self.collections[collection] = (rate, limit, timeout)
+        self.tiers[collection] = {}
+        for client in self.clients.values():
+            client.create(rate, limit, timeout, collection)
+
+    def define_tier(self, collection, prefix, rate, limit):
+        """
+        Define a tier of buckets in the named collection on every server.
+        """
+        for client in self.clients.values():
+            client.define_tier(collection, prefix, rate, limit)
+        if collection in self.tiers:
+            self.tiers[collection][prefix] = (rate, limit)
 
     def consume(self, collection, name, tokens):
-        self._send('C', {'c': collection, 'b': name, 't': tokens})
+        """
+        Attempt to consume tokens from the named bucket, as with
+        `Client.consume`.
+        """
+        return self.client_for(collection, name).consume(
+            collection, name, tokens)
+
+    def try_consume(self, collection, name, tokens):
+        """
+        Attempt to consume tokens from the named bucket, as with
+        `Client.try_consume`.
+        """
+        return self.client_for(collection, name).try_consume(
+            collection, name, tokens)
+
+    def acquire(self, collection, name, tokens, timeout=None):
+        """
+        Consume tokens, sleeping until enough are available, as with
+        `Client.acquire`.
+        """
+        return self.client_for(collection, name).acquire(
+            collection, name, tokens, timeout)
+
+    def query(self, collection, names):
+        """
+        Fetch the state of the named buckets, as with `Client.query`,
+        sending one request to each server holding any of them.
+        """
+        names = list(names)
+        by_node = {}
+        for i, name in enumerate(names):
+            by_node.setdefault(self.node_for(collection, name), []).append(i)
+        results = [None] * len(names)
+        for node, indices in by_node.items():
+            states = self.clients[node].query(
+                collection, [names[i] for i in indices])
+            for i, state in zip(indices, states):
+                results[i] = state
+        return results
+
+    def peek(self, collection, name):
+        """
+        Fetch the state of a single bucket, as with `Client.peek`.
+        """
+        return self.client_for(collection, name).peek(collection, name)
+
+    def stats(self, collection):
+        """
+        Fetch statistics about the named collection from every server, as a
+        dictionary mapping each server's name to its statistics.
+        """
+        return dict(
+            (node, client.stats(collection))
+            for node, client in self.clients.items())
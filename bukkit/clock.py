@@ -0,0 +1,101 @@
+"""
+Coarse clocks, which trade precision for cheaper reads.
+"""
+
+import functools
+import operator
+import threading
+import time
+
+
+__all__ = (
+    'CoarseClock',
+)
+
+
+class CoarseClock(object):
+    """
+    A clock that caches the time read from `source`, refreshing it every
+    `resolution` seconds, so that reading it is no more than a lookup.
+
+    The cached time is refreshed by calling `tick`, which can be left to a
+    background thread with `start` or to an asyncio event loop with
+    `attach`. Readings lag the source by up to `resolution` seconds, plus
+    however late the refresh runs. A busy interpreter only lets the
+    background thread run every `sys.getswitchinterval()` seconds, 5ms by
+    default, so lags of that order are to be expected under load.
+
+    The clock can be called directly, but `now` is a faster equivalent,
+    and is what should be passed as the `clock` of a `Collection` or the
+    server's `Registry`, which then share the one cached time between all
+    their buckets.
+    """
+
+    __slots__ = (
+        'source',
+        'resolution',
+        'value',
+        'now',
+        'thread',
+        'stopping',
+        'handle',
+    )
+
+    def __init__(self, source=time.time, resolution=0.001):
+        self.source = source
+        self.resolution = resolution
+        self.value = [source()]
+        self.now = functools.partial(operator.getitem, self.value, 0)
+        self.thread = None
+        self.stopping = None
+        self.handle = None
+
+    def __call__(self):
+        return self.value[0]
+
+    def tick(self):
+        """
+        Refresh the cached time from the source.
+        """
+        self.value[0] = self.source()
+
+    def start(self):
+        """
+        Start refreshing the cached time on a background thread.
+        """
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run, args=(self.stopping,), daemon=True)
+        self.thread.start()
+
+    def _run(self, stopping):
+        while not stopping.is_set():
+            self.tick()
+            stopping.wait(self.resolution)
+
+    def stop(self):
+        """
+        Stop the background thread started by `start`.
+        """
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    def attach(self, loop):
+        """
+        Refresh the cached time on the given asyncio event loop.
+        """
+        self.handle = loop.call_soon(self._tick_on, loop)
+
+    def _tick_on(self, loop):
+        self.tick()
+        self.handle = loop.call_later(self.resolution, self._tick_on, loop)
+
+    def detach(self):
+        """
+        Stop refreshing the cached time on the event loop.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
@@ -0,0 +1,15 @@
+"""
+Exceptions shared by the client, server, and wire protocols.
+"""
+
+
+__all__ = (
+    'ProtocolError',
+)
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a malformed stanza is received, or when the server responds
+    to a request with an error.
+    """
@@ -0,0 +1,408 @@
+"""
+Write-ahead journal of the server's collections and bucket states.
+
+The journal is a series of segment files, each an append-only sequence of
+records: the creation of a collection (`B`), the definition of a tier within
+one (`T`), or the state of a bucket after tokens were taken from it (`U`).
+Records are queued in memory and written out in groups, with a single
+`fsync` every `sync_interval` seconds, or, if `sync_interval` is zero,
+written and synced one at a time. Responses aren't held back until their
+records are synced, so a crash loses at most the last `sync_interval`
+seconds of changes.
+
+Compaction rotates the current segment out of the way and writes the state
+of every collection and bucket to a snapshot, in the same record format,
+yielding to the event loop as it goes. Each segment starts with its
+generation number (`G`), and a snapshot starts with the generation of the
+last segment it supersedes, so a crash at any point during compaction can't
+cause stale records to be replayed over newer ones.
+
+Each record is framed by its length and a CRC-32 of its contents, so a
+record torn by a crash is detected, and dropped, when the journal is
+replayed. All numbers are big-endian.
+"""
+
+import asyncio
+import collections
+import contextlib
+import os
+import struct
+import threading
+import zlib
+
+from bukkit.bucket import TokenBucket
+
+
+__all__ = (
+    'Journal',
+    'JournalError',
+)
+
+
+# length, CRC-32
+_FRAME = struct.Struct('!II')
+# opcode, generation
+_GENERATION = struct.Struct('!BQ')
+# opcode, rate, limit, timeout, collection length
+_CREATE = struct.Struct('!BdddH')
+# opcode, timestamp, available tokens, collection length, bucket length
+_STATE = struct.Struct('!BddHH')
+# opcode, rate, limit, collection length, prefix length
+_TIER = struct.Struct('!BddHH')
+
+OP_GENERATION = ord('G')
+OP_CREATE = ord('B')
+OP_STATE = ord('U')
+OP_TIER = ord('T')
+
+
+class JournalError(Exception):
+    """
+    Raised when a journal can't be replayed.
+    """
+
+
+def _frame(body):
+    return _FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def _generation_record(generation):
+    return _frame(_GENERATION.pack(OP_GENERATION, generation))
+
+
+def _create_record(name, rate, limit, timeout):
+    encoded = name.encode('utf-8')
+    return _frame(
+        _CREATE.pack(OP_CREATE, rate, limit, timeout, len(encoded)) +
+        encoded)
+
+
+def _tier_record(name, prefix, rate, limit):
+    encoded_name = name.encode('utf-8')
+    encoded_prefix = prefix.encode('utf-8')
+    return _frame(
+        _TIER.pack(
+            OP_TIER, rate, limit, len(encoded_name), len(encoded_prefix)) +
+        encoded_name + encoded_prefix)
+
+
+def _state_record(name, key, bucket):
+    encoded_name = name.encode('utf-8')
+    encoded_key = key.encode('utf-8')
+    return _frame(
+        _STATE.pack(
+            OP_STATE, bucket.ts, bucket._available,
+            len(encoded_name), len(encoded_key)) +
+        encoded_name + encoded_key)
+
+
+def _records(data):
+    """
+    Iterate over the bodies of the intact records in `data`, stopping at
+    the first torn or corrupt one. Yields each body's start and end.
+
+    For internal use only.
+    """
+    offset = 0
+    while offset + _FRAME.size <= len(data):
+        length, crc = _FRAME.unpack_from(data, offset)
+        start = offset + _FRAME.size
+        end = start + length
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break
+        yield start, end
+        offset = end
+
+
+def _read(path):
+    """
+    Read a journal file, returning its generation, its records, and the
+    length of its intact prefix. A missing file has no generation.
+
+    For internal use only.
+    """
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        return None, [], 0
+    records = []
+    valid = 0
+    for start, end in _records(data):
+        records.append(data[start:end])
+        valid = end
+    if not records or records[0][0] != OP_GENERATION:
+        if valid == 0 and len(data) < _FRAME.size + _GENERATION.size:
+            # Torn before its header was complete.
+            return None, [], 0
+        raise JournalError("No generation header: '%s'" % path)
+    return _GENERATION.unpack(records[0])[1], records[1:], valid
+
+
+def _apply(registry, record):
+    """
+    Apply a single record to a registry.
+
+    For internal use only.
+    """
+    opcode = record[0]
+    if opcode == OP_CREATE:
+        _, rate, limit, timeout, name_len = _CREATE.unpack_from(record)
+        name = record[_CREATE.size:_CREATE.size + name_len].decode('utf-8')
+        registry.create(name, rate, limit, timeout)
+    elif opcode == OP_TIER:
+        _, rate, limit, name_len, prefix_len = _TIER.unpack_from(record)
+        split = _TIER.size + name_len
+        name = record[_TIER.size:split].decode('utf-8')
+        prefix = record[split:split + prefix_len].decode('utf-8')
+        if name in registry.collections:
+            registry.define_tier(name, prefix, rate, limit)
+    elif opcode == OP_STATE:
+        _, ts, available, name_len, key_len = _STATE.unpack_from(record)
+        split = _STATE.size + name_len
+        name = record[_STATE.size:split].decode('utf-8')
+        key = record[split:split + key_len].decode('utf-8')
+        collection = registry.collections.get(name)
+        if collection is not None:
+            bucket = collection._lookup(key).obj
+            bucket.ts = ts
+            bucket._available = available
+    else:
+        raise JournalError("Unknown record type: %d" % opcode)
+
+
+def _reorder(collection):
+    """
+    Rebuild a collection's cache order from its buckets' timestamps.
+
+    For internal use only.
+    """
+    nodes = sorted(collection.node_map.values(), key=lambda node: node.obj.ts)
+    for node in nodes:
+        node.detach()
+        node.insert_after(collection.head_node)
+
+
+class Journal(object):
+    """
+    A journal kept in the segment file at `path`, with the segment being
+    replaced by compaction at `path + '.old'` and the snapshot at
+    `path + '.snapshot'`.
+
+    Call `replay` to restore a registry, then `open` to start recording.
+    """
+
+    __slots__ = (
+        'path',
+        'sync_interval',
+        'generation',
+        'pending',
+        'fh',
+        'lock',
+    )
+
+    def __init__(self, path, sync_interval=0.1):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.generation = 0
+        self.pending = collections.deque()
+        self.fh = None
+        self.lock = threading.RLock()
+
+    @property
+    def old_path(self):
+        return self.path + '.old'
+
+    @property
+    def snapshot_path(self):
+        return self.path + '.snapshot'
+
+    def replay(self, registry):
+        """
+        Restore the collections and buckets recorded in the journal into a
+        registry, returning the number of records replayed. Any torn record
+        at the end of the current segment is cut off.
+        """
+        superseded, snapshot, _ = _read(self.snapshot_path)
+        if superseded is None:
+            superseded = 0
+        self.generation = superseded
+        batches = [snapshot]
+        live_old = False
+        for path in (self.old_path, self.path):
+            generation, records, valid = _read(path)
+            if generation is not None and generation > superseded:
+                batches.append(records)
+                self.generation = max(self.generation, generation)
+                live_old = live_old or path == self.old_path
+        if generation is not None and generation <= superseded:
+            # A crash came between a snapshot superseding the current
+            # segment and its removal. Its records are all in the snapshot,
+            # and any appended to it would be skipped by the next replay, so
+            # remove it and let `open` start a new one.
+            os.unlink(self.path)
+        elif os.path.exists(self.path):
+            os.truncate(self.path, valid)
+
+        count = 0
+        for records in batches:
+            for record in records:
+                _apply(registry, record)
+            count += len(records)
+        for collection in registry.collections.values():
+            if collection.bucket_class is TokenBucket:
+                _reorder(collection)
+
+        if live_old:
+            # A compaction was interrupted. Finish it now, as the next one
+            # would need to move the current segment to where the old one
+            # is.
+            self._install(self._snapshot(registry, self.generation))
+            os.unlink(self.path)
+        return count
+
+    def open(self):
+        """
+        Open the current segment for appending, starting a new one if
+        there's none.
+        """
+        if (os.path.exists(self.path) and
+                os.path.getsize(self.path) > 0):
+            self.fh = open(self.path, 'ab')
+        else:
+            self.generation += 1
+            self.fh = open(self.path, 'wb')
+            self.fh.write(_generation_record(self.generation))
+            self.sync()
+
+    def close(self):
+        """
+        Sync any pending records and close the current segment.
+        """
+        if self.fh is not None:
+            self.sync()
+            self.fh.close()
+            self.fh = None
+
+    def _append(self, record):
+        if self.sync_interval:
+            self.pending.append(record)
+        else:
+            self.fh.write(record)
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+
+    def record_create(self, name, rate, limit, timeout):
+        """
+        Record the creation of a collection.
+        """
+        self._append(_create_record(name, rate, limit, timeout))
+
+    def record_tier(self, name, prefix, rate, limit):
+        """
+        Record the definition of a tier within a collection.
+        """
+        self._append(_tier_record(name, prefix, rate, limit))
+
+    def record_state(self, name, key, bucket):
+        """
+        Record the state of a bucket.
+        """
+        self._append(_state_record(name, key, bucket))
+
+    def sync(self):
+        """
+        Write out all pending records and sync them to disk. This is safe
+        to call from a thread other than the one recording.
+        """
+        with self.lock:
+            parts = []
+            pending = self.pending
+            while pending:
+                parts.append(pending.popleft())
+            fh = self.fh
+            if parts:
+                fh.write(b"".join(parts))
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def _rotate(self):
+        """
+        Move the current segment out of the way, ready for compaction, and
+        start a new one.
+
+        For internal use only.
+        """
+        with self.lock:
+            self.sync()
+            self.fh.close()
+            os.replace(self.path, self.old_path)
+            self.fh = None
+            self.open()
+
+    def _snapshot(self, registry, superseded):
+        """
+        Generate the records of a snapshot of the registry superseding the
+        segments up to the given generation.
+
+        For internal use only.
+        """
+        yield _generation_record(superseded)
+        for name, collection in list(registry.collections.items()):
+            yield _create_record(
+                name, collection.rate, collection.limit, collection.timeout)
+            if collection.resolver is not None:
+                for prefix, policy in list(
+                        collection.resolver.policies.items()):
+                    yield _tier_record(
+                        name, prefix, policy.rate, policy.limit)
+            for key in list(collection.node_map):
+                if registry.collections.get(name) is not collection:
+                    # Replaced while the snapshot was being written; the
+                    # current segment records its replacement.
+                    break
+                node = collection.node_map.get(key)
+                if node is not None:
+                    yield _state_record(name, key, node.obj)
+
+    def _install(self, records):
+        """
+        Write the records of a snapshot to a temporary file, then move it
+        into place and remove the old segment it supersedes.
+
+        For internal use only.
+        """
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as fh:
+            for record in records:
+                fh.write(record)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.old_path):
+            os.unlink(self.old_path)
+
+    async def compact(self, registry, chunk=1000):
+        """
+        Replace the journal so far with a snapshot of the registry, yielding
+        to the event loop after every `chunk` records written.
+        """
+        loop = asyncio.get_running_loop()
+        superseded = self.generation
+        self._rotate()
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as fh:
+                for i, record in enumerate(
+                        self._snapshot(registry, superseded), 1):
+                    fh.write(record)
+                    if i % chunk == 0:
+                        await asyncio.sleep(0)
+                fh.flush()
+                await loop.run_in_executor(None, os.fsync, fh.fileno())
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+        os.replace(tmp_path, self.snapshot_path)
+        os.unlink(self.old_path)
@@ -0,0 +1,263 @@
+"""
+Keyed collection of token buckets stored in a single dictionary.
+
+Rather than a `Node` and a `TokenBucket` per key, with a dictionary from
+keys to nodes and another back again, each key maps to a `(ts, available)`
+tuple, and the dictionary's own insertion order serves as the cache order:
+every use of a bucket removes its key and inserts it again at the end.
+Nothing per key refers to the collection's rate, limit or clock.
+"""
+
+import collections
+import itertools
+import time
+
+
+__all__ = (
+    'LeanCollection',
+)
+
+
+class BucketView(object):
+    """
+    A read-only view onto a single bucket of a `LeanCollection`, exposing
+    the same `ts` and `tokens` attributes as a `TokenBucket`. Reading
+    `tokens` doesn't change the bucket.
+    """
+
+    __slots__ = (
+        'collection',
+        'key',
+    )
+
+    def __init__(self, collection, key):
+        self.collection = collection
+        self.key = key
+
+    @property
+    def ts(self):
+        """
+        When the bucket was last used.
+        """
+        return self.collection.buckets[self.key][0]
+
+    @property
+    def tokens(self):
+        """
+        The number of tokens available in the bucket.
+        """
+        return self.collection.peek(self.key)[0]
+
+
+class LeanCollection(object):
+    """
+    A keyed collection of token buckets with one dictionary entry per key.
+
+    This has the same interface, and the same `purge_step`, `max_buckets`,
+    `expired` and `evicted` semantics, as `bukkit.bucket.Collection` with
+    `TokenBucket` buckets.
+
+    Removing keys from the front of a dictionary leaves a run of empty
+    entries that each later look for its first key must skip, so the least
+    recently used buckets are looked up a batch at a time and kept in
+    `oldest`, to be skipped over should they be used again.
+    """
+
+    __slots__ = (
+        'buckets',
+        'oldest',
+        'rate', 'limit',
+        'timeout',
+        'clock',
+        'purge_step', 'max_buckets',
+        'expired', 'evicted',
+    )
+
+    def __init__(self, rate, limit, timeout, clock=time.time,
+                 purge_step=0, max_buckets=None):
+        self.buckets = {}
+        self.oldest = collections.deque()
+        self.rate = rate
+        self.limit = limit
+        self.timeout = timeout
+        self.clock = clock
+        self.purge_step = purge_step
+        self.max_buckets = max_buckets
+        self.expired = 0
+        self.evicted = 0
+
+    def __contains__(self, key):
+        return key in self.buckets
+
+    def __getitem__(self, key):
+        if key in self.buckets:
+            return BucketView(self, key)
+        raise IndexError("No such bucket: '%s'" % key)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def _least_recent(self):
+        """
+        The key and state of the least recently used bucket, or `None` if
+        there are no buckets.
+
+        For internal use only.
+        """
+        buckets = self.buckets
+        oldest = self.oldest
+        while True:
+            while oldest:
+                key, state = oldest[0]
+                # A bucket used since it was queued has a new state.
+                if buckets.get(key) is state:
+                    return key, state
+                oldest.popleft()
+            if not buckets:
+                return None
+            oldest.extend(itertools.islice(
+                buckets.items(), max(64, len(buckets) >> 6)))
+
+    def _evict_lru(self):
+        """
+        Evict the least recently used bucket to make room for a new one.
+
+        For internal use only.
+        """
+        least = self._least_recent()
+        if least is not None:
+            del self.buckets[least[0]]
+            self.oldest.popleft()
+            self.evicted += 1
+
+    def _purge(self, limit, max_buckets):
+        """
+        Remove up to `max_buckets` buckets last used at or before `limit`,
+        least recently used first. Returns the number of buckets removed.
+
+        For internal use only.
+        """
+        removed = 0
+        while removed < max_buckets:
+            least = self._least_recent()
+            if least is None or least[1][0] > limit:
+                break
+            del self.buckets[least[0]]
+            self.oldest.popleft()
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def consume(self, key, tokens):
+        """
+        Attempt to consume the given number of token in the bucket identified
+        by `key`. Returns `True` if succeeds, otherwise `False`.
+        """
+        ts = self.clock()
+        buckets = self.buckets
+        state = buckets.pop(key, None)
+        if state is None:
+            if (self.max_buckets is not None and
+                    len(buckets) >= self.max_buckets):
+                self._evict_lru()
+            available = self.limit
+        else:
+            available = state[1]
+            if available < self.limit:
+                available += min(
+                    (ts - state[0]) * self.rate, self.limit - available)
+        result = 0 <= tokens <= available
+        if result:
+            available -= tokens
+        buckets[key] = (ts, available)
+        if self.purge_step:
+            self._purge(ts - self.timeout, self.purge_step)
+        return result
+
+    def consume_many(self, pairs):
+        """
+        Attempt to consume tokens from many buckets against a single reading
+        of the clock. `pairs` is an iterable of `(key, tokens)` pairs, and a
+        list of booleans giving the outcome of each is returned.
+        """
+        ts = self.clock()
+        buckets = self.buckets
+        rate = self.rate
+        limit = self.limit
+        results = []
+        for key, tokens in pairs:
+            state = buckets.pop(key, None)
+            if state is None:
+                if (self.max_buckets is not None and
+                        len(buckets) >= self.max_buckets):
+                    self._evict_lru()
+                available = limit
+            else:
+                available = state[1]
+                if available < limit:
+                    available += min(
+                        (ts - state[0]) * rate, limit - available)
+            if 0 <= tokens <= available:
+                available -= tokens
+                results.append(True)
+            else:
+                results.append(False)
+            buckets[key] = (ts, available)
+        if self.purge_step:
+            self._purge(ts - self.timeout, self.purge_step)
+        return results
+
+    def peek(self, key):
+        """
+        The number of tokens available in the bucket identified by `key`,
+        and when it was last used, as a tuple. A bucket that doesn't exist
+        would be full, and its last use is `None`. This neither changes the
+        bucket nor counts as a use of it.
+        """
+        state = self.buckets.get(key)
+        if state is None:
+            return self.limit, None
+        ts, available = state
+        if available < self.limit:
+            available += min(
+                (self.clock() - ts) * self.rate, self.limit - available)
+        return available, ts
+
+    def time_until(self, key, tokens):
+        """
+        The number of seconds until the given number of tokens will be
+        available in the bucket identified by `key`, or `None` if they never
+        will be. This doesn't count as a use of the bucket.
+        """
+        if not 0 <= tokens <= self.limit:
+            return None
+        available = self.peek(key)[0]
+        if tokens <= available:
+            return 0.0
+        if self.rate <= 0:
+            return None
+        return (tokens - available) / self.rate
+
+    def purge(self):
+        """
+        Purge all expired buckets.
+        """
+        cutoff = self.clock() - self.timeout
+        expired = [
+            key for key, _ in itertools.takewhile(
+                lambda item: item[1][0] <= cutoff, self.buckets.items())]
+        for key in expired:
+            del self.buckets[key]
+        self.oldest.clear()
+        self.expired += len(expired)
+
+    def stats(self):
+        """
+        Summarise the collection: the number of live buckets, and how many
+        have been expired and evicted.
+        """
+        return {
+            'buckets': len(self.buckets),
+            'expired': self.expired,
+            'evicted': self.evicted,
+        }
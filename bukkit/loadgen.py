@@ -0,0 +1,332 @@
+"""
+Load generator for measuring the throughput and latency of a bukkit server.
+
+    bukkit-loadgen PATH [--connections N] [--processes N] [--duration SECONDS]
+                        [--keys N] [--skew S] [--tokens N,...] [--depth N]
+                        [--binary] [--spawn]
+
+Each connection sends `C` requests for keys drawn from `--keys` distinct
+buckets, with ranks weighted by a Zipfian distribution of exponent `--skew`
+(zero for uniform), and token counts drawn from `--tokens`. Requests are
+pipelined `--depth` at a time: each batch is written in one go, and the next
+isn't sent until every response to it has arrived. The latency of a request
+runs from when its batch was sent to when its response arrived.
+
+Connections are spread over `--processes` processes, each running its own
+event loop, so that the generator needn't be the bottleneck. Only requests
+sent after `--warmup` seconds are measured. The results are written to
+stdout as JSON: the requests made per second, how many were allowed, denied
+or failed, and the 50th, 99th and 99.9th percentile latency in milliseconds.
+
+With `--spawn`, a server is started on PATH for the duration of the run.
+"""
+
+import argparse
+import array
+import asyncio
+import bisect
+import concurrent.futures
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+from bukkit import binary
+from bukkit.client import Client, _build_stanza
+
+
+__all__ = (
+    'percentile',
+    'run',
+)
+
+
+# The number of requests each connection encodes ahead of time, and then
+# sends over and over.
+_REQUESTS_PER_CONNECTION = 4096
+
+
+def _sampler(n_keys, skew, rng):
+    """
+    Build a function drawing key ranks from a Zipfian distribution of the
+    given exponent over `n_keys` keys.
+
+    For internal use only.
+    """
+    if skew == 0:
+        return lambda: rng.randrange(n_keys)
+    weights = list(itertools.accumulate(
+        1.0 / (rank ** skew) for rank in range(1, n_keys + 1)))
+    total = weights[-1]
+    return lambda: min(
+        bisect.bisect_left(weights, rng.random() * total), n_keys - 1)
+
+
+def _batches(options, rng):
+    """
+    Encode the batches of requests a connection sends.
+
+    For internal use only.
+    """
+    sample = _sampler(options.keys, options.skew, rng)
+    depth = options.depth
+    n_batches = max(1, _REQUESTS_PER_CONNECTION // depth)
+    batches = []
+    for _ in range(n_batches):
+        requests = []
+        for _ in range(depth):
+            key = 'key:%d' % sample()
+            tokens = rng.choice(options.tokens)
+            if options.binary:
+                requests.append(binary.pack_consume(
+                    options.collection, key, tokens))
+            else:
+                requests.append(_build_stanza(
+                    'C', {'c': options.collection, 'b': key, 't': tokens}))
+        batches.append(b"".join(requests))
+    return batches
+
+
+async def _read_status(reader, is_binary):
+    """
+    Read a single response, returning its status byte.
+
+    For internal use only.
+    """
+    if is_binary:
+        status, length = binary._RESPONSE.unpack(
+            await reader.readexactly(binary._RESPONSE.size))
+        if length:
+            await reader.readexactly(length)
+        return status
+    return (await reader.readuntil(b"\n\n"))[:1]
+
+
+async def _connection(options, rng, measure_from, stop, latencies, counts):
+    """
+    Drive a single connection until `stop`, recording the latencies and
+    outcomes of requests sent from `measure_from` onwards.
+
+    For internal use only.
+    """
+    batches = _batches(options, rng)
+    reader, writer = await asyncio.open_unix_connection(options.path)
+    try:
+        if options.binary:
+            writer.write(binary.HANDSHAKE)
+        clock = time.perf_counter
+        for batch in itertools.cycle(batches):
+            sent = clock()
+            if sent >= stop:
+                break
+            writer.write(batch)
+            measured = sent >= measure_from
+            for _ in range(options.depth):
+                status = await _read_status(reader, options.binary)
+                if measured:
+                    latencies.append(clock() - sent)
+                    counts[status] = counts.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def _drive(options, seed):
+    latencies = array.array('d')
+    counts = {}
+    started = time.perf_counter()
+    measure_from = started + options.warmup
+    stop = measure_from + options.duration
+    await asyncio.gather(*[
+        _connection(
+            options, random.Random(seed * 1000003 + i), measure_from, stop,
+            latencies, counts)
+        for i in range(options.connections)])
+    return latencies.tobytes(), counts
+
+
+def _worker(options, seed):
+    """
+    Run a share of the connections in one process, returning their
+    latencies, as the bytes of an array of doubles, and outcome counts.
+
+    For internal use only.
+    """
+    return asyncio.run(_drive(options, seed))
+
+
+def percentile(ordered, fraction):
+    """
+    The given percentile, expressed as a fraction, of a sorted sequence, by
+    the nearest-rank method.
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run(options):
+    """
+    Run the load described by the parsed command-line options and return
+    the results as a dictionary.
+    """
+    if options.create:
+        with Client(options.path) as client:
+            client.create(
+                options.rate, options.limit, options.timeout,
+                options.collection)
+
+    shares = [
+        options.connections // options.processes +
+        (1 if i < options.connections % options.processes else 0)
+        for i in range(options.processes)]
+    jobs = [
+        (argparse.Namespace(**dict(vars(options), connections=share)),
+         options.seed + i)
+        for i, share in enumerate(shares) if share]
+    if len(jobs) == 1:
+        outcomes = [_worker(*jobs[0])]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+                len(jobs), mp_context=context) as pool:
+            outcomes = list(pool.map(_worker, *zip(*jobs)))
+
+    latencies = array.array('d')
+    counts = {}
+    for data, worker_counts in outcomes:
+        latencies.frombytes(data)
+        for status, count in worker_counts.items():
+            counts[status] = counts.get(status, 0) + count
+    ordered = sorted(latencies)
+    return {
+        'config': {
+            'binary': options.binary,
+            'connections': options.connections,
+            'depth': options.depth,
+            'duration': options.duration,
+            'keys': options.keys,
+            'processes': len(jobs),
+            'skew': options.skew,
+            'tokens': options.tokens,
+        },
+        'requests': len(ordered),
+        'requests_per_sec': len(ordered) / options.duration,
+        'allowed': counts.get(b"+", 0),
+        'denied': counts.get(b"-", 0),
+        'errors': counts.get(b"!", 0),
+        'latency_ms': {
+            'mean': sum(ordered) / len(ordered) * 1e3 if ordered else 0.0,
+            'p50': percentile(ordered, 0.5) * 1e3,
+            'p99': percentile(ordered, 0.99) * 1e3,
+            'p999': percentile(ordered, 0.999) * 1e3,
+            'max': ordered[-1] * 1e3 if ordered else 0.0,
+        },
+    }
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "'%s' is not a positive integer" % value)
+    return number
+
+
+def _token_sizes(value):
+    try:
+        return [float(size) for size in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'%s' is not a list of numbers" % value)
+
+
+def main(argv=None):
+    """
+    Run the load generator from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('path', help="path of the server's Unix socket")
+    parser.add_argument(
+        '--connections', type=_positive_int, default=16, metavar='N',
+        help="number of concurrent connections (default: %(default)s)")
+    parser.add_argument(
+        '--processes', type=_positive_int, default=1, metavar='N',
+        help="number of processes to spread the connections over "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--duration', type=float, default=10.0, metavar='SECONDS',
+        help="how long to measure for (default: %(default)s)")
+    parser.add_argument(
+        '--warmup', type=float, default=1.0, metavar='SECONDS',
+        help="how long to run before measuring (default: %(default)s)")
+    parser.add_argument(
+        '--keys', type=_positive_int, default=100000, metavar='N',
+        help="number of distinct buckets (default: %(default)s)")
+    parser.add_argument(
+        '--skew', type=float, default=0.0, metavar='S',
+        help="Zipfian exponent of key popularity, or 0 for uniform "
+             "(default: %(default)s)")
+    parser.add_argument(
+        '--tokens', type=_token_sizes, default=[1.0], metavar='N,...',
+        help="token counts to draw from (default: 1)")
+    parser.add_argument(
+        '--depth', type=_positive_int, default=1, metavar='N',
+        help="requests pipelined per batch (default: %(default)s)")
+    parser.add_argument(
+        '--binary', action='store_true',
+        help="use the binary protocol")
+    parser.add_argument(
+        '--collection', default='loadgen',
+        help="collection to consume from (default: %(default)s)")
+    parser.add_argument(
+        '--no-create', dest='create', action='store_false',
+        help="use an existing collection rather than creating it")
+    parser.add_argument(
+        '--rate', type=float, default=10.0,
+        help="rate of the collection created (default: %(default)s)")
+    parser.add_argument(
+        '--limit', type=float, default=100.0,
+        help="limit of the collection created (default: %(default)s)")
+    parser.add_argument(
+        '--timeout', type=float, default=60.0,
+        help="timeout of the collection created (default: %(default)s)")
+    parser.add_argument(
+        '--seed', type=int, default=42,
+        help="seed for drawing keys and tokens (default: %(default)s)")
+    parser.add_argument(
+        '--spawn', action='store_true',
+        help="start a server on the path for the duration of the run")
+    options = parser.parse_args(argv)
+
+    server = None
+    if options.spawn:
+        if os.path.exists(options.path):
+            os.unlink(options.path)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'bukkit.server', options.path])
+        while not os.path.exists(options.path):
+            if server.poll() is not None:
+                parser.error("The server exited early")
+            time.sleep(0.01)
+    try:
+        results = run(options)
+    finally:
+        if server is not None:
+            # Interrupt rather than terminate, so the server cleans up.
+            server.send_signal(signal.SIGINT)
+            server.wait()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Lightweight instrumentation for collections and the server.
+"""
+
+import bisect
+
+
+__all__ = (
+    'Histogram',
+    'Metrics',
+)
+
+
+# Upper bounds, in seconds, of the histogram buckets: powers of two from
+# about a microsecond to about a second.
+DEFAULT_BOUNDS = tuple(2.0 ** exp for exp in range(-20, 1))
+
+
+class Histogram(object):
+    """
+    A histogram of durations in seconds, with fixed bucket bounds. The last
+    bucket counts anything longer than the largest bound.
+    """
+
+    __slots__ = (
+        'bounds',
+        'counts',
+        'count',
+        'total',
+    )
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        """
+        Record a single duration.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        """
+        An upper bound on the given percentile, expressed as a fraction, of
+        the recorded durations. This is the bound of the histogram bucket it
+        falls in, or infinite if it's in the last bucket.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        """
+        Summarise the histogram as its count, mean, and 50th and 99th
+        percentiles.
+        """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+        }
+
+
+class Metrics(object):
+    """
+    Counters for a `Collection`: requests allowed and denied, buckets
+    created, and the number and total duration, in seconds, of full purges.
+    """
+
+    __slots__ = (
+        'allowed', 'denied',
+        'created',
+        'purges', 'purge_seconds', 'max_purge_seconds',
+    )
+
+    def __init__(self):
+        self.allowed = 0
+        self.denied = 0
+        self.created = 0
+        self.purges = 0
+        self.purge_seconds = 0.0
+        self.max_purge_seconds = 0.0
+
+    def record_purge(self, elapsed):
+        """
+        Record the duration of a purge.
+        """
+        self.purges += 1
+        self.purge_seconds += elapsed
+        self.max_purge_seconds = max(self.max_purge_seconds, elapsed)
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
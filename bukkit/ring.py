@@ -0,0 +1,86 @@
+"""
+Consistent hashing for spreading buckets across several servers.
+"""
+
+import bisect
+import hashlib
+
+
+__all__ = (
+    'HashRing',
+)
+
+
+def _hash(data):
+    return int.from_bytes(
+        hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing(object):
+    """
+    A consistent hash ring mapping keys to nodes.
+
+    Each node is placed on the ring at `replicas` points, and a key belongs
+    to the node owning the first point at or after the key's own hash. When
+    a node is added, it only takes over keys from the points just before its
+    own, so about 1/N of the keys move; when a node is removed, only the
+    keys it owned move.
+    """
+
+    __slots__ = (
+        'replicas',
+        'nodes',
+        'points',
+        'owners',
+    )
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self.nodes = []
+        self.points = []
+        self.owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def _node_points(self, node):
+        return [_hash('%s#%d' % (node, i)) for i in range(self.replicas)]
+
+    def add(self, node):
+        """
+        Add a node to the ring.
+        """
+        if node in self.nodes:
+            raise ValueError("Node already present: '%s'" % node)
+        self.nodes.append(node)
+        for point in self._node_points(node):
+            i = bisect.bisect_left(self.points, point)
+            self.points.insert(i, point)
+            self.owners.insert(i, node)
+
+    def remove(self, node):
+        """
+        Remove a node from the ring.
+        """
+        if node not in self.nodes:
+            raise ValueError("No such node: '%s'" % node)
+        self.nodes.remove(node)
+        kept = [
+            (point, owner) for point, owner in zip(self.points, self.owners)
+            if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def node_for(self, key):
+        """
+        Find the node a key belongs to.
+        """
+        if not self.points:
+            raise LookupError("The ring is empty")
+        i = bisect.bisect_left(self.points, _hash(key))
+        return self.owners[i % len(self.points)]
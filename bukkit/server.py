@@ -17,17 +17,70 @@ Request format:
       it will be destroyed.
   C;c=<collection>;b=<bucket>;t=<tokens>
     - Attempt to consume the given tokens from the named bucket in the named
-      collection. Response is '+'if successful, '-' if not.
+      collection. Response is '+' if successful, '-' if not. A '-' response
+      gives the number of seconds until enough tokens will be available in
+      its 'r' attribute, which is 'inf' if there never will be.
+  S;c=<collection>
+    - Fetch statistics about the named collection. Responds with '=',
+      followed by one attribute per statistic: the number of live buckets,
+      how many have been expired and evicted, and, if the server is
+      collecting metrics, the collection's counters and the request count,
+      mean, and 50th and 99th percentile latency, in seconds, of each type of
+      request, e.g. 'latency.C.p99'.
+  Q;c=<collection>;b.0=<bucket>;b.1=<bucket>;...
+    - Query any number of buckets in the named collection without consuming
+      from them or counting as a use of them. Responds with '=', giving the
+      tokens available in the bucket named by 'b.<n>' in the 'a.<n>'
+      attribute, and the timestamp of when it was last used in 's.<n>'. A
+      bucket that doesn't exist yet has no 's.<n>' attribute.
+  H;t=<tokens>;c.0=<collection>;b.0=<bucket>;c.1=<collection>;...
+    - Attempt to consume the given tokens from every bucket in a chain, such
+      as a user's, their tenant's, and a global one, each named by 'c.<n>'
+      and 'b.<n>'. The tokens are only taken if every bucket has enough, in
+      which case the response is '+'; otherwise none are taken, and the
+      response is '-', with 'r' giving the number of seconds until every
+      bucket will have enough.
+
+  T;c=<collection>;p=<prefix>;r=<rate>;l=<limit>
+    - Define a tier in the named collection: buckets created from then on
+      whose names start with the given prefix have the given rate and
+      limit, rather than those of the collection. Where several prefixes
+      match, the longest wins. Redefining a prefix doesn't change buckets
+      that already exist, and recreating the collection drops its tiers.
+      Always responds with '+'.
 
   If the response code starts with '!', an error message follows in the 'm'
   attribute.
+
+Requests may be pipelined: a client can send any number of requests without
+waiting for the responses, which are sent back in the same order.
+
+A client may instead use the binary framing described in `bukkit.binary` by
+sending its handshake byte immediately after connecting.
+
+The server can also listen on a Unix datagram socket for requests that need
+no reply, such as charging for work after the fact. Each datagram holds any
+number of binary `C` frames, as described in `bukkit.binary`, which are
+applied together; nothing is sent back, and frames that are malformed, are
+of other types, or name missing collections are dropped.
+
+If the server is given a journal, collections created and tokens consumed are
+recorded in it, as described in `bukkit.journal`, and replayed on startup.
 """
 
-import asynchat
-import asyncore
+import argparse
+import asyncio
+import os
 import socket
+import time
 
-from bukkit import bucket
+from bukkit import binary, bucket
+from bukkit.bucket import consume_chain
+from bukkit.clock import CoarseClock
+from bukkit.journal import Journal
+from bukkit.metrics import Histogram
+from bukkit.client import _build_stanza, _parse_stanza
+from bukkit.exceptions import ProtocolError
 
 
 _REQS = {
@@ -37,54 +90,617 @@ _REQS = {
     # Consume tokens from a bucket.
     # C;c=<collection>;b=<bucket>;t=<tokens>
     'C': ['t', 'c', 'b'],
+    # Fetch statistics about a collection.
+    # S;c=<collection>
+    'S': ['c'],
+    # Query buckets without consuming from them.
+    # Q;c=<collection>;b.0=<bucket>;b.1=<bucket>;...
+    'Q': None,
+    # Consume tokens from a chain of buckets, all or nothing.
+    # H;t=<tokens>;c.0=<collection>;b.0=<bucket>;...
+    'H': None,
+    # Define a tier of buckets with their own rate and limit.
+    # T;c=<collection>;p=<prefix>;r=<rate>;l=<limit>
+    'T': ['c', 'p', 'r', 'l'],
 }
 
 
-_RESPS = {
-    # Success.
-    '+': [],
-    # Action failed without an error, e.g. bucket exhausted.
-    '-': [],
-    # Error; 'm' attribute contains error message.
-    # !;m=<msg>
-    '!': ['m'],
-}
+# Largest stanza we're willing to buffer while waiting for its terminator.
+MAX_STANZA = 64 * 1024
+
+_TERMINATOR = b"\n\n"
+_OK = _build_stanza('+')
+_BINARY_OK = binary.pack_response('+')
+
+
+def _number(attrs, key):
+    """
+    Fetch a numeric attribute from a parsed stanza.
+    """
+    try:
+        return float(attrs[key])
+    except ValueError:
+        raise ProtocolError("'%s' must be a number" % key)
+
+
+def _bucket_names(attrs):
+    """
+    Fetch the bucket names, given as 'b.0', 'b.1', and so on, from a parsed
+    'Q' stanza.
+    """
+    if 'c' not in attrs:
+        raise ProtocolError("'c' is missing")
+    names = []
+    for i in range(len(attrs) - 1):
+        key = 'b.%d' % i
+        if key not in attrs:
+            raise ProtocolError("'%s' is missing" % key)
+        names.append(attrs[key])
+    return names
+
+
+def _chain_levels(attrs):
+    """
+    Fetch the collection and bucket names of each level, given as 'c.0' and
+    'b.0', 'c.1' and 'b.1', and so on, from a parsed 'H' stanza.
+    """
+    if 't' not in attrs:
+        raise ProtocolError("'t' is missing")
+    levels = []
+    for i in range(len(attrs) // 2):
+        level = []
+        for attr in ('c', 'b'):
+            key = '%s.%d' % (attr, i)
+            if key not in attrs:
+                raise ProtocolError("'%s' is missing" % key)
+            level.append(attrs[key])
+        levels.append(tuple(level))
+    return levels
+
+
+def _query_attrs(results):
+    """
+    Build the attributes of the response to a 'Q' request.
+    """
+    attrs = {}
+    for i, (tokens, ts) in enumerate(results):
+        attrs['a.%d' % i] = tokens
+        if ts is not None:
+            attrs['s.%d' % i] = ts
+    return attrs
+
+
+class Registry(object):
+    """
+    A set of named token bucket collections, all using the given clock.
+
+    If `metrics` is true, the collections count their requests, buckets and
+    purges, and `latency` holds a histogram of how long each type of request
+    takes to handle; otherwise, `latency` is `None`.
+
+    If `journal` is set to a `bukkit.journal.Journal`, the creation of each
+    collection and the state of each bucket tokens are taken from are
+    recorded in it.
+    """
+
+    __slots__ = (
+        'collections',
+        'clock',
+        'metrics',
+        'latency',
+        'journal',
+    )
+
+    def __init__(self, clock=None, metrics=False, journal=None):
+        self.collections = {}
+        self.clock = clock
+        self.metrics = metrics
+        self.latency = None
+        if metrics:
+            self.latency = dict((command, Histogram()) for command in _REQS)
+        self.journal = journal
+
+    def create(self, name, rate, limit, timeout):
+        """
+        Create a new collection, replacing any existing one of the same name.
+        """
+        self.collections[name] = bucket.Collection(
+            rate=rate, limit=limit, timeout=timeout, clock=self.clock,
+            metrics=self.metrics)
+        if self.journal is not None:
+            self.journal.record_create(name, rate, limit, timeout)
+
+    def define_tier(self, name, prefix, rate, limit):
+        """
+        Give buckets created from now on in the named collection whose names
+        start with `prefix` their own rate and limit.
+        """
+        collection = self._collection(name)
+        if collection.resolver is None:
+            collection.resolver = bucket.PrefixResolver()
+        collection.resolver.add(prefix, collection.policy(rate, limit))
+        if self.journal is not None:
+            self.journal.record_tier(name, prefix, rate, limit)
+
+    def _collection(self, name):
+        """
+        Fetch the named collection.
+
+        For internal use only.
+        """
+        if name not in self.collections:
+            raise ProtocolError("No such collection: '%s'" % name)
+        return self.collections[name]
+
+    def consume(self, name, key, tokens):
+        """
+        Attempt to consume tokens from a bucket in the named collection.
+        """
+        collection = self._collection(name)
+        result = collection.consume(key, tokens)
+        if result and self.journal is not None:
+            self.journal.record_state(name, key, collection[key])
+        return result
+
+    def consume_many(self, name, pairs):
+        """
+        Attempt to consume tokens from many buckets in the named collection
+        against a single reading of the clock, as with
+        `Collection.consume_many`.
+        """
+        collection = self._collection(name)
+        pairs = list(pairs)
+        results = collection.consume_many(pairs)
+        if self.journal is not None:
+            # Record each bucket once, in the order they were last used.
+            allowed = dict.fromkeys(
+                key for (key, _), result in zip(
+                    reversed(pairs), reversed(results)) if result)
+            for key in reversed(list(allowed)):
+                if key in collection:
+                    self.journal.record_state(name, key, collection[key])
+        return results
 
+    def time_until(self, name, key, tokens):
+        """
+        The number of seconds until tokens can be consumed from a bucket in
+        the named collection, which is infinite if they never can be.
+        """
+        delay = self._collection(name).time_until(key, tokens)
+        return float('inf') if delay is None else delay
 
-class Handler(asynchat.async_chat):  # pylint: disable-msg=R0904
+    def consume_chain(self, levels, tokens):
+        """
+        Attempt to consume tokens from every bucket in a chain of
+        `(collection, key)` pairs, all or nothing.
+        """
+        if not levels:
+            raise ProtocolError("Chain is empty")
+        chain = [(self._collection(name), key) for name, key in levels]
+        result = consume_chain(chain, tokens)
+        if result and self.journal is not None:
+            for (name, key), (collection, _) in zip(levels, chain):
+                self.journal.record_state(name, key, collection[key])
+        return result
+
+    def chain_time_until(self, levels, tokens):
+        """
+        The number of seconds until tokens can be consumed from every
+        bucket in a chain, which is infinite if they never can be.
+        """
+        return max(
+            [self.time_until(name, key, tokens) for name, key in levels],
+            default=0.0)
+
+    def query(self, name, keys):
+        """
+        The tokens available in each of the given buckets in the named
+        collection, and when each was last used, without changing them.
+        """
+        peek = self._collection(name).peek
+        return [peek(key) for key in keys]
+
+    def stats(self, name):
+        """
+        Statistics about the named collection, along with request latencies
+        if metrics are being collected.
+        """
+        result = self._collection(name).stats()
+        if self.latency is not None:
+            for command, histogram in sorted(self.latency.items()):
+                for key, value in histogram.as_dict().items():
+                    result['latency.%s.%s' % (command, key)] = value
+        return result
+
+    def purge(self):
+        """
+        Purge expired buckets from every collection.
+        """
+        for collection in self.collections.values():
+            collection.purge()
+
+
+class Handler(asyncio.Protocol):
     """
-    Handle charity domain queries.
+    Handle requests on a single connection.
+
+    All the complete requests that arrive in a single read are processed
+    together and their responses written back with a single write. The
+    first byte received selects between the text and binary protocols.
     """
 
-    def __init__(self, sock, db_path):
-        asynchat.async_chat.__init__(self, sock)
-        self.ibuffer = []
-        self.set_terminator(CRLF)
+    def __init__(self, registry):
+        self.registry = registry
+        self.transport = None
+        self.buffer = bytearray()
+        self.binary = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        if self.binary is None:
+            self.binary = data[:1] == binary.HANDSHAKE
+            if self.binary:
+                data = data[1:]
+        self.buffer.extend(data)
+        if self.binary:
+            responses = self._binary_requests()
+        else:
+            responses = self._text_requests()
+
+        if len(self.buffer) > MAX_STANZA:
+            responses.append(self._error("Request too large"))
+            self.transport.write(b"".join(responses))
+            self.transport.close()
+        elif responses:
+            self.transport.write(b"".join(responses))
 
-    def collect_incoming_data(self, data):
-        self.ibuffer.append(data)
+    def _error(self, message):
+        if self.binary:
+            return binary.pack_response('!', message)
+        return _build_stanza('!', {'m': message})
 
-    def found_terminator(self):
-        request = ''.join(self.ibuffer)
-        self.ibuffer = []
-        self.push('Request was: [{0}]'.format(request))
-        self.push(CRLF)
+    def _text_requests(self):
+        """
+        Process all complete text stanzas in the buffer.
+        """
+        responses = []
+        start = 0
+        while True:
+            end = self.buffer.find(_TERMINATOR, start)
+            if end == -1:
+                break
+            responses.append(self.handle(bytes(self.buffer[start:end])))
+            start = end + len(_TERMINATOR)
+        del self.buffer[:start]
+        return responses
 
+    def _binary_requests(self):
+        """
+        Process all complete binary frames in the buffer.
+        """
+        responses = []
+        start = 0
+        size = len(self.buffer)
+        with memoryview(self.buffer) as view:
+            while size - start >= binary.LENGTH.size:
+                body = start + binary.LENGTH.size
+                end = body + binary.LENGTH.unpack_from(view, start)[0]
+                if end > size:
+                    break
+                responses.append(self.handle_frame(view, body, end))
+                start = end
+        del self.buffer[:start]
+        return responses
 
-class UnixServer(asyncore.dispatcher):  # pylint: disable-msg=R0904
+    def _timed(self, handler, *args):
+        """
+        Run a request handler, recording how long it took in the histogram
+        for its type of request if metrics are being collected.
+        """
+        latency = self.registry.latency
+        if latency is None:
+            return handler(*args)[1]
+        started = time.perf_counter()
+        command, response = handler(*args)
+        if command in latency:
+            latency[command].observe(time.perf_counter() - started)
+        return response
+
+    def handle_frame(self, view, start, end):
+        """
+        Process a single binary request, returning the response to send
+        back.
+        """
+        return self._timed(self._handle_frame, view, start, end)
+
+    def _handle_frame(self, view, start, end):
+        request = None
+        try:
+            request = binary.unpack_request(view, start, end)
+            if request[0] == 'B':
+                _, name, rate, limit, timeout = request
+                self.registry.create(name, rate, limit, timeout)
+                return 'B', _BINARY_OK
+            if request[0] == 'T':
+                _, name, prefix, rate, limit = request
+                self.registry.define_tier(name, prefix, rate, limit)
+                return 'T', _BINARY_OK
+            if request[0] == 'S':
+                return 'S', binary.pack_attrs(
+                    self.registry.stats(request[1]))
+            if request[0] == 'Q':
+                _, name, keys = request
+                return 'Q', binary.pack_attrs(
+                    _query_attrs(self.registry.query(name, keys)))
+            if request[0] == 'H':
+                _, levels, tokens = request
+                if self.registry.consume_chain(levels, tokens):
+                    return 'H', _BINARY_OK
+                return 'H', binary.pack_denied(
+                    self.registry.chain_time_until(levels, tokens))
+            _, name, key, tokens = request
+            if self.registry.consume(name, key, tokens):
+                return 'C', _BINARY_OK
+            return 'C', binary.pack_denied(
+                self.registry.time_until(name, key, tokens))
+        except ProtocolError as exc:
+            command = None if request is None else request[0]
+            return command, binary.pack_response('!', str(exc))
+
+    def handle(self, data):
+        """
+        Process a single request, returning the response to send back.
+        """
+        return self._timed(self._handle, data)
+
+    def _handle(self, data):
+        stanza_type = None
+        try:
+            stanza_type, attrs = _parse_stanza(data, _REQS)
+            if stanza_type == 'B':
+                self.registry.create(
+                    attrs['c'],
+                    rate=_number(attrs, 'r'),
+                    limit=_number(attrs, 'l'),
+                    timeout=_number(attrs, 't'))
+                return stanza_type, _OK
+            if stanza_type == 'T':
+                self.registry.define_tier(
+                    attrs['c'], attrs['p'],
+                    rate=_number(attrs, 'r'),
+                    limit=_number(attrs, 'l'))
+                return stanza_type, _OK
+            if stanza_type == 'S':
+                return stanza_type, _build_stanza(
+                    '=', self.registry.stats(attrs['c']))
+            if stanza_type == 'Q':
+                names = _bucket_names(attrs)
+                results = self.registry.query(attrs['c'], names)
+                return stanza_type, _build_stanza('=', _query_attrs(results))
+            if stanza_type == 'H':
+                levels = _chain_levels(attrs)
+                tokens = _number(attrs, 't')
+                if self.registry.consume_chain(levels, tokens):
+                    return stanza_type, _OK
+                return stanza_type, _build_stanza('-', {
+                    'r': self.registry.chain_time_until(levels, tokens),
+                })
+            tokens = _number(attrs, 't')
+            if self.registry.consume(attrs['c'], attrs['b'], tokens):
+                return stanza_type, _OK
+            return stanza_type, _build_stanza('-', {
+                'r': self.registry.time_until(attrs['c'], attrs['b'], tokens),
+            })
+        except ProtocolError as exc:
+            return stanza_type, _build_stanza('!', {'m': str(exc)})
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    """
+    Apply the consume requests arriving in datagrams, a batch per collection
+    per datagram, without replying. `dropped` counts the frames that
+    couldn't be applied.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.dropped = 0
+
+    def datagram_received(self, data, addr):
+        view = memoryview(data)
+        size = len(data)
+        batches = {}
+        start = 0
+        while start + binary.LENGTH.size <= size:
+            body = start + binary.LENGTH.size
+            end = body + binary.LENGTH.unpack_from(view, start)[0]
+            if end > size:
+                break
+            try:
+                request = binary.unpack_request(view, body, end)
+            except ProtocolError:
+                request = None
+            if request is not None and request[0] == 'C':
+                _, name, key, tokens = request
+                batches.setdefault(name, []).append((key, tokens))
+            else:
+                self.dropped += 1
+            start = end
+        if start != size:
+            # A truncated frame.
+            self.dropped += 1
+        for name, pairs in batches.items():
+            try:
+                self.registry.consume_many(name, pairs)
+            except ProtocolError:
+                self.dropped += len(pairs)
+
+
+class UnixServer(object):
     """
     Simple listener that accepts incoming connections over a Unix stream
-    socket and spawns per-connection handlers.
+    socket and spawns per-connection handlers. Expired buckets are purged
+    every `purge_interval` seconds.
+
+    If a `CoarseClock` is given as `clock`, it's refreshed on the server's
+    event loop for as long as the server is running; the registry should be
+    created with the clock's `now` as its clock.
+
+    If the registry has a journal, its pending records are synced every
+    `sync_interval` seconds of the journal, off the event loop, and it's
+    compacted every `compact_interval` seconds.
+
+    If `datagram_path` is given, the server also accepts consume requests
+    without replies on a Unix datagram socket at that path, handled by a
+    `DatagramHandler`.
+    """
+
+    def __init__(self, path, registry=None, purge_interval=60.0, clock=None,
+                 compact_interval=3600.0, datagram_path=None):
+        self.path = path
+        self.registry = Registry() if registry is None else registry
+        self.purge_interval = purge_interval
+        self.clock = clock
+        self.compact_interval = compact_interval
+        self.datagram_path = datagram_path
+        self.datagrams = None
+        self.server = None
+        self.purger = None
+        self.syncer = None
+        self.compactor = None
+
+    async def start(self):
+        """
+        Start listening for connections.
+        """
+        loop = asyncio.get_running_loop()
+        if self.clock is not None:
+            self.clock.attach(loop)
+        self.server = await loop.create_unix_server(
+            lambda: Handler(self.registry), self.path)
+        if self.datagram_path is not None:
+            self.datagrams, _ = await loop.create_datagram_endpoint(
+                lambda: DatagramHandler(self.registry),
+                local_addr=self.datagram_path, family=socket.AF_UNIX)
+        self.purger = loop.create_task(self._purge_periodically())
+        journal = self.registry.journal
+        if journal is not None:
+            if journal.sync_interval:
+                self.syncer = loop.create_task(self._sync_periodically())
+            self.compactor = loop.create_task(self._compact_periodically())
+
+    async def _purge_periodically(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            self.registry.purge()
+
+    async def _sync_periodically(self):
+        journal = self.registry.journal
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(journal.sync_interval)
+            await loop.run_in_executor(None, journal.sync)
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            await self.registry.journal.compact(self.registry)
+
+    async def close(self):
+        """
+        Stop listening and wait for the listener to shut down. Any pending
+        journal records are synced.
+        """
+        self.purger.cancel()
+        for task in (self.syncer, self.compactor):
+            if task is not None:
+                task.cancel()
+        if self.registry.journal is not None:
+            self.registry.journal.sync()
+        if self.clock is not None:
+            self.clock.detach()
+        if self.datagrams is not None:
+            self.datagrams.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve_forever(self):
+        """
+        Start listening and handle connections until cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+
+def main(argv=None):
     """
+    Run a server from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('path', help="path of the Unix socket to listen on")
+    parser.add_argument(
+        '--purge-interval', type=float, default=60.0, metavar='SECONDS',
+        help="how often to purge expired buckets (default: %(default)s)")
+    parser.add_argument(
+        '--metrics', action='store_true',
+        help="collect request counters and latency histograms")
+    parser.add_argument(
+        '--clock-resolution', type=float, metavar='SECONDS',
+        help="read the time at most this often, caching it in between")
+    parser.add_argument(
+        '--datagram', metavar='PATH',
+        help="also accept consume requests without replies on a Unix "
+             "datagram socket at this path")
+    parser.add_argument(
+        '--journal', metavar='PATH',
+        help="record changes in a journal at this path, and replay it")
+    parser.add_argument(
+        '--sync-interval', type=float, default=0.1, metavar='SECONDS',
+        help="how often to sync the journal to disk, or 0 to sync every "
+             "change (default: %(default)s)")
+    parser.add_argument(
+        '--compact-interval', type=float, default=3600.0, metavar='SECONDS',
+        help="how often to compact the journal (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    for path in (args.path, args.datagram):
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+    clock = None
+    if args.clock_resolution is not None:
+        clock = CoarseClock(resolution=args.clock_resolution)
+    registry = Registry(
+        clock=None if clock is None else clock.now,
+        metrics=args.metrics)
+    journal = None
+    if args.journal is not None:
+        journal = Journal(args.journal, sync_interval=args.sync_interval)
+        journal.replay(registry)
+        journal.open()
+        registry.journal = journal
+    server = UnixServer(
+        args.path,
+        registry=registry,
+        purge_interval=args.purge_interval,
+        clock=clock,
+        compact_interval=args.compact_interval,
+        datagram_path=args.datagram)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if journal is not None:
+            journal.close()
+        for path in (args.path, args.datagram):
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
 
-    def __init__(self, path):
-        asyncore.dispatcher.__init__(self)
-        self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.bind(path)
-        self.listen(128)
 
-    def handle_accept(self):
-        pair = self.accept()
-        if pair is not None:
-            sock, _ = pair
-            Handler(sock)
+if __name__ == '__main__':
+    main()
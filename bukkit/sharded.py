@@ -0,0 +1,102 @@
+"""
+Thread-safe keyed collection of token buckets.
+"""
+
+import copy
+import threading
+
+from bukkit.bucket import Collection
+
+
+__all__ = (
+    'ShardedCollection',
+)
+
+
+class ShardedCollection(object):
+    """
+    A keyed collection of token buckets that may be shared between threads.
+
+    Keys are hashed across a number of independent `Collection` shards, each
+    with its own lock and cache order, so threads working on keys in
+    different shards don't contend with one another. Any further keyword
+    arguments, such as `max_buckets` and `bucket_class`, are passed to each
+    shard, and the clock defaults to that of `bucket_class`, as with
+    `Collection`.
+
+    Looking up a bucket gives a copy of it as it was at the time, so that
+    reading it can't race with threads consuming from the original.
+    """
+
+    __slots__ = (
+        'shards',
+        'locks',
+    )
+
+    def __init__(self, rate, limit, timeout, clock=None, shards=16,
+                 **kwargs):
+        self.shards = [
+            Collection(rate, limit, timeout, clock=clock, **kwargs)
+            for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+    def shard_for(self, key):
+        """
+        The index of the shard holding the bucket identified by `key`.
+        """
+        return hash(key) % len(self.shards)
+
+    def __contains__(self, key):
+        i = self.shard_for(key)
+        with self.locks[i]:
+            return key in self.shards[i]
+
+    def __getitem__(self, key):
+        # Reading a bucket's tokens refills it, so hand out a copy taken
+        # under the lock rather than the bucket other threads consume from.
+        i = self.shard_for(key)
+        with self.locks[i]:
+            return copy.copy(self.shards[i][key])
+
+    def consume(self, key, tokens):
+        """
+        Attempt to consume the given number of token in the bucket identified
+        by `key`. Returns `True` if succeeds, otherwise `False`.
+        """
+        i = self.shard_for(key)
+        with self.locks[i]:
+            return self.shards[i].consume(key, tokens)
+
+    def consume_many(self, pairs):
+        """
+        Attempt to consume tokens from many buckets at once, as with
+        `Collection.consume_many`. Each shard's lock is taken once for the
+        requests that fall in it.
+        """
+        by_shard = {}
+        for pos, (key, tokens) in enumerate(pairs):
+            by_shard.setdefault(self.shard_for(key), []).append(
+                (pos, key, tokens))
+        results = [None] * sum(len(reqs) for reqs in by_shard.values())
+        for i, reqs in by_shard.items():
+            with self.locks[i]:
+                outcomes = self.shards[i].consume_many(
+                    [(key, tokens) for _, key, tokens in reqs])
+            for (pos, _, _), outcome in zip(reqs, outcomes):
+                results[pos] = outcome
+        return results
+
+    def purge_shard(self, i):
+        """
+        Purge all expired buckets in the given shard.
+        """
+        with self.locks[i]:
+            self.shards[i].purge()
+
+    def purge(self):
+        """
+        Purge all expired buckets, one shard at a time, so that only one
+        shard is locked at any given moment.
+        """
+        for i in range(len(self.shards)):
+            self.purge_shard(i)
@@ -0,0 +1,229 @@
+"""
+Keyed collection of token buckets in shared memory.
+
+A `SharedCollection` keeps its buckets in a `multiprocessing.shared_memory`
+block, so every process it's shared with, such as the workers of a preforking
+server, enforces the same limits without a round trip to the bukkit server.
+Create it in the parent process before forking; it can also be passed to a
+child process as an argument when the child is started, in which case the
+multiprocessing context used to start the child must be given as `ctx`.
+
+The block is split into a number of segments, each an open-addressing hash
+table guarded by its own lock. Each key is hashed to pick its segment and its
+starting slot within that segment, and the slot holds a digest of the key
+rather than the key itself, along with the bucket's timestamp and available
+tokens. Buckets are refilled exactly as a `TokenBucket` would refill them.
+"""
+
+import hashlib
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+
+from bukkit.bucket import TokenBucket
+
+
+__all__ = (
+    'CapacityError',
+    'SharedCollection',
+)
+
+
+# in use, key digest, timestamp, available tokens
+_SLOT = struct.Struct('=?7x16sdd')
+_EMPTY = bytes(_SLOT.size)
+
+
+class CapacityError(Exception):
+    """
+    Raised when there's no room left for a new bucket, even after purging
+    expired ones.
+    """
+
+
+def _digest(key):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).digest()
+
+
+class SharedCollection(object):
+    """
+    A keyed collection of token buckets shared between processes.
+
+    `capacity` is the number of buckets that can be held at once; keeping
+    the table no more than about two thirds full keeps probing short. Keys
+    must be strings or bytes. The creating process should call `unlink`
+    once every process is done with the collection.
+    """
+
+    __slots__ = (
+        'rate', 'limit',
+        'timeout',
+        'clock',
+        'segment_size', 'locks',
+        'shm', 'buf',
+    )
+
+    def __init__(self, rate, limit, timeout, clock=time.time,
+                 capacity=65536, stripes=64, ctx=multiprocessing):
+        self.rate = rate
+        self.limit = limit
+        self.timeout = timeout
+        self.clock = clock
+        self.segment_size = max(1, -(-capacity // stripes))
+        self.locks = [ctx.Lock() for _ in range(stripes)]
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=stripes * self.segment_size * _SLOT.size)
+        self.buf = self.shm.buf
+
+    def __getstate__(self):
+        return {
+            'rate': self.rate,
+            'limit': self.limit,
+            'timeout': self.timeout,
+            'clock': self.clock,
+            'segment_size': self.segment_size,
+            'locks': self.locks,
+            'name': self.shm.name,
+        }
+
+    def __setstate__(self, state):
+        for k in ('rate', 'limit', 'timeout', 'clock', 'segment_size',
+                  'locks'):
+            setattr(self, k, state[k])
+        self.shm = shared_memory.SharedMemory(name=state['name'])
+        self.buf = self.shm.buf
+
+    def close(self):
+        """
+        Detach this process from the shared memory block.
+        """
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Free the shared memory block once every process has closed it.
+        """
+        self.shm.unlink()
+
+    def _locate(self, digest):
+        """
+        Find the segment for a key digest and the slot to start probing at.
+
+        For internal use only.
+        """
+        h = int.from_bytes(digest[:8], 'little')
+        n_segments = len(self.locks)
+        return h % n_segments, (h // n_segments) % self.segment_size
+
+    def _probe(self, segment, start, digest):
+        """
+        Find the offset of the slot holding `digest` in a segment, or else
+        of the first empty slot, returning it and whether it was a match.
+        If the segment is full, the offset is `None`. The segment's lock
+        must be held.
+
+        For internal use only.
+        """
+        base = segment * self.segment_size
+        for i in range(self.segment_size):
+            offset = (base + (start + i) % self.segment_size) * _SLOT.size
+            used, slot_digest, _, _ = _SLOT.unpack_from(self.buf, offset)
+            if not used:
+                return offset, False
+            if slot_digest == digest:
+                return offset, True
+        return None, False
+
+    def _purge_segment(self, segment, limit):
+        """
+        Rebuild a segment without any buckets last used at or before
+        `limit`. The segment's lock must be held.
+
+        For internal use only.
+        """
+        start = segment * self.segment_size * _SLOT.size
+        end = start + self.segment_size * _SLOT.size
+        live = [
+            slot for slot in _SLOT.iter_unpack(self.buf[start:end])
+            if slot[0] and slot[2] > limit]
+        self.buf[start:end] = _EMPTY * self.segment_size
+        for slot in live:
+            offset, _ = self._probe(
+                segment, self._locate(slot[1])[1], slot[1])
+            _SLOT.pack_into(self.buf, offset, *slot)
+
+    def consume(self, key, tokens):
+        """
+        Attempt to consume the given number of token in the bucket identified
+        by `key`. Returns `True` if succeeds, otherwise `False`.
+        """
+        digest = _digest(key)
+        segment, start = self._locate(digest)
+        with self.locks[segment]:
+            ts = self.clock()
+            offset, found = self._probe(segment, start, digest)
+            if offset is None:
+                self._purge_segment(segment, ts - self.timeout)
+                offset, found = self._probe(segment, start, digest)
+                if offset is None:
+                    raise CapacityError("No room for bucket: %r" % (key,))
+            if found:
+                _, _, last, available = _SLOT.unpack_from(self.buf, offset)
+                if available < self.limit:
+                    available += min(
+                        (ts - last) * self.rate,
+                        self.limit - available)
+            else:
+                available = self.limit
+            result = 0 <= tokens <= available
+            if result:
+                available -= tokens
+            _SLOT.pack_into(self.buf, offset, True, digest, ts, available)
+        return result
+
+    def __contains__(self, key):
+        digest = _digest(key)
+        segment, start = self._locate(digest)
+        with self.locks[segment]:
+            return self._probe(segment, start, digest)[1]
+
+    def __getitem__(self, key):
+        """
+        Fetch a copy of the named bucket, as a `TokenBucket`.
+        """
+        digest = _digest(key)
+        segment, start = self._locate(digest)
+        with self.locks[segment]:
+            offset, found = self._probe(segment, start, digest)
+            if found:
+                _, _, ts, available = _SLOT.unpack_from(self.buf, offset)
+        if not found:
+            raise IndexError("No such bucket: '%s'" % (key,))
+        bucket = TokenBucket(self.rate, self.limit, clock=self.clock)
+        bucket.ts = ts
+        bucket._available = available
+        return bucket
+
+    def __len__(self):
+        total = 0
+        for segment, lock in enumerate(self.locks):
+            start = segment * self.segment_size * _SLOT.size
+            end = start + self.segment_size * _SLOT.size
+            with lock:
+                total += sum(
+                    1 for slot in _SLOT.iter_unpack(self.buf[start:end])
+                    if slot[0])
+        return total
+
+    def purge(self):
+        """
+        Purge all expired buckets, one segment at a time.
+        """
+        limit = self.clock() - self.timeout
+        for segment, lock in enumerate(self.locks):
+            with lock:
+                self._purge_segment(segment, limit)
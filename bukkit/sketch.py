@@ -0,0 +1,153 @@
+"""
+Approximate rate limiting in fixed memory, for unbounded numbers of keys.
+"""
+
+import array
+import time
+
+from bukkit.bucket import Collection
+
+
+__all__ = (
+    'SketchCollection',
+)
+
+
+_MASK = (1 << 32) - 1
+
+
+class SketchCollection(object):
+    """
+    A fixed-memory, approximate stand-in for a `Collection`.
+
+    Rather than a bucket per key, the tokens each key has used are tallied
+    in a count-min sketch: `depth` rows of `width` cells, with each key
+    hashed to one cell per row. Each cell drains at `rate` tokens per
+    second, which is equivalent to a token bucket refilling, and a key's
+    usage is estimated as the smallest of its cells. Collisions can only
+    inflate that estimate, so requests may be denied that an exact
+    `Collection` would allow, but never the reverse.
+
+    Keys whose estimated usage reaches `promote_at` times the limit are
+    heavy hitters, and are promoted into an exact `TokenBucket` with no
+    more tokens than the sketch allowed them. At most `max_exact` of these
+    are kept, in a `Collection` which expires them as usual, after which
+    their keys fall back to the sketch.
+    """
+
+    __slots__ = (
+        'rate', 'limit',
+        'timeout',
+        'clock',
+        'width', 'depth',
+        'levels', 'stamps',
+        'threshold',
+        'exact',
+    )
+
+    def __init__(self, rate, limit, timeout, clock=time.time,
+                 width=65536, depth=4, promote_at=0.5, max_exact=10000):
+        self.rate = rate
+        self.limit = limit
+        self.timeout = timeout
+        self.clock = clock
+        self.width = width
+        self.depth = depth
+        self.levels = array.array('d', bytes(8 * width * depth))
+        self.stamps = array.array('d', bytes(8 * width * depth))
+        self.threshold = promote_at * limit
+        self.exact = Collection(
+            rate, limit, timeout, clock=clock, max_buckets=max_exact)
+
+    def _cells(self, key):
+        """
+        The index of the cell for a key in each row of the sketch, derived
+        from a single hash by double hashing.
+
+        For internal use only.
+        """
+        h = hash(key)
+        h1 = h & _MASK
+        h2 = ((h >> 32) & _MASK) | 1
+        width = self.width
+        return [
+            row * width + (h1 + row * h2) % width
+            for row in range(self.depth)]
+
+    def _usage(self, cells, ts):
+        """
+        Drain the given cells as of the timestamp `ts`, returning the
+        estimated usage of the key they belong to.
+
+        For internal use only.
+        """
+        levels = self.levels
+        stamps = self.stamps
+        rate = self.rate
+        usage = None
+        for i in cells:
+            level = levels[i]
+            if level > 0:
+                level = max(0.0, level - (ts - stamps[i]) * rate)
+                levels[i] = level
+            stamps[i] = ts
+            if usage is None or level < usage:
+                usage = level
+        return usage
+
+    def _raise(self, cells, usage):
+        """
+        Raise the given cells to at least `usage`. Only raising those below
+        it, rather than adding to every cell, keeps collisions from
+        inflating estimates more than they must.
+
+        For internal use only.
+        """
+        levels = self.levels
+        for i in cells:
+            if levels[i] < usage:
+                levels[i] = usage
+
+    def estimate(self, key):
+        """
+        An estimate of the tokens the key has used and not yet had refilled.
+        For promoted keys, this is exact.
+        """
+        if key in self.exact:
+            return self.limit - self.exact.peek(key)[0]
+        return self._usage(self._cells(key), self.clock())
+
+    def consume(self, key, tokens):
+        """
+        Attempt to consume the given number of token in the bucket identified
+        by `key`. Returns `True` if succeeds, otherwise `False`.
+        """
+        ts = self.clock()
+        cells = self._cells(key)
+        usage = self._usage(cells, ts)
+        if key in self.exact:
+            result = self.exact.consume(key, tokens)
+            # Keep the sketch up to date, so the key's usage isn't
+            # underestimated should its exact bucket be evicted.
+            self._raise(cells, self.limit - self.exact[key]._available)
+            return result
+        result = 0 <= tokens <= self.limit - usage
+        if result:
+            usage += tokens
+            self._raise(cells, usage)
+        if usage >= self.threshold:
+            self.exact.consume(key, 0)
+            self.exact[key]._available = self.limit - usage
+        return result
+
+    def __contains__(self, key):
+        """
+        Whether a key has been promoted to an exact bucket.
+        """
+        return key in self.exact
+
+    def purge(self):
+        """
+        Purge expired exact buckets. The sketch itself never needs purging.
+        """
+        self.exact.purge()
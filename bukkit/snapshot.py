@@ -0,0 +1,182 @@
+"""
+Compact on-disk snapshots of token bucket collections.
+
+Unlike pickling, a snapshot is written incrementally as the cache is walked,
+so no intermediate list of buckets is built, and it's read back through
+`mmap`, so restoring doesn't need the whole file in memory at once. Keys
+must be strings.
+
+The file starts with a header giving the format version, the collection's
+settings, the kind of bucket it holds, and the number of buckets. One record
+per bucket follows, from least to most recently used, each giving the
+length of the key, the bucket's timestamp and available tokens, and the key
+itself. All numbers are big-endian.
+
+Timestamps are saved as-is, so a snapshot of a collection of
+`MonotonicTokenBucket` objects is only meaningful until the machine reboots.
+"""
+
+import mmap
+import os
+import struct
+
+from bukkit.bucket import Collection, MonotonicTokenBucket, Node, TokenBucket
+
+
+__all__ = (
+    'SnapshotError',
+    'load',
+    'save',
+)
+
+
+MAGIC = b"BKKT"
+VERSION = 1
+
+# magic, version, bucket kind, rate, limit, timeout, purge step,
+# max buckets (zero for none), bucket count
+_HEADER = struct.Struct('!4sHBdddIQQ')
+
+# Each kind of bucket, and the layout of its records: key length, timestamp,
+# and available tokens. Fixed-point token counts don't fit in 64 bits, so are
+# split in two.
+_KINDS = {
+    TokenBucket: (0, struct.Struct('!Hdd')),
+    MonotonicTokenBucket: (1, struct.Struct('!HqQQ')),
+}
+_CLASSES = dict((kind, cls) for cls, (kind, _) in _KINDS.items())
+
+_LOW = (1 << 64) - 1
+
+
+class SnapshotError(Exception):
+    """
+    Raised when a snapshot can't be written or read.
+    """
+
+
+def save(collection, path):
+    """
+    Write a snapshot of `collection` to `path`. The snapshot is written to
+    a temporary file which then replaces `path`, so an existing snapshot is
+    never left half-written.
+    """
+    if collection.bucket_class not in _KINDS:
+        raise SnapshotError(
+            "Cannot snapshot %s buckets" % collection.bucket_class.__name__)
+    kind, record = _KINDS[collection.bucket_class]
+    monotonic = collection.bucket_class is MonotonicTokenBucket
+
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as fh:
+            _write(fh, collection, kind, record, monotonic)
+            fh.flush()
+            os.fsync(fh.fileno())
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def _write(fh, collection, kind, record, monotonic):
+    fh.write(_HEADER.pack(
+        MAGIC, VERSION, kind,
+        collection.rate, collection.limit, collection.timeout,
+        collection.purge_step, collection.max_buckets or 0,
+        len(collection.node_map)))
+    key_map = collection.key_map
+    node = collection.tail_node.next_node
+    while node is not collection.head_node:
+        key = key_map[node]
+        if not isinstance(key, str):
+            raise SnapshotError("Key %r is not a string" % (key,))
+        encoded = key.encode('utf-8')
+        bucket = node.obj
+        if monotonic:
+            fh.write(record.pack(
+                len(encoded), bucket.ts,
+                bucket._available >> 64, bucket._available & _LOW))
+        else:
+            fh.write(record.pack(len(encoded), bucket.ts, bucket._available))
+        fh.write(encoded)
+        node = node.next_node
+
+
+def load(path, clock=None, resolver=None):
+    """
+    Restore a collection from the snapshot at `path`. The clock isn't saved
+    in the snapshot, so it defaults to that of the bucket class. Nor are the
+    policies of a collection with a resolver, so the `resolver` given is
+    used to find the policy of each bucket restored.
+    """
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            raise SnapshotError("Truncated header")
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _restore(mm, clock, resolver)
+
+
+def _restore(mm, clock, resolver):
+    if len(mm) < _HEADER.size:
+        raise SnapshotError("Truncated header")
+    (magic, version, kind, rate, limit, timeout,
+     purge_step, max_buckets, count) = _HEADER.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise SnapshotError("Not a snapshot")
+    if version != VERSION:
+        raise SnapshotError("Unsupported snapshot version: %d" % version)
+    if kind not in _CLASSES:
+        raise SnapshotError("Unknown bucket kind: %d" % kind)
+
+    bucket_class = _CLASSES[kind]
+    _, record = _KINDS[bucket_class]
+    collection = Collection(
+        rate, limit, timeout, clock=clock, purge_step=purge_step,
+        max_buckets=max_buckets or None, bucket_class=bucket_class,
+        resolver=resolver)
+    clock = collection.clock
+    monotonic = bucket_class is MonotonicTokenBucket
+    if monotonic:
+        template = MonotonicTokenBucket(rate, limit, clock=clock)
+    else:
+        policy = collection.policy(rate, limit)
+
+    node_map = collection.node_map
+    key_map = collection.key_map
+    head_node = collection.head_node
+    new_bucket = bucket_class.__new__
+    offset = _HEADER.size
+    for _ in range(count):
+        if offset + record.size > len(mm):
+            raise SnapshotError("Truncated record")
+        if monotonic:
+            key_len, ts, high, low = record.unpack_from(mm, offset)
+            available = (high << 64) | low
+        else:
+            key_len, ts, available = record.unpack_from(mm, offset)
+        offset += record.size
+        if offset + key_len > len(mm):
+            raise SnapshotError("Truncated record")
+        key = mm[offset:offset + key_len].decode('utf-8')
+        offset += key_len
+
+        bucket = new_bucket(bucket_class)
+        bucket.ts = ts
+        bucket._available = available
+        if monotonic:
+            bucket.clock = clock
+            bucket.rate = rate
+            bucket.limit = limit
+            bucket._capacity = template._capacity
+            bucket._step = template._step
+        elif resolver is None:
+            bucket.policy = policy
+        else:
+            bucket.policy = resolver(key) or policy
+
+        node = Node(bucket)
+        node_map[key] = node
+        key_map[node] = key
+        node.insert_after(head_node)
+    return collection
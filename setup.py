@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-from __future__ import with_statement
-
 import os.path
 import sys
 
@@ -26,6 +24,16 @@ setup(
     url='https://github.com/kgaughan/bukkit/',
     license='MIT',
     packages=['bukkit'],
+    python_requires='>=3.8',
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'bukkit-server = bukkit.server:main',
+            'bukkit-loadgen = bukkit.loadgen:main',
+        ],
+    },
 
     classifiers=(
         'Development Status :: 3 - Alpha',
@@ -34,6 +42,7 @@ setup(
         'License :: OSI Approved :: MIT License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
+        'Programming Language :: Python :: 3',
     ),
 
     author='Keith Gaughan',
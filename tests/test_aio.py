@@ -0,0 +1,70 @@
+import asyncio
+
+from bukkit.aio import AsyncLimiter
+from bukkit.bucket import Collection
+
+
+def test_fifo():
+    async def run():
+        limiter = AsyncLimiter(Collection(rate=200, limit=10, timeout=60))
+        assert await limiter.acquire('x', 10)
+        order = []
+
+        async def wait(name, tokens):
+            assert await limiter.acquire('x', tokens)
+            order.append(name)
+
+        # The small request can't jump ahead of the large one.
+        await asyncio.gather(wait('big', 10), wait('small', 1))
+        assert order == ['big', 'small']
+        assert limiter.wakeups == 2
+        assert limiter.queues == {}
+        assert limiter.timers == {}
+
+    asyncio.run(run())
+
+
+def test_never_and_timeout():
+    async def run():
+        limiter = AsyncLimiter(Collection(rate=1, limit=10, timeout=60))
+        assert not await limiter.acquire('x', 11)
+        assert await limiter.acquire('x', 10)
+        assert not await limiter.acquire('x', 5, timeout=0.01)
+        assert limiter.queues == {}
+        assert limiter.timers == {}
+
+    asyncio.run(run())
+
+
+def test_withdrawn_head_lets_next_through():
+    async def run():
+        limiter = AsyncLimiter(Collection(rate=100, limit=10, timeout=60))
+        assert await limiter.acquire('x', 10)
+        big = asyncio.ensure_future(limiter.acquire('x', 10, timeout=0.01))
+        small = asyncio.ensure_future(limiter.acquire('x', 1))
+        assert not await big
+        assert await small
+        assert limiter.queues == {}
+
+    asyncio.run(run())
+
+
+def test_purge_reevaluates_queue():
+    ticks = [0]
+
+    async def run():
+        buckets = Collection(
+            rate=0.01, limit=10, timeout=30, clock=lambda: ticks[0])
+        limiter = AsyncLimiter(buckets)
+        assert await limiter.acquire('x', 10)
+        waiter = asyncio.ensure_future(limiter.acquire('x', 5))
+        await asyncio.sleep(0)
+        assert 'x' in limiter.queues
+        ticks[0] = 31
+        limiter.purge()
+        assert await waiter
+        assert limiter.queues == {}
+        assert limiter.timers == {}
+        assert buckets['x'].tokens == 5
+
+    asyncio.run(run())
@@ -0,0 +1,115 @@
+from unittest import SkipTest
+
+try:
+    from bukkit.arrays import ArrayCollection
+except ImportError:
+    raise SkipTest("NumPy is not installed")
+
+
+def test_consume():
+    buckets = ArrayCollection(rate=5, limit=23, timeout=31, clock=lambda: 0)
+    # Consuming nothing ensures the thing is present.
+    buckets.consume('thingy', 0)
+    assert buckets['thingy'].tokens == 23
+    assert buckets.consume('thingy', 3)
+    assert buckets['thingy'].tokens == 20
+    assert not buckets.consume('thingy', 21)
+    assert not buckets.consume('thingy', -1)
+
+
+def test_refill():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ArrayCollection(rate=5, limit=20, timeout=31, clock=fake_clock)
+
+    assert buckets.consume('thingy', 10)
+    ticks += 1
+    assert buckets['thingy'].tokens == 15
+    ticks += 2
+    assert buckets['thingy'].tokens == 20
+
+
+def test_contains_and_get():
+    buckets = ArrayCollection(rate=5, limit=23, timeout=31, clock=lambda: 0)
+
+    assert 'thingy' not in buckets
+    try:
+        buckets['thingy']
+        assert False, "Should not be able to look up 'thingy'"
+    except IndexError as exc:
+        assert str(exc) == "No such bucket: 'thingy'"
+
+    buckets.consume('thingy', 5)
+    assert 'thingy' in buckets
+    assert len(buckets) == 1
+    assert buckets['thingy'].tokens == 18
+
+
+def test_growth():
+    buckets = ArrayCollection(
+        rate=5, limit=23, timeout=31, clock=lambda: 0, capacity=2)
+    for i in range(5):
+        buckets.consume('x' + str(i), i)
+    assert len(buckets) == 5
+    assert len(buckets.keys) == 8
+    for i in range(5):
+        assert buckets['x' + str(i)].tokens == 23 - i
+
+    buckets = ArrayCollection(
+        rate=5, limit=23, timeout=31, clock=lambda: 0, capacity=0)
+    assert buckets.consume('x', 1)
+    assert buckets.consume_many([('y', 2), ('z', 3)]) == [True, True]
+    assert len(buckets.keys) == 4
+    assert buckets['z'].tokens == 20
+
+
+def test_purge_reuses_slots():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ArrayCollection(
+        rate=1, limit=20, timeout=15, clock=fake_clock, capacity=4)
+
+    for i in range(4):
+        buckets.consume('x' + str(i), 0)
+    ticks += 10
+    buckets.consume('x1', 0)
+    ticks += 10
+    buckets.purge()
+    assert sorted(buckets.index.keys()) == ['x1']
+
+    slot = buckets.index['x1']
+    for i in range(4, 7):
+        buckets.consume('x' + str(i), 0)
+    assert len(buckets.keys) == 4
+    assert buckets.index['x1'] == slot
+    assert sorted(buckets.index.values()) == [0, 1, 2, 3]
+
+    ticks += 20
+    buckets.purge()
+    assert len(buckets) == 0
+    assert not buckets.used.any()
+
+
+def test_consume_many():
+    buckets = ArrayCollection(rate=5, limit=10, timeout=31, clock=lambda: 0)
+    results = buckets.consume_many([('a', 6), ('b', 1), ('a', 6), ('a', 4)])
+    assert results == [True, True, False, True]
+    assert buckets['a'].tokens == 0
+    assert buckets['b'].tokens == 9
+
+
+def test_consume_many_refills():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ArrayCollection(rate=2, limit=10, timeout=31, clock=fake_clock)
+    buckets.consume_many([('a', 10), ('b', 4), ('c', 0)])
+    ticks += 2
+    # Distinct buckets are decided together; repeated ones in order.
+    assert buckets.consume_many([('a', 5), ('b', 11), ('c', -1)]) == [
+        False, False, False]
+    assert buckets.consume_many([('a', 4), ('b', 10), ('c', 10)]) == [
+        True, True, True]
+    assert buckets.consume_many([('c', 1), ('a', 1), ('c', 0)]) == [
+        False, False, True]
+    assert buckets.consume_many([]) == []
+    assert list(buckets.ts[:3]) == [2, 2, 2]
@@ -0,0 +1,63 @@
+from bukkit import binary
+from bukkit.exceptions import ProtocolError
+import io
+
+
+def unpack(frame):
+    (length,) = binary.LENGTH.unpack_from(frame)
+    assert length == len(frame) - binary.LENGTH.size
+    return binary.unpack_request(
+        memoryview(frame), binary.LENGTH.size, len(frame))
+
+
+def test_round_trip():
+    frame = binary.pack_create(1.5, 20, 60, 'tést')
+    assert unpack(frame) == ('B', 'tést', 1.5, 20.0, 60.0)
+    frame = binary.pack_consume('test', 'ünïcode', 3)
+    assert unpack(frame) == ('C', 'test', 'ünïcode', 3.0)
+    assert unpack(binary.pack_stats('tést')) == ('S', 'tést')
+    frame = binary.pack_query('test', ['a', 'ünïcode', ''])
+    assert unpack(frame) == ('Q', 'test', ['a', 'ünïcode', ''])
+    assert unpack(binary.pack_query('test', [])) == ('Q', 'test', [])
+    frame = binary.pack_chain([('users', 'ünïcode'), ('all', '')], 2)
+    assert unpack(frame) == ('H', [('users', 'ünïcode'), ('all', '')], 2.0)
+    frame = binary.pack_tier('test', 'pänd:', 10, 100)
+    assert unpack(frame) == ('T', 'test', 'pänd:', 10.0, 100.0)
+
+
+def test_bad_requests():
+    for frame, message in [
+            (binary.LENGTH.pack(0), "Empty request"),
+            (binary.LENGTH.pack(2) + b"C\x00", "Truncated request"),
+            (binary.pack_consume('a', 'b', 1) + b"x", "Bad request length"),
+            (binary.pack_query('a', ['b'])[:-1], "Bad request length"),
+            (binary.pack_query('a', ['b']) + b"x", "Bad request length"),
+            (binary.pack_chain([('a', 'b')], 1)[:-1], "Bad request length"),
+            (binary.pack_chain([('a', 'b')], 1) + b"x", "Bad request length"),
+            (binary.pack_tier('a', 'b', 1, 2)[:-1], "Bad request length"),
+            (binary.LENGTH.pack(1) + b"Z", "Opcode 90 is not recognised")]:
+        try:
+            binary.unpack_request(
+                memoryview(frame), binary.LENGTH.size, len(frame))
+            assert False, "Should have rejected %r" % frame
+        except ProtocolError as exc:
+            assert str(exc) == message
+
+
+def test_read_response():
+    rfile = io.BytesIO(
+        binary.pack_response('+') +
+        binary.pack_denied(1.5) +
+        binary.pack_attrs({'buckets': 3, 'mean': 0.5}) +
+        binary.pack_response('!', "Oops") +
+        binary.pack_response('!', "Trunc")[:-1])
+    assert binary.read_response(rfile) == ('+', {})
+    assert binary.read_response(rfile) == ('-', {'r': 1.5})
+    assert binary.read_response(rfile) == (
+        '=', {'buckets': '3', 'mean': '0.5'})
+    assert binary.read_response(rfile) == ('!', {'m': "Oops"})
+    try:
+        binary.read_response(rfile)
+        assert False, "Should have detected truncated response"
+    except ProtocolError:
+        pass
@@ -1,5 +1,9 @@
-from bukkit import TokenBucket
-import cPickle as pickle
+from bukkit import (
+    GCRABucket, MonotonicTokenBucket, Policy, PrefixResolver, TokenBucket)
+import asyncio
+import pickle
+import random
+import time
 
 
 def test_creation():
@@ -67,3 +71,226 @@ def test_pickle():
     assert original.rate == unpickled.rate
     assert original.limit == unpickled.limit
     assert original._available == unpickled._available
+    assert original.policy is unpickled.policy
+
+    # Buckets pickled before they shared policies can still be loaded.
+    unpickled = TokenBucket.__new__(TokenBucket)
+    unpickled.__setstate__({
+        'clock': time.time, 'ts': 3.0, 'rate': 5, 'limit': 20,
+        '_available': 7})
+    assert unpickled.policy is original.policy
+    assert unpickled.ts == 3.0
+    assert unpickled._available == 7
+
+
+def test_policy():
+    fake_clock = lambda: 0
+    policy = Policy.intern(5, 20, fake_clock)
+    assert Policy.intern(5, 20, fake_clock) is policy
+    assert Policy.intern(5, 21, fake_clock) is not policy
+    assert Policy(5, 20, fake_clock) == policy
+
+    b1 = TokenBucket(5, 20, clock=fake_clock)
+    b2 = TokenBucket(5, 20, clock=fake_clock)
+    assert b1.policy is b2.policy is policy
+    assert (b1.rate, b1.limit, b1.clock) == (5, 20, fake_clock)
+    assert not hasattr(b1, '__dict__')
+
+    paid = Policy.intern(10, 100, fake_clock)
+    resolver = PrefixResolver({'paid:': paid, 'paid:gold:': policy})
+    assert resolver('paid:x') is paid
+    assert resolver('paid:gold:x') is policy
+    assert resolver('free:x') is None
+    resolver.add('', policy)
+    assert resolver('free:x') is policy
+
+
+def test_consume_at():
+    calls = []
+
+    def fake_clock():
+        calls.append(None)
+        return 0
+
+    bucket = TokenBucket(5, 20, clock=fake_clock)
+    del calls[:]
+    assert bucket.consume_at(15, 0)
+    assert not bucket.consume_at(11, 1)
+    assert bucket.consume_at(10, 2)
+    assert bucket.ts == 2
+    assert calls == []
+
+
+def test_monotonic():
+    ticks = 0
+    fake_clock = lambda: ticks
+
+    bucket = MonotonicTokenBucket(rate=0.1, limit=20, clock=fake_clock)
+    assert bucket.tokens == 20
+    assert bucket.consume(20)
+    assert not bucket.consume(0.1)
+
+    # A hundred thousand refills of a nanosecond each add up to exactly a
+    # tenth of a millisecond's worth of tokens.
+    for _ in range(100000):
+        ticks += 1
+        bucket.consume_at(0, ticks)
+    assert bucket._available == 10 ** 13
+    assert bucket.consume(0.00001)
+    assert bucket._available == 0
+    assert not bucket.consume(0.00001)
+
+    ticks += 10 ** 10
+    assert bucket.tokens == 1
+    ticks += 10 ** 12
+    assert bucket.tokens == 20
+
+
+def test_monotonic_pickle():
+    original = MonotonicTokenBucket(5, 20)
+    original.consume(1)
+    unpickled = pickle.loads(pickle.dumps(original))
+    for attr in MonotonicTokenBucket.__slots__:
+        assert getattr(original, attr) == getattr(unpickled, attr)
+
+
+def test_time_until():
+    ticks = 0
+    fake_clock = lambda: ticks
+
+    for cls, quarter in ((TokenBucket, 0.25),
+                         (MonotonicTokenBucket, 10 ** 9 // 4)):
+        bucket = cls(rate=4, limit=20, clock=fake_clock)
+        assert bucket.time_until(20) == 0
+        assert bucket.time_until(21) is None
+        assert bucket.time_until(-1) is None
+        assert bucket.consume(20)
+        assert bucket.time_until(2) == 0.5
+        ticks += quarter
+        assert bucket.time_until(2) == 0.25
+        assert cls(rate=0, limit=20, clock=fake_clock).time_until(20) == 0
+        bucket = cls(rate=0, limit=20, clock=fake_clock)
+        bucket.consume(1)
+        assert bucket.time_until(20) is None
+
+
+def test_peek():
+    for cls, second in ((TokenBucket, 1), (MonotonicTokenBucket, 10 ** 9)):
+        bucket = cls(rate=4, limit=20, clock=lambda: 0)
+        assert bucket.consume(20)
+        assert bucket.peek(second) == 4
+        assert bucket.peek(10 * second) == 20
+        # Peeking doesn't refill the bucket.
+        assert bucket.ts == 0
+        assert bucket.peek(second) == 4
+        assert bucket.time_until(2) == 0.5
+        assert bucket.ts == 0
+
+
+def test_acquire():
+    for cls in (TokenBucket, MonotonicTokenBucket):
+        bucket = cls(rate=100, limit=2)
+        started = time.time()
+        assert bucket.acquire(2)
+        assert bucket.acquire(2)
+        assert time.time() - started >= 0.015
+        assert not bucket.acquire(2, timeout=0.001)
+        assert not bucket.acquire(3)
+        assert asyncio.run(bucket.acquire_async(2, timeout=1))
+
+
+def test_acquire_partial_wait():
+    ticks = 0
+    fake_clock = lambda: ticks
+    bucket = TokenBucket(rate=1, limit=4, clock=fake_clock)
+    assert bucket.consume(4)
+
+    # The two seconds needed run past the timeout, so the sleep is cut
+    # short at the timeout for a last attempt, which fails.
+    steps = bucket._acquisition(2, timeout=0.5)
+    assert next(steps) == 0.5
+    ticks += 0.5
+    try:
+        next(steps)
+        assert False, "Should have given up at the timeout"
+    except StopIteration as stop:
+        assert stop.value is False
+
+    # A last attempt that finds enough tokens succeeds.
+    steps = bucket._acquisition(2, timeout=0.5)
+    assert next(steps) == 0.5
+    ticks += 2
+    try:
+        next(steps)
+        assert False, "Should have acquired the tokens"
+    except StopIteration as stop:
+        assert stop.value is True
+
+    bucket = TokenBucket(rate=100, limit=2)
+    assert bucket.consume(2)
+    started = time.time()
+    assert not bucket.acquire(2, timeout=0.005)
+    assert time.time() - started >= 0.005
+
+
+def test_refund():
+    ticks = 0
+    fake_clock = lambda: ticks
+    for cls in (TokenBucket, MonotonicTokenBucket, GCRABucket):
+        bucket = cls(rate=1, limit=10, clock=fake_clock)
+        assert bucket.consume(6)
+        bucket.refund(2)
+        assert bucket.peek(0) == 6
+        # Refunds never overfill the bucket.
+        bucket.refund(20)
+        assert bucket.peek(0) == 10
+        assert bucket.consume(10)
+        assert not bucket.consume(1)
+
+
+def test_gcra_matches_token_bucket():
+    rng = random.Random(42)
+    ticks = 0
+    fake_clock = lambda: ticks
+    for rate, limit in ((4, 20), (0.5, 3), (64, 1)):
+        expected = TokenBucket(rate=rate, limit=limit, clock=fake_clock)
+        bucket = GCRABucket(rate=rate, limit=limit, clock=fake_clock)
+        for _ in range(2000):
+            ticks += rng.randrange(8) / 8
+            tokens = rng.randrange(-1, limit + 2)
+            assert bucket.time_until(tokens) == expected.time_until(tokens)
+            assert bucket.consume(tokens) == expected.consume(tokens)
+            assert bucket.tokens == expected.tokens
+
+
+def test_gcra():
+    ticks = 0
+    fake_clock = lambda: ticks
+    bucket = GCRABucket(rate=4, limit=20, clock=fake_clock)
+    assert bucket.consume(20)
+    assert bucket._tat == bucket.ts == 5
+    ticks = 1
+    assert not bucket.consume(5)
+    assert bucket.peek(1) == 4
+    ticks = 10
+    assert bucket.tokens == 20
+    assert bucket._tat == 5
+    # Even a denied request counts as a use.
+    assert not bucket.consume(21)
+    assert bucket.ts == 10
+    assert (bucket.rate, bucket.limit, bucket.clock) == (4, 20, fake_clock)
+
+    bucket = GCRABucket(rate=4, limit=20)
+    bucket.consume(10)
+    copy = pickle.loads(pickle.dumps(bucket))
+    assert copy._tat == bucket._tat
+    # Buckets with the same settings share them, even across pickling.
+    assert copy.params is bucket.params
+    assert GCRABucket(rate=4, limit=20).params is bucket.params
+    assert copy.limit == 20
+
+    try:
+        GCRABucket(rate=0, limit=20)
+        assert False, "A zero rate should be rejected"
+    except ValueError:
+        pass
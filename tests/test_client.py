@@ -0,0 +1,340 @@
+from bukkit.client import Client, ClientPool, MultiClient, ProtocolError
+from bukkit.server import Registry, UnixServer
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+class ServerThread(object):
+    """
+    Runs a server on its own event loop in a background thread.
+    """
+
+    def __init__(self, registry=None):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'bukkit.sock')
+        self.datagram_path = os.path.join(self.tmpdir, 'bukkit.dgram')
+        self.loop = asyncio.new_event_loop()
+        self.server = UnixServer(
+            self.path, registry=registry, datagram_path=self.datagram_path)
+        self.thread = threading.Thread(target=self.loop.run_forever)
+
+    def __enter__(self):
+        self.loop.run_until_complete(self.server.start())
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        asyncio.run_coroutine_threadsafe(
+            self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        shutil.rmtree(self.tmpdir)
+
+
+class ServerProcesses(object):
+    """
+    Runs several servers, each in its own process.
+    """
+
+    def __init__(self, count):
+        self.tmpdir = tempfile.mkdtemp()
+        self.paths = [
+            os.path.join(self.tmpdir, 'bukkit%d.sock' % i)
+            for i in range(count)]
+        self.procs = []
+
+    def start(self, path):
+        self.procs.append(subprocess.Popen(
+            [sys.executable, '-m', 'bukkit.server', path]))
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+    def __enter__(self):
+        for path in self.paths:
+            self.start(path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for proc in self.procs:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(self.tmpdir)
+
+
+def test_create_and_consume():
+    with ServerThread() as server:
+        with Client(server.path) as client:
+            client.create(rate=1, limit=2, timeout=60, collection='test')
+            assert client.consume('test', 'x', 2)
+            assert not client.consume('test', 'x', 1)
+            try:
+                client.consume('missing', 'x', 1)
+                assert False, "Should not be able to use 'missing'"
+            except ProtocolError as exc:
+                assert str(exc) == "No such collection: 'missing'"
+            # The connection is still usable after an error.
+            assert client.consume('test', 'y', 1)
+
+
+def test_tiers():
+    for binary in (False, True):
+        with ServerThread() as server:
+            with Client(server.path, binary=binary) as client:
+                client.create(rate=1, limit=2, timeout=60, collection='test')
+                client.define_tier('test', 'paid:', rate=1, limit=10)
+                assert client.consume('test', 'paid:x', 5)
+                assert not client.consume('test', 'free:x', 5)
+                with client.pipeline() as pipe:
+                    pipe.define_tier('test', 'gold:', rate=1, limit=20)
+                    pipe.consume('test', 'gold:x', 15)
+                assert pipe.results == [True, True]
+
+
+def test_pipeline():
+    with ServerThread() as server:
+        with Client(server.path) as client:
+            with client.pipeline() as pipe:
+                pipe.create(rate=1, limit=2, timeout=60, collection='test')
+                for _ in range(3):
+                    pipe.consume('test', 'x', 1)
+            assert pipe.results == [True, True, True, False]
+
+            pipe = client.pipeline()
+            pipe.consume('missing', 'x', 1)
+            pipe.consume('test', 'y', 1)
+            try:
+                pipe.execute()
+                assert False, "Should not be able to use 'missing'"
+            except ProtocolError:
+                pass
+            # Every response was read, so the connection is still in step.
+            assert client.consume('test', 'y', 1)
+            assert not client.consume('test', 'y', 1)
+
+
+def test_retry_after():
+    for use_binary in (False, True):
+        with ServerThread() as server:
+            with Client(server.path, binary=use_binary) as client:
+                client.create(rate=100, limit=2, timeout=60, collection='test')
+                assert client.try_consume('test', 'x', 2) == (True, 0.0)
+                succeeded, retry_after = client.try_consume('test', 'x', 1)
+                assert not succeeded
+                assert 0 < retry_after <= 0.01
+                assert client.try_consume('test', 'x', 3) == (
+                    False, float('inf'))
+
+                assert client.acquire('test', 'x', 2, timeout=1)
+                assert not client.acquire('test', 'x', 2, timeout=0.001)
+                assert not client.acquire('test', 'x', 3)
+
+                pool = ClientPool(server.path, binary=use_binary)
+                assert pool.acquire('test', 'y', 2)
+                assert pool.acquire('test', 'y', 2)
+                pool.close()
+
+
+def test_binary():
+    with ServerThread() as server:
+        with Client(server.path, binary=True) as client:
+            client.create(rate=1, limit=2, timeout=60, collection='test')
+            assert client.consume('test', 'x', 2)
+            assert not client.consume('test', 'x', 1)
+            with client.pipeline() as pipe:
+                pipe.consume('test', 'y', 1)
+                pipe.consume('test', 'y', 1)
+                pipe.consume('test', 'y', 1)
+            assert pipe.results == [True, True, False]
+            try:
+                client.consume('missing', 'x', 1)
+                assert False, "Should not be able to use 'missing'"
+            except ProtocolError as exc:
+                assert str(exc) == "No such collection: 'missing'"
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def test_charge():
+    with ServerThread() as server:
+        with Client(
+                server.path, datagram_path=server.datagram_path,
+                max_datagram=100, flush_interval=None) as client:
+            client.create(rate=0, limit=100, timeout=60, collection='test')
+            for _ in range(10):
+                client.charge('test', 'x', 1)
+            # Frames that don't fit have pushed the earlier ones out.
+            assert 0 < client.datagrams.size <= 100
+            client.flush()
+            assert client.datagrams.size == 0
+            wait_for(lambda: client.peek('test', 'x')[0] == 90)
+
+        with Client(
+                server.path, datagram_path=server.datagram_path,
+                flush_interval=0.01) as client:
+            client.charge('test', 'x', 5)
+            wait_for(lambda: client.peek('test', 'x')[0] == 85)
+            client.charge('test', 'y', 5)
+        # Closing sends anything still buffered.
+        with Client(server.path) as client:
+            wait_for(lambda: client.peek('test', 'y')[0] == 95)
+            try:
+                client.charge('test', 'x', 1)
+                assert False, "Should not be able to charge"
+            except ValueError as exc:
+                assert str(exc) == "No datagram socket given"
+
+
+def test_charge_drops_when_full():
+    with ServerThread() as server:
+        # A socket nobody reads from soon fills up.
+        path = os.path.join(server.tmpdir, 'unread.dgram')
+        unread = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        unread.bind(path)
+        try:
+            with Client(
+                    server.path, datagram_path=path, max_datagram=100,
+                    flush_interval=None) as client:
+                started = time.monotonic()
+                for _ in range(10000):
+                    client.charge('test', 'x', 1)
+                client.flush()
+                # Charges are dropped and counted rather than blocking.
+                assert time.monotonic() - started < 5
+                assert 0 < client.dropped < 10000
+            with Client(server.path) as client:
+                assert client.dropped == 0
+        finally:
+            unread.close()
+
+
+def test_stats():
+    for binary in (False, True):
+        with ServerThread(Registry(metrics=True)) as server:
+            with Client(server.path, binary=binary) as client:
+                client.create(rate=1, limit=2, timeout=60, collection='test')
+                client.consume('test', 'x', 2)
+                client.consume('test', 'x', 1)
+                stats = client.stats('test')
+                assert stats['buckets'] == 1
+                assert stats['allowed'] == 1
+                assert stats['denied'] == 1
+                assert stats['latency.C.count'] == 2
+                assert stats['latency.C.p99'] > 0
+                try:
+                    client.stats('missing')
+                    assert False, "Should not be able to use 'missing'"
+                except ProtocolError as exc:
+                    assert str(exc) == "No such collection: 'missing'"
+
+
+def test_query():
+    for binary in (False, True):
+        with ServerThread() as server:
+            with Client(server.path, binary=binary) as client:
+                client.create(rate=1, limit=2, timeout=60, collection='test')
+                started = time.time()
+                client.consume('test', 'x', 2)
+                (x_tokens, x_seen), (y_tokens, y_seen) = client.query(
+                    'test', ['x', 'y'])
+                assert 0 <= x_tokens < 1
+                assert started <= x_seen <= time.time()
+                assert (y_tokens, y_seen) == (2, None)
+                assert client.peek('test', 'y') == (2, None)
+                assert client.query('test', []) == []
+                assert client.consume('test', 'y', 2)
+
+
+def test_chain():
+    for binary in (False, True):
+        with ServerThread() as server:
+            with Client(server.path, binary=binary) as client:
+                client.create(rate=1, limit=2, timeout=60, collection='users')
+                client.create(rate=1, limit=3, timeout=60, collection='all')
+                assert client.consume_chain(
+                    [('users', 'alice'), ('all', 'x')], 2)
+                succeeded, retry_after = client.try_consume_chain(
+                    [('users', 'bob'), ('all', 'x')], 2)
+                assert not succeeded
+                assert 0 < retry_after <= 1
+                with client.pipeline() as pipe:
+                    pipe.consume_chain([('users', 'bob'), ('all', 'x')], 1)
+                    pipe.consume('users', 'bob', 2)
+                assert pipe.results == [True, False]
+
+
+def test_pool():
+    with ServerThread() as server:
+        pool = ClientPool(server.path, size=2)
+        pool.create(rate=0, limit=1000, timeout=60, collection='test')
+        granted = []
+
+        def worker():
+            count = 0
+            for _ in range(100):
+                if pool.consume('test', 'x', 1):
+                    count += 1
+            granted.append(count)
+
+        threads = [threading.Thread(target=worker) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(granted) == 1000
+        assert pool.idle.qsize() <= 2
+        pool.close()
+        assert pool.idle.qsize() == 0
+
+
+def test_multi_client():
+    with ServerProcesses(4) as servers:
+        # Ring positions come from the node names alone, not the temporary
+        # socket paths, so where each bucket lands is the same every run.
+        nodes = dict(zip('abc', servers.paths))
+        with MultiClient(nodes) as client:
+            client.create(rate=0.01, limit=2, timeout=60, collection='test')
+            names = ['key:%d' % i for i in range(3000)]
+            for name in names:
+                assert client.consume('test', name, 2)
+            assert not client.consume('test', 'key:0', 1)
+            client.define_tier('test', 'paid:', rate=0.01, limit=10)
+            stats = client.stats('test')
+            assert sorted(stats) == ['a', 'b', 'c']
+            assert sum(s['buckets'] for s in stats.values()) == len(names)
+            for node in nodes:
+                assert abs(stats[node]['buckets'] - 1000) < 30
+            states = client.query('test', ['key:1', 'missing', 'key:2'])
+            assert [tokens < 1 for tokens, _ in states] == [True, False, True]
+            assert states[1] == (2, None)
+
+            # Adding a server moves a share of the buckets to it, and no
+            # others, where they start out full again.
+            before = dict(
+                (name, client.node_for('test', name)) for name in names)
+            client.add_node(servers.paths[3], 'd')
+            moved = [
+                name for name in names
+                if client.node_for('test', name) != before[name]]
+            assert all(client.node_for('test', name) == 'd' for name in moved)
+            assert 625 < len(moved) < 675
+            for name in names[:100]:
+                assert client.consume('test', name, 2) == (name in moved)
+            # Tiers are defined on the new server too.
+            for name in moved[:10]:
+                assert client.consume('test', 'paid:' + name, 10)
+
+            client.remove_node('d')
+            assert not client.consume('test', moved[0], 2)
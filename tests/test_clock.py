@@ -0,0 +1,54 @@
+from bukkit import Collection
+from bukkit.clock import CoarseClock
+import asyncio
+import time
+
+
+def test_tick():
+    ticks = [0]
+    clock = CoarseClock(source=lambda: ticks[0])
+    ticks[0] = 5
+    assert clock() == clock.now() == 0
+    clock.tick()
+    assert clock() == clock.now() == 5
+
+    # Every bucket in a collection sees the same cached time.
+    buckets = Collection(rate=1, limit=10, timeout=30, clock=clock.now)
+    buckets.consume('x', 10)
+    buckets.consume('y', 10)
+    assert buckets['x'].ts == buckets['y'].ts == 5
+    ticks[0] = 7
+    assert buckets['x'].tokens == 0
+    clock.tick()
+    assert buckets['x'].tokens == 2
+
+
+def test_thread():
+    clock = CoarseClock(resolution=0.001)
+    started = clock()
+    clock.start()
+    try:
+        time.sleep(0.05)
+        assert clock() > started
+        assert abs(clock() - time.time()) < 0.05
+    finally:
+        clock.stop()
+    assert clock.thread is None
+    stopped = clock()
+    time.sleep(0.01)
+    assert clock() == stopped
+
+
+def test_event_loop():
+    async def run():
+        clock = CoarseClock(resolution=0.001)
+        started = clock()
+        clock.attach(asyncio.get_running_loop())
+        await asyncio.sleep(0.05)
+        assert clock() > started
+        clock.detach()
+        stopped = clock()
+        await asyncio.sleep(0.01)
+        assert clock() == stopped
+
+    asyncio.run(run())
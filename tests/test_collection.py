@@ -1,5 +1,9 @@
-from bukkit import Collection
-import cPickle as pickle
+from bukkit import (
+    Collection, GCRABucket, MonotonicTokenBucket, PrefixResolver, TokenBucket,
+    consume_chain)
+import asyncio
+import pickle
+import time
 
 
 def test_creation():
@@ -36,7 +40,7 @@ def test_get():
     try:
         buckets['thingy']
         assert False, "Should not be able to look up 'thingy'"
-    except IndexError, exc:
+    except IndexError as exc:
         assert str(exc) == "No such bucket: 'thingy'"
 
     buckets.consume('thingy', 5)
@@ -49,7 +53,7 @@ def test_purge():
     buckets = Collection(rate=1, limit=20, timeout=15, clock=fake_clock)
 
     # Create a bunch of buckets for messing with.
-    for i in xrange(4):
+    for i in range(4):
         buckets.consume('x' + str(i), 0)
     assert sorted(buckets.node_map.keys()) == ['x0', 'x1', 'x2', 'x3']
 
@@ -100,3 +104,387 @@ def test_pickle():
     # everything was unpickled properly.
     assert sorted(buckets.node_map.keys()) == sorted(unpickled.node_map.keys())
     assert len(list(buckets.head_node)) == len(list(unpickled.head_node))
+
+
+def test_consume_many():
+    ticks = 0
+    calls = []
+
+    def fake_clock():
+        calls.append(None)
+        return ticks
+
+    buckets = Collection(rate=5, limit=10, timeout=31, clock=fake_clock)
+    buckets.consume('c', 0)
+    del calls[:]
+
+    results = buckets.consume_many(
+        [('a', 6), ('b', 1), ('a', 6), ('c', 1), ('a', 4)])
+    assert results == [True, True, False, True, True]
+    assert buckets['a']._available == 0
+    assert buckets['b']._available == 9
+    # New buckets are created as of the same single reading of the clock.
+    assert len(calls) == 1
+    assert buckets['a'].ts == buckets['b'].ts == ticks
+
+    # Most recently used first, each key exactly once.
+    order = []
+    node = buckets.head_node.prev_node
+    while node is not buckets.tail_node:
+        order.append(buckets.key_map[node])
+        node = node.prev_node
+    assert order == ['a', 'c', 'b']
+
+    # Likewise for the other bucket classes, and for resolved buckets.
+    resolver = PrefixResolver()
+    tiered = Collection(
+        rate=5, limit=10, timeout=31, clock=fake_clock, resolver=resolver)
+    resolver.add('paid:', tiered.policy(10, 100))
+    for buckets in (
+            tiered,
+            Collection(
+                rate=5, limit=10, timeout=31, clock=fake_clock,
+                bucket_class=MonotonicTokenBucket),
+            Collection(
+                rate=5, limit=10, timeout=31, clock=fake_clock,
+                bucket_class=GCRABucket)):
+        del calls[:]
+        buckets.consume_many([('a', 6), ('paid:b', 6)])
+        assert len(calls) == 1
+
+
+def test_incremental_purge():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(
+        rate=1, limit=20, timeout=15, clock=fake_clock, purge_step=2)
+
+    for i in range(5):
+        buckets.consume('x' + str(i), 0)
+    assert buckets.expired == 0
+
+    # Each consume evicts at most two expired buckets from the tail.
+    ticks += 20
+    buckets.consume('y', 0)
+    assert sorted(buckets.node_map.keys()) == ['x2', 'x3', 'x4', 'y']
+    assert buckets.expired == 2
+    buckets.consume('y', 0)
+    assert sorted(buckets.node_map.keys()) == ['x4', 'y']
+    buckets.consume('y', 0)
+    assert sorted(buckets.node_map.keys()) == ['y']
+    assert buckets.expired == 5
+
+    buckets.purge()
+    assert buckets.expired == 5
+
+
+def test_max_buckets():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(
+        rate=1, limit=20, timeout=15, clock=fake_clock, max_buckets=3)
+
+    for i in range(3):
+        buckets.consume('x' + str(i), 0)
+    buckets.consume('x0', 0)
+    assert buckets.evicted == 0
+
+    # The least recently used bucket makes way for the new one.
+    buckets.consume('x3', 0)
+    assert sorted(buckets.node_map.keys()) == ['x0', 'x2', 'x3']
+    assert sorted(buckets.key_map.values()) == ['x0', 'x2', 'x3']
+    assert buckets.evicted == 1
+
+    buckets.consume_many([('x4', 1), ('x5', 1), ('x0', 1)])
+    assert sorted(buckets.node_map.keys()) == ['x0', 'x4', 'x5']
+    assert buckets.evicted == 4
+    assert len(list(buckets.tail_node)) == 5
+
+
+def test_max_buckets_within_batch():
+    buckets = Collection(
+        rate=1, limit=2, timeout=15, clock=lambda: 0, max_buckets=2)
+
+    # New buckets count against the cap as soon as they're created.
+    buckets.consume_many([('a', 1), ('b', 1), ('c', 1), ('d', 1)])
+    assert sorted(buckets.node_map.keys()) == ['c', 'd']
+    assert buckets.evicted == 2
+    assert len(list(buckets.tail_node)) == 4
+
+
+def test_max_buckets_spares_batch():
+    buckets = Collection(
+        rate=1, limit=2, timeout=15, clock=lambda: 0, max_buckets=3)
+    for key in ('p', 'q', 'r'):
+        buckets.consume(key, 0)
+
+    # Using 'p' makes it the most recently used, so the new buckets evict
+    # 'q' and 'r' rather than it, and it doesn't come back full to grant
+    # more than its limit.
+    results = buckets.consume_many([('p', 2), ('s', 1), ('t', 1), ('p', 1)])
+    assert results == [True, True, True, False]
+    assert sorted(buckets.node_map.keys()) == ['p', 's', 't']
+    assert buckets.evicted == 2
+
+
+def test_resolver():
+    ticks = 0
+    fake_clock = lambda: ticks
+    resolver = PrefixResolver()
+    buckets = Collection(
+        rate=1, limit=10, timeout=30, clock=fake_clock, resolver=resolver)
+    resolver.add('paid:', buckets.policy(10, 100))
+
+    assert buckets.peek('paid:x') == (100, None)
+    assert buckets.time_until('paid:x', 50) == 0.0
+    assert buckets.time_until('free:x', 50) is None
+    assert buckets.consume('paid:x', 50)
+    assert not buckets.consume('free:x', 50)
+    assert buckets.consume('free:x', 10)
+    assert buckets.consume('paid:y', 0)
+    assert buckets['paid:x'].policy is buckets['paid:y'].policy
+    assert buckets['free:x'].policy is not buckets['paid:x'].policy
+    ticks += 1
+    assert buckets['paid:x'].tokens == 60
+    assert buckets['free:x'].tokens == 1
+
+    # Every tier shares the one purge.
+    ticks += 30
+    buckets.consume('free:z', 1)
+    buckets.purge()
+    assert sorted(buckets.node_map) == ['free:z']
+
+    unpickled = pickle.loads(pickle.dumps(
+        Collection(rate=1, limit=10, timeout=30, resolver=PrefixResolver({
+            'paid:': Collection(1, 10, 30).policy(10, 100)}))))
+    unpickled.consume('paid:x', 50)
+    assert unpickled['paid:x'].limit == 100
+
+    try:
+        Collection(
+            rate=1, limit=10, timeout=30, bucket_class=GCRABucket,
+            resolver=resolver)
+        assert False, "Should not accept a resolver with GCRABucket"
+    except ValueError as exc:
+        assert str(exc) == "Resolvers need TokenBucket buckets"
+
+
+def test_bucket_class():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(
+        rate=1, limit=20, timeout=15, clock=fake_clock,
+        bucket_class=MonotonicTokenBucket)
+    buckets.consume('x', 5)
+    assert isinstance(buckets['x'], MonotonicTokenBucket)
+
+    # The timeout is in seconds, though the clock ticks in nanoseconds.
+    ticks += 14 * 10 ** 9
+    buckets.purge()
+    assert 'x' in buckets
+    assert buckets['x'].tokens == 20
+    ticks += 15 * 10 ** 9
+    buckets.purge()
+    assert 'x' not in buckets
+
+    assert Collection(1, 20, 15).clock is time.time
+    buckets = Collection(1, 20, 15, bucket_class=MonotonicTokenBucket)
+    assert buckets.clock is time.monotonic_ns
+
+
+def test_gcra_bucket_class():
+    ticks = 0
+    fake_clock = lambda: ticks
+    expected = Collection(rate=4, limit=20, timeout=31, clock=fake_clock)
+    buckets = Collection(
+        rate=4, limit=20, timeout=31, clock=fake_clock,
+        bucket_class=GCRABucket)
+    for i in range(200):
+        ticks += 0.25
+        key = 'key:%d' % (i % 7)
+        tokens = i % 9
+        assert buckets.consume(key, tokens) == expected.consume(key, tokens)
+    # Every bucket shares one set of settings.
+    assert len(set(buckets[k].params for k in buckets.node_map)) == 1
+    assert buckets.consume_many([('x', 20), ('x', 1)]) == [True, False]
+
+    # Buckets expire once they've been full for the timeout, which is at
+    # most limit / rate seconds after they were last used.
+    ticks += 30
+    buckets.purge()
+    assert 'x' in buckets
+    assert buckets.peek('x') == (20, ticks - 25)
+    ticks += 5
+    buckets.purge()
+    assert 'x' in buckets
+    ticks += 1
+    buckets.purge()
+    assert len(buckets) == 0
+
+
+def test_gcra_purge():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(
+        rate=1, limit=10, timeout=30, clock=fake_clock,
+        bucket_class=GCRABucket)
+    for i in range(1000):
+        ticks += 0.01
+        # Drain every tenth bucket, which then takes ten seconds to refill.
+        buckets.consume('key:%d' % i, 10 if i % 10 == 0 else 1)
+
+    # A drained bucket near the tail holds up those behind it until it's
+    # been full for the timeout, so no more than ten seconds.
+    ticks = 40
+    assert buckets.peek('key:0') == (10, 10.01)
+    buckets.purge()
+    assert buckets.expired == 0
+    ticks = 41
+    buckets.purge()
+    assert buckets.expired == 100
+    ticks = 50
+    buckets.purge()
+    assert len(buckets) == 0
+
+
+def test_time_until_and_acquire():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(rate=4, limit=20, timeout=31, clock=fake_clock)
+    assert buckets.time_until('x', 20) == 0
+    assert buckets.time_until('x', 21) is None
+    assert 'x' not in buckets
+    buckets.consume('x', 20)
+    buckets.consume('y', 0)
+    assert buckets.time_until('x', 2) == 0.5
+    # Checking the time doesn't move the bucket in the cache.
+    assert buckets.head_node.prev_node.obj is buckets['y']
+
+    buckets = Collection(rate=100, limit=2, timeout=31)
+    assert buckets.acquire('x', 2)
+    assert buckets.acquire('x', 2, timeout=1)
+    assert not buckets.acquire('x', 2, timeout=0.001)
+    assert asyncio.run(buckets.acquire_async('x', 2, timeout=1))
+
+
+def test_peek():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(rate=4, limit=20, timeout=31, clock=fake_clock)
+    assert buckets.peek('x') == (20, None)
+    assert 'x' not in buckets
+    buckets.consume('x', 20)
+    buckets.consume('y', 0)
+    ticks = 1
+    assert buckets.peek('x') == (4, 0)
+    # Peeking doesn't move the bucket in the cache or count as a use.
+    assert buckets.head_node.prev_node.obj is buckets['y']
+    assert buckets['x'].ts == 0
+
+
+def test_metrics():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(rate=1, limit=2, timeout=30, clock=fake_clock)
+    buckets.consume('x', 1)
+    assert buckets.metrics is None
+    assert buckets.stats() == {'buckets': 1, 'expired': 0, 'evicted': 0}
+
+    buckets = Collection(
+        rate=1, limit=2, timeout=30, clock=fake_clock, metrics=True)
+    assert buckets.consume('x', 2)
+    assert not buckets.consume('x', 1)
+    assert buckets.consume_many([('y', 1), ('y', 1), ('y', 1)]) == [
+        True, True, False]
+    ticks = 31
+    buckets.purge()
+    stats = buckets.stats()
+    assert stats['buckets'] == len(buckets) == 0
+    assert stats['expired'] == 2
+    assert stats['allowed'] == 3
+    assert stats['denied'] == 2
+    assert stats['created'] == 2
+    assert stats['purges'] == 1
+    assert stats['purge_seconds'] >= 0
+    # Whether metrics are collected survives pickling, but not the counts.
+    buckets = Collection(rate=1, limit=2, timeout=30, metrics=True)
+    buckets.consume('x', 1)
+    copy = pickle.loads(pickle.dumps(buckets))
+    assert copy.metrics is not None
+    assert copy.metrics.allowed == 0
+
+
+def test_consume_chain():
+    ticks = 0
+    fake_clock = lambda: ticks
+    users = Collection(rate=1, limit=5, timeout=30, clock=fake_clock)
+    tenants = Collection(
+        rate=1, limit=8, timeout=30, clock=fake_clock, metrics=True)
+    backend = Collection(
+        rate=1, limit=10, timeout=30, clock=fake_clock,
+        bucket_class=GCRABucket)
+
+    def chain(user, tenant):
+        return [(users, user), (tenants, tenant), (backend, 'global')]
+
+    assert consume_chain(chain('alice', 'acme'), 5)
+    assert not consume_chain(chain('alice', 'acme'), 1)
+    # Bob has tokens, but his tenant is short, so nothing is taken from
+    # him or the global bucket.
+    assert not consume_chain(chain('bob', 'acme'), 4)
+    assert users['bob'].tokens == 5
+    assert backend['global'].tokens == 5
+    assert consume_chain(chain('bob', 'acme'), 3)
+    assert tenants['acme'].tokens == 0
+    assert consume_chain(chain('carol', 'initech'), 2)
+    # Now the global bucket is the one that's short.
+    assert not consume_chain(chain('dave', 'initech'), 1)
+    assert users['dave'].tokens == 5
+    assert tenants['initech'].tokens == 6
+
+    # The same bucket can appear more than once.
+    ticks = 100
+    assert consume_chain([(users, 'erin'), (users, 'erin')], 2)
+    assert not consume_chain([(users, 'erin'), (users, 'erin')], 1)
+    assert users['erin'].tokens == 1
+
+    # A refused chain puts back what it took without undoing any refill,
+    # and still counts as a use of every bucket in it.
+    ticks = 101
+    assert not consume_chain(
+        [(users, 'frank'), (users, 'erin'), (backend, 'global')], 3)
+    assert users['frank']._available == 5
+    assert users['erin']._available == 2
+    assert users['erin'].ts == backend['global'].ts == 101
+
+    assert tenants.metrics.allowed == 3
+    assert tenants.metrics.denied == 3
+
+    # Looking up a later level evicts some other bucket rather than an
+    # earlier level's, so a refund reaches the bucket that's kept.
+    ticks = 200
+    capped = Collection(
+        rate=1, limit=5, timeout=30, clock=fake_clock, max_buckets=2,
+        purge_step=1)
+    capped.consume('grace', 0)
+    capped.consume('heidi', 0)
+    capped.consume('grace', 0)
+    users.consume('drained', 5)
+    assert not consume_chain(
+        [(capped, 'heidi'), (capped, 'ivan'), (users, 'drained')], 1)
+    assert sorted(capped.node_map) == ['heidi', 'ivan']
+    assert capped['heidi']._available == 5
+    # A chain purges expired buckets as consume does.
+    ticks = 215
+    capped.consume('heidi', 0)
+    ticks = 231
+    assert consume_chain([(capped, 'heidi'), (users, 'drained')], 1)
+    assert sorted(capped.node_map) == ['heidi']
+    assert capped.expired == 1
+    # A chain the cap can't hold at once is refused before taking anything.
+    try:
+        consume_chain([(capped, 'judy'), (capped, 'ken'), (capped, 'leo')], 1)
+    except ValueError as exc:
+        assert str(exc) == "Too many buckets in the chain for max_buckets"
+    else:
+        assert False
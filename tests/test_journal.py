@@ -0,0 +1,244 @@
+from bukkit.journal import Journal
+from bukkit.server import Registry
+import asyncio
+import os
+import shutil
+import tempfile
+
+
+def cache_order(buckets):
+    order = []
+    node = buckets.tail_node.next_node
+    while node is not buckets.head_node:
+        order.append(buckets.key_map[node])
+        node = node.next_node
+    return order
+
+
+def with_tmpdir(func):
+    def wrapper():
+        tmpdir = tempfile.mkdtemp()
+        try:
+            func(os.path.join(tmpdir, 'journal'))
+        finally:
+            shutil.rmtree(tmpdir)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+def journalled(path, clock, sync_interval=0.1):
+    journal = Journal(path, sync_interval=sync_interval)
+    registry = Registry(clock=clock)
+    journal.replay(registry)
+    journal.open()
+    registry.journal = journal
+    return registry
+
+
+def restore(path, clock):
+    registry = Registry(clock=clock)
+    Journal(path).replay(registry)
+    return registry
+
+
+def assert_same(registry, restored):
+    assert sorted(registry.collections) == sorted(restored.collections)
+    for name, buckets in registry.collections.items():
+        other = restored.collections[name]
+        for attr in ('rate', 'limit', 'timeout'):
+            assert getattr(buckets, attr) == getattr(other, attr)
+        assert cache_order(other) == cache_order(buckets)
+        for key in buckets.node_map:
+            assert other[key].ts == buckets[key].ts
+            assert other[key]._available == buckets[key]._available
+
+
+@with_tmpdir
+def test_round_trip(path):
+    ticks = 0
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('default', 2, 20, 15)
+    registry.create('other', 1, 5, 15)
+    registry.define_tier('other', 'paid:', 1, 50)
+    for i in range(5):
+        ticks += 1
+        assert registry.consume('default', 'x' + str(i), i)
+    ticks += 1
+    assert registry.consume('default', 'x1', 3)
+    assert registry.consume('other', 'ünïcode', 0.5)
+    assert not registry.consume('other', 'ünïcode', 10)
+    assert registry.consume_chain(
+        [('default', 'x2'), ('other', 'tenant')], 1)
+    assert registry.consume('other', 'paid:x', 40)
+    assert registry.consume_many(
+        'default', [('x4', 1), ('x3', 1), ('x4', 1)]) == [True] * 3
+    registry.journal.close()
+
+    restored = restore(path, clock)
+    assert_same(registry, restored)
+    assert restored.collections['other']['paid:x'].limit == 50
+
+
+@with_tmpdir
+def test_sync_per_write(path):
+    ticks = 1
+    clock = lambda: ticks
+    registry = journalled(path, clock, sync_interval=0)
+    registry.create('default', 2, 20, 15)
+    registry.consume('default', 'x', 5)
+    assert not registry.journal.pending
+    # Nothing's lost, even without closing the journal.
+    assert_same(registry, restore(path, clock))
+    registry.journal.close()
+
+
+@with_tmpdir
+def test_batched_sync(path):
+    ticks = 1
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('default', 2, 20, 15)
+    registry.consume('default', 'x', 5)
+    assert len(registry.journal.pending) == 2
+    assert 'default' not in restore(path, clock).collections
+    registry.journal.sync()
+    assert not registry.journal.pending
+    assert_same(registry, restore(path, clock))
+    registry.journal.close()
+
+
+@with_tmpdir
+def test_torn_record(path):
+    ticks = 1
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('default', 2, 20, 15)
+    registry.consume('default', 'x', 5)
+    registry.journal.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as fh:
+        fh.write(b"\x00\x00\x00\x20\x00")
+
+    registry = journalled(path, clock)
+    assert os.path.getsize(path) == size
+    assert registry.collections['default']['x']._available == 15
+    registry.consume('default', 'x', 5)
+    registry.journal.close()
+    assert restore(path, clock).collections['default']['x']._available == 10
+
+
+@with_tmpdir
+def test_compaction(path):
+    ticks = 0
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('replaced', 1, 1, 1)
+    registry.create('default', 2, 20, 15)
+    registry.define_tier('default', 'paid:', 2, 50)
+    for i in range(10):
+        ticks += 1
+        registry.consume('default', 'x' + str(i % 4), 1)
+    registry.create('replaced', 2, 2, 2)
+    registry.consume('replaced', 'y', 1)
+    registry.journal.sync()
+    before = os.path.getsize(path)
+
+    asyncio.run(registry.journal.compact(registry, chunk=2))
+    assert os.path.exists(registry.journal.snapshot_path)
+    assert not os.path.exists(registry.journal.old_path)
+    assert os.path.getsize(registry.journal.snapshot_path) < before
+    ticks += 1
+    registry.consume('default', 'x0', 1)
+    registry.consume('default', 'x9', 1)
+    registry.consume('default', 'paid:x', 30)
+    registry.journal.close()
+
+    restored = restore(path, clock)
+    assert_same(registry, restored)
+    assert restored.collections['default']['paid:x'].limit == 50
+
+
+@with_tmpdir
+def test_interrupted_compaction(path):
+    ticks = 0
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('default', 2, 20, 15)
+    registry.consume('default', 'x', 1)
+    asyncio.run(registry.journal.compact(registry))
+    ticks += 1
+    registry.consume('default', 'x', 1)
+    registry.consume('default', 'y', 1)
+    # Crash after moving the current segment aside, before the snapshot
+    # replacing it is written.
+    registry.journal._rotate()
+    ticks += 1
+    registry.consume('default', 'y', 1)
+    registry.journal.close()
+
+    restored = journalled(path, clock)
+    assert_same(registry, restored)
+    assert not os.path.exists(restored.journal.old_path)
+    ticks += 1
+    restored.consume('default', 'x', 1)
+    restored.journal.close()
+    assert_same(restored, restore(path, clock))
+
+
+@with_tmpdir
+def test_crash_after_finishing_compaction(path):
+    ticks = 0
+    clock = lambda: ticks
+    registry = journalled(path, clock)
+    registry.create('default', 2, 20, 15)
+    registry.consume('default', 'x', 1)
+    registry.journal._rotate()
+    registry.consume('default', 'y', 1)
+    registry.journal.close()
+    with open(path, 'rb') as fh:
+        segment = fh.read()
+
+    # Replaying finishes the interrupted compaction. Crash before the
+    # segment the new snapshot supersedes is removed.
+    assert_same(registry, restore(path, clock))
+    assert not os.path.exists(path)
+    with open(path, 'wb') as fh:
+        fh.write(segment)
+
+    restored = journalled(path, clock)
+    assert_same(registry, restored)
+    ticks += 1
+    restored.consume('default', 'x', 1)
+    restored.journal.close()
+    assert_same(restored, restore(path, clock))
+
+
+class FailingJournal(Journal):
+    """
+    A journal whose snapshots fail once they've started being written.
+    """
+
+    __slots__ = ()
+
+    def _snapshot(self, registry, superseded):
+        os.unlink(self.snapshot_path + '.tmp')
+        raise RuntimeError("Disk on fire")
+        yield
+
+
+@with_tmpdir
+def test_failed_compaction(path):
+    registry = Registry(clock=lambda: 0)
+    journal = FailingJournal(path)
+    journal.replay(registry)
+    journal.open()
+    registry.journal = journal
+    registry.create('default', 2, 20, 15)
+    try:
+        asyncio.run(journal.compact(registry))
+    except RuntimeError as exc:
+        # Not hidden by failing to remove the temporary file.
+        assert str(exc) == "Disk on fire"
+    else:
+        assert False
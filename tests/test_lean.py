@@ -0,0 +1,109 @@
+from bukkit.bucket import Collection
+from bukkit.lean import LeanCollection
+import random
+import tracemalloc
+
+
+def cache_order(buckets):
+    if isinstance(buckets, LeanCollection):
+        return list(buckets.buckets)
+    order = []
+    node = buckets.tail_node.next_node
+    while node is not buckets.head_node:
+        order.append(buckets.key_map[node])
+        node = node.next_node
+    return order
+
+
+def test_consume():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = LeanCollection(rate=5, limit=23, timeout=31, clock=fake_clock)
+    # Consuming nothing ensures the thing is present.
+    buckets.consume('thingy', 0)
+    assert buckets['thingy'].tokens == 23
+    assert buckets.consume('thingy', 3)
+    assert buckets['thingy'].tokens == 20
+    assert not buckets.consume('thingy', 21)
+    assert not buckets.consume('thingy', -1)
+    ticks += 1
+    assert buckets['thingy'].tokens == 23
+    assert buckets['thingy'].ts == 0
+    assert buckets.peek('thingy') == (23, 0)
+    assert buckets.peek('other') == (23, None)
+
+
+def test_contains_and_get():
+    buckets = LeanCollection(rate=5, limit=23, timeout=31, clock=lambda: 0)
+
+    assert 'thingy' not in buckets
+    try:
+        buckets['thingy']
+        assert False, "Should not be able to look up 'thingy'"
+    except IndexError as exc:
+        assert str(exc) == "No such bucket: 'thingy'"
+
+    buckets.consume('thingy', 5)
+    assert 'thingy' in buckets
+    assert len(buckets) == 1
+    assert buckets['thingy'].tokens == 18
+
+
+def test_time_until():
+    buckets = LeanCollection(rate=2, limit=10, timeout=31, clock=lambda: 0)
+    assert buckets.time_until('thingy', 10) == 0.0
+    assert buckets.time_until('thingy', 11) is None
+    buckets.consume('thingy', 10)
+    assert buckets.time_until('thingy', 4) == 2.0
+
+
+def test_matches_collection():
+    # Drive both backends through the same mix of operations, including
+    # incremental purges and evictions, and check they agree throughout.
+    rng = random.Random(42)
+    ticks = 0
+    fake_clock = lambda: ticks
+    kwargs = dict(
+        rate=1, limit=5, timeout=20, clock=fake_clock,
+        purge_step=2, max_buckets=50)
+    expected = Collection(**kwargs)
+    actual = LeanCollection(**kwargs)
+    for step in range(5000):
+        ticks += rng.random()
+        key = 'key:%d' % int(rng.paretovariate(1.2))
+        if step % 97 == 0:
+            expected.purge()
+            actual.purge()
+        elif step % 13 == 0:
+            pairs = [(key, 1), ('key:%d' % rng.randrange(80), 2), (key, 1)]
+            assert actual.consume_many(pairs) == expected.consume_many(pairs)
+        else:
+            tokens = rng.choice((0, 1, 2, 6))
+            assert actual.consume(key, tokens) == expected.consume(key, tokens)
+        assert cache_order(actual) == cache_order(expected)
+    assert actual.stats() == expected.stats()
+    for key in expected.node_map:
+        assert actual.peek(key) == expected.peek(key)
+
+
+def bytes_per_key(factory, keys):
+    tracemalloc.start()
+    try:
+        collection = factory()
+        for key in keys:
+            collection.consume(key, 1)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current / len(keys)
+
+
+def test_memory():
+    keys = ['key:%d' % i for i in range(20000)]
+    results = {}
+    for cls in (Collection, LeanCollection):
+        results[cls] = bytes_per_key(
+            lambda: cls(rate=1, limit=10, timeout=60, clock=lambda: 0), keys)
+    # Timings are compared in benchmarks/memory.py rather than here, where
+    # a loaded machine would make them flaky.
+    assert results[LeanCollection] < 0.75 * results[Collection]
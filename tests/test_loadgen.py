@@ -0,0 +1,64 @@
+from bukkit import loadgen
+import json
+import os
+import random
+import shutil
+import tempfile
+
+
+def test_percentile():
+    ordered = list(range(1, 1001))
+    assert loadgen.percentile(ordered, 0.5) == 500
+    assert loadgen.percentile(ordered, 0.99) == 990
+    assert loadgen.percentile(ordered, 0.999) == 999
+    assert loadgen.percentile(ordered, 1.0) == 1000
+    assert loadgen.percentile([], 0.5) == 0.0
+
+
+def test_skew():
+    rng = random.Random(42)
+    sample = loadgen._sampler(1000, 1.1, rng)
+    draws = [sample() for _ in range(10000)]
+    assert all(0 <= draw < 1000 for draw in draws)
+    # The most popular key gets far more than its uniform share.
+    assert draws.count(0) > 1000
+    sample = loadgen._sampler(1000, 0, rng)
+    assert max(sample() for _ in range(10000)) >= 990
+
+
+def test_positive_counts(capsys):
+    for option in ('--connections', '--processes', '--keys', '--depth'):
+        for value in ('0', '-1', 'x'):
+            try:
+                loadgen.main(['bukkit.sock', option, value])
+            except SystemExit as exc:
+                assert exc.code == 2
+            else:
+                assert False, (option, value)
+            err = capsys.readouterr().err
+            assert "'%s' is not a positive integer" % value in err
+
+
+def test_run(capsys):
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+    try:
+        for extra in ([], ['--binary', '--processes', '2']):
+            loadgen.main([
+                path, '--spawn', '--duration', '0.3', '--warmup', '0.1',
+                '--connections', '4', '--depth', '5', '--keys', '50',
+                '--skew', '1.1', '--tokens', '1,50', '--limit', '60'] +
+                extra)
+            results = json.loads(capsys.readouterr().out)
+            assert results['requests'] > 0
+            assert results['requests'] % 5 == 0
+            assert results['errors'] == 0
+            assert results['allowed'] > 0 and results['denied'] > 0
+            assert (results['allowed'] + results['denied'] ==
+                    results['requests'])
+            latency = results['latency_ms']
+            assert 0 < latency['p50'] <= latency['p99'] <= latency['p999']
+            assert latency['p999'] <= latency['max']
+            assert not os.path.exists(path)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,23 @@
+from bukkit.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    histogram = Histogram(bounds=(1, 2, 4))
+    assert histogram.percentile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.percentile(0.5) == 2
+    assert histogram.percentile(0.8) == 4
+    assert histogram.percentile(0.99) == float('inf')
+    assert histogram.as_dict() == {
+        'count': 5, 'mean': 3.3, 'p50': 2, 'p99': float('inf')}
+
+
+def test_metrics():
+    metrics = Metrics()
+    metrics.record_purge(0.5)
+    metrics.record_purge(0.25)
+    assert metrics.purges == 2
+    assert metrics.purge_seconds == 0.75
+    assert metrics.max_purge_seconds == 0.5
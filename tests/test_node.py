@@ -1,5 +1,5 @@
 from bukkit.bucket import Node
-import cPickle as pickle
+import pickle
 
 
 def test_creation():
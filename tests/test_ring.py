@@ -0,0 +1,47 @@
+from bukkit.ring import HashRing
+
+
+KEYS = ['key:%d' % i for i in range(20000)]
+
+
+def test_spread():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    counts = {}
+    for key in KEYS:
+        node = ring.node_for(key)
+        counts[node] = counts.get(node, 0) + 1
+    assert sorted(counts) == ['a', 'b', 'c', 'd']
+    for count in counts.values():
+        assert abs(count - len(KEYS) / 4) < len(KEYS) / 4 * 0.2
+
+
+def test_add_and_remove():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    before = dict((key, ring.node_for(key)) for key in KEYS)
+    ring.add('e')
+    after = dict((key, ring.node_for(key)) for key in KEYS)
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Only keys taken over by the new node move, about 1/5 of them.
+    assert all(after[key] == 'e' for key in moved)
+    assert abs(len(moved) - len(KEYS) / 5) < len(KEYS) / 5 * 0.2
+
+    ring.remove('e')
+    assert dict((key, ring.node_for(key)) for key in KEYS) == before
+    assert len(ring) == 4
+    assert 'e' not in ring
+
+
+def test_errors():
+    ring = HashRing()
+    try:
+        ring.node_for('x')
+        assert False, "Empty ring should have no nodes"
+    except LookupError:
+        pass
+    ring.add('a')
+    for func, node in ((ring.add, 'a'), (ring.remove, 'b')):
+        try:
+            func(node)
+            assert False, "Should have rejected '%s'" % node
+        except ValueError:
+            pass
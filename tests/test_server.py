@@ -0,0 +1,278 @@
+from bukkit import binary
+from bukkit.clock import CoarseClock
+from bukkit.journal import Journal
+from bukkit.server import (
+    DatagramHandler, Handler, Registry, UnixServer, MAX_STANZA)
+import asyncio
+import os
+import shutil
+import tempfile
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.writes = []
+        self.closed = False
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def make_handler():
+    handler = Handler(Registry(clock=lambda: 0))
+    handler.connection_made(FakeTransport())
+    return handler
+
+
+def test_create_and_consume():
+    handler = make_handler()
+    handler.data_received(b"B\nr=1\nl=2\nt=60\nc=test\n\n")
+    assert handler.transport.writes == [b"+\n\n"]
+    assert 'test' in handler.registry.collections
+
+    handler.data_received(b"C\nc=test\nb=x\nt=2\n\n")
+    handler.data_received(b"C\nc=test\nb=x\nt=1\n\n")
+    assert handler.transport.writes[1:] == [b"+\n\n", b"-\nr=1.0\n\n"]
+
+    handler.data_received(b"C\nc=test\nb=x\nt=3\n\n")
+    assert handler.transport.writes[-1] == b"-\nr=inf\n\n"
+
+
+def test_tiers():
+    handler = make_handler()
+    handler.data_received(
+        b"B\nr=1\nl=2\nt=60\nc=test\n\n" +
+        b"T\nc=test\np=paid:\nr=1\nl=10\n\n" +
+        b"C\nc=test\nb=paid:x\nt=5\n\n" +
+        b"C\nc=test\nb=free:x\nt=5\n\n" +
+        b"T\nc=missing\np=paid:\nr=1\nl=10\n\n")
+    assert handler.transport.writes == [
+        b"+\n\n+\n\n+\n\n-\nr=inf\n\n" +
+        b"!\nm=No such collection: 'missing'\n\n"]
+
+    handler = make_handler()
+    handler.data_received(
+        binary.HANDSHAKE +
+        binary.pack_create(1, 2, 60, 'test') +
+        binary.pack_tier('test', 'paid:', 1, 10) +
+        binary.pack_consume('test', 'paid:x', 5))
+    assert handler.transport.writes == [binary.pack_response('+') * 3]
+
+
+def test_pipelining():
+    handler = make_handler()
+    handler.data_received(
+        b"B\nr=1\nl=2\nt=60\nc=test\n\n" +
+        b"C\nc=test\nb=x\nt=1\n\n" * 3 +
+        b"C\nc=test\nb=x")
+    # Everything that arrived together is answered with a single write.
+    assert handler.transport.writes == [b"+\n\n+\n\n+\n\n-\nr=1.0\n\n"]
+
+    # The partial request is completed by the next read.
+    handler.data_received(b"\nt=0\n\n")
+    assert handler.transport.writes[1:] == [b"+\n\n"]
+    assert len(handler.buffer) == 0
+
+
+def test_errors():
+    handler = make_handler()
+    handler.data_received(b"C\nc=missing\nb=x\nt=1\n\n")
+    handler.data_received(b"X\n\n")
+    handler.data_received(b"C\nc=missing\nb=x\n\n")
+    handler.data_received(b"B\nr=fast\nl=2\nt=60\nc=test\n\n")
+    assert handler.transport.writes == [
+        b"!\nm=No such collection: 'missing'\n\n",
+        b"!\nm='X' is not recognised\n\n",
+        b"!\nm='t' is missing\n\n",
+        b"!\nm='r' must be a number\n\n",
+    ]
+    assert not handler.transport.closed
+
+    handler.data_received(b"C" * (MAX_STANZA + 1))
+    assert handler.transport.writes[-1] == b"!\nm=Request too large\n\n"
+    assert handler.transport.closed
+
+
+def test_binary():
+    handler = make_handler()
+    request = (
+        binary.pack_create(1, 2, 60, 'test') +
+        binary.pack_consume('test', 'x', 1) * 3 +
+        binary.pack_consume('missing', 'x', 1))
+    # The handshake and a partial frame arrive in the first read.
+    handler.data_received(binary.HANDSHAKE + request[:-3])
+    assert handler.binary
+    handler.data_received(request[-3:])
+    ok = binary.pack_response('+')
+    assert handler.transport.writes == [
+        ok * 3 + binary.pack_denied(1.0),
+        binary.pack_response('!', "No such collection: 'missing'"),
+    ]
+
+
+def test_datagram():
+    registry = Registry(clock=lambda: 0)
+    registry.create('test', 1, 3, 60)
+    handler = DatagramHandler(registry)
+    handler.datagram_received(
+        binary.pack_consume('test', 'x', 1) * 4 +
+        binary.pack_consume('test', 'y', 2) +
+        binary.pack_consume('missing', 'x', 1) +
+        binary.pack_create(1, 2, 60, 'other') +
+        binary.pack_consume('test', 'z', 1)[:-2], None)
+    assert registry.collections['test'].peek('x') == (0, 0)
+    assert registry.collections['test'].peek('y') == (1, 0)
+    assert 'z' not in registry.collections['test']
+    assert 'other' not in registry.collections
+    # The missing collection, the create and the truncated frame.
+    assert handler.dropped == 3
+
+
+def test_stats():
+    handler = make_handler()
+    handler.data_received(b"B\nr=1\nl=2\nt=60\nc=test\n\n")
+    handler.data_received(b"C\nc=test\nb=x\nt=2\n\n")
+    handler.data_received(b"S\nc=test\n\n")
+    assert handler.transport.writes[-1] == (
+        b"=\nbuckets=1\nexpired=0\nevicted=0\n\n")
+
+    handler = Handler(Registry(clock=lambda: 0, metrics=True))
+    handler.connection_made(FakeTransport())
+    handler.data_received(b"B\nr=1\nl=2\nt=60\nc=test\n\n")
+    handler.data_received(b"C\nc=test\nb=x\nt=2\n\n")
+    handler.data_received(b"C\nc=test\nb=x\nt=2\n\n")
+    handler.data_received(b"C\nc=missing\nb=x\nt=2\n\n")
+    stats = handler.registry.stats('test')
+    assert stats['allowed'] == 1
+    assert stats['denied'] == 1
+    assert stats['created'] == 1
+    assert stats['latency.B.count'] == 1
+    assert stats['latency.C.count'] == 3
+    assert stats['latency.S.count'] == 0
+
+
+def test_query():
+    handler = make_handler()
+    handler.data_received(b"B\nr=1\nl=2\nt=60\nc=test\n\n")
+    handler.data_received(b"C\nc=test\nb=x\nt=2\n\n")
+    handler.data_received(b"Q\nc=test\nb.0=x\nb.1=y\n\n")
+    assert handler.transport.writes[-1] == (
+        b"=\na.0=0.0\ns.0=0\na.1=2.0\n\n")
+    # Querying neither creates buckets nor consumes from them.
+    assert 'y' not in handler.registry.collections['test']
+    handler.data_received(b"C\nc=test\nb=y\nt=2\n\n")
+    assert handler.transport.writes[-1] == b"+\n\n"
+
+    handler.data_received(b"Q\nc=test\nb.1=x\n\n")
+    handler.data_received(b"Q\nb.0=x\n\n")
+    assert handler.transport.writes[-2:] == [
+        b"!\nm='b.0' is missing\n\n",
+        b"!\nm='c' is missing\n\n",
+    ]
+
+    handler = make_handler()
+    handler.data_received(
+        binary.HANDSHAKE +
+        binary.pack_create(1, 2, 60, 'test') +
+        binary.pack_query('test', ['x']))
+    assert handler.transport.writes == [
+        binary.pack_response('+') + binary.pack_attrs({'a.0': 2.0})]
+
+
+def test_chain():
+    handler = make_handler()
+    handler.data_received(
+        b"B\nr=1\nl=2\nt=60\nc=users\n\n" +
+        b"B\nr=1\nl=3\nt=60\nc=all\n\n")
+    chain = b"H\nt=2\nc.0=users\nb.0=%s\nc.1=all\nb.1=x\n\n"
+    handler.data_received(chain % b"alice" + chain % b"bob")
+    assert handler.transport.writes[-1] == b"+\n\n-\nr=1.0\n\n"
+    # Bob's bucket wasn't touched by the failed attempt.
+    assert handler.registry.collections['users']['bob'].tokens == 2
+
+    handler.data_received(
+        b"H\nt=1\nc.0=users\nb.0=x\nc.1=missing\nb.1=x\n\n" +
+        b"H\nt=1\nc.0=users\nb.0=x\nc.1=all\n\n" +
+        b"H\nt=1\n\n")
+    assert handler.transport.writes[-1] == (
+        b"!\nm=No such collection: 'missing'\n\n" +
+        b"!\nm='b.1' is missing\n\n" +
+        b"!\nm=Chain is empty\n\n")
+
+    handler = make_handler()
+    handler.data_received(
+        binary.HANDSHAKE +
+        binary.pack_create(1, 2, 60, 'test') +
+        binary.pack_chain([('test', 'x'), ('test', 'y')], 2) +
+        binary.pack_chain([('test', 'x'), ('test', 'z')], 1))
+    assert handler.transport.writes == [
+        binary.pack_response('+') * 2 + binary.pack_denied(1.0)]
+
+
+def test_unix_server():
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+
+    async def scenario(clock=None):
+        registry = Registry(clock=None if clock is None else clock.now)
+        server = UnixServer(path, registry=registry, clock=clock)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(
+                b"B\nr=1\nl=2\nt=60\nc=test\n\n" +
+                b"C\nc=test\nb=x\nt=1\n\n" * 3)
+            response = await reader.readexactly(9)
+            response += await reader.readuntil(b"\n\n")
+            writer.close()
+            return response
+        finally:
+            await server.close()
+
+    try:
+        for clock in (None, CoarseClock(resolution=0.01)):
+            response = asyncio.run(scenario(clock))
+            assert response.startswith(b"+\n\n+\n\n+\n\n-\nr=")
+            assert 0 < float(response[13:-2]) <= 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_unix_server_journal():
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bukkit.sock')
+    journal_path = os.path.join(tmpdir, 'journal')
+
+    async def scenario(requests):
+        journal = Journal(journal_path, sync_interval=0.01)
+        registry = Registry()
+        journal.replay(registry)
+        journal.open()
+        registry.journal = journal
+        server = UnixServer(path, registry=registry, compact_interval=0.05)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(requests)
+            response = await reader.readuntil(b"\n\n")
+            # Long enough to sync and compact.
+            await asyncio.sleep(0.1)
+            writer.close()
+            return response
+        finally:
+            await server.close()
+            journal.close()
+
+    try:
+        response = asyncio.run(scenario(
+            b"B\nr=0.001\nl=2\nt=60\nc=test\n\nC\nc=test\nb=x\nt=2\n\n"))
+        assert response == b"+\n\n"
+        assert os.path.exists(journal_path + '.snapshot')
+        response = asyncio.run(scenario(b"C\nc=test\nb=x\nt=1\n\n"))
+        assert response.startswith(b"-\nr=")
+    finally:
+        shutil.rmtree(tmpdir)
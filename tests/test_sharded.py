@@ -0,0 +1,98 @@
+from bukkit import ShardedCollection
+from bukkit.bucket import MonotonicTokenBucket
+import threading
+
+
+def test_consume():
+    buckets = ShardedCollection(
+        rate=5, limit=23, timeout=31, clock=lambda: 0, shards=4)
+    assert 'thingy' not in buckets
+    assert buckets.consume('thingy', 3)
+    assert 'thingy' in buckets
+    assert buckets['thingy'].tokens == 20
+    assert 'thingy' in buckets.shards[buckets.shard_for('thingy')]
+
+
+def test_getitem_copies():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ShardedCollection(
+        rate=1, limit=10, timeout=31, clock=fake_clock, shards=4)
+    buckets.consume('x', 5)
+    ticks += 2
+    bucket = buckets['x']
+    assert bucket.tokens == 7
+    assert bucket.consume(7)
+    # Neither reading nor consuming from the copy touches the original.
+    original = buckets.shards[buckets.shard_for('x')]['x']
+    assert original.ts == 0
+    assert original._available == 5
+    assert buckets.consume('x', 7)
+
+
+def test_consume_many():
+    buckets = ShardedCollection(
+        rate=5, limit=10, timeout=31, clock=lambda: 0, shards=4)
+    pairs = [('x' + str(i % 7), 3) for i in range(28)]
+    results = buckets.consume_many(pairs)
+    # Each key gets three successful attempts out of its four.
+    assert results == [True] * 21 + [False] * 7
+
+
+def test_purge():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ShardedCollection(
+        rate=1, limit=20, timeout=15, clock=fake_clock, shards=4)
+    for i in range(20):
+        buckets.consume('x' + str(i), 0)
+    ticks += 10
+    buckets.consume('x0', 0)
+    ticks += 10
+    buckets.purge()
+    assert sum(len(shard.node_map) for shard in buckets.shards) == 1
+    assert 'x0' in buckets
+
+
+def test_monotonic_buckets():
+    buckets = ShardedCollection(
+        rate=100, limit=10, timeout=15, shards=4,
+        bucket_class=MonotonicTokenBucket)
+    assert all(
+        shard.clock is MonotonicTokenBucket.default_clock
+        for shard in buckets.shards)
+
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = ShardedCollection(
+        rate=100, limit=10, timeout=15, clock=fake_clock, shards=4,
+        bucket_class=MonotonicTokenBucket)
+    assert buckets.consume('x', 10)
+    assert not buckets.consume('x', 1)
+    # Ten milliseconds, in nanoseconds, refills one token.
+    ticks += 10 ** 7
+    assert buckets.consume('x', 1)
+    assert not buckets.consume('x', 1)
+    ticks += 20 * 10 ** 9
+    buckets.purge()
+    assert 'x' not in buckets
+
+
+def test_threads():
+    buckets = ShardedCollection(
+        rate=0, limit=1000, timeout=31, clock=lambda: 0, shards=4)
+    granted = []
+
+    def worker():
+        count = 0
+        for i in range(500):
+            if buckets.consume('k' + str(i % 3), 1):
+                count += 1
+        granted.append(count)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(granted) == 3000
@@ -0,0 +1,109 @@
+from bukkit.shm import CapacityError, SharedCollection
+import multiprocessing
+
+
+def make_collection(**kwargs):
+    kwargs.setdefault('clock', lambda: 0)
+    return SharedCollection(rate=5, limit=23, timeout=31, **kwargs)
+
+
+def test_consume():
+    buckets = make_collection()
+    try:
+        assert 'thingy' not in buckets
+        buckets.consume('thingy', 0)
+        assert 'thingy' in buckets
+        assert buckets['thingy'].tokens == 23
+        assert buckets.consume('thingy', 3)
+        assert buckets['thingy'].tokens == 20
+        assert not buckets.consume('thingy', 21)
+        assert len(buckets) == 1
+        try:
+            buckets['other']
+            assert False, "Should not be able to look up 'other'"
+        except IndexError as exc:
+            assert str(exc) == "No such bucket: 'other'"
+    finally:
+        buckets.close()
+        buckets.unlink()
+
+
+def test_refill():
+    ticks = multiprocessing.Value('d', 0)
+    buckets = make_collection(clock=lambda: ticks.value)
+    try:
+        assert buckets.consume('x', 20)
+        ticks.value = 1
+        assert buckets['x'].tokens == 8
+        assert not buckets.consume('x', 9)
+        ticks.value = 10
+        assert buckets.consume('x', 23)
+    finally:
+        buckets.close()
+        buckets.unlink()
+
+
+def test_purge_and_capacity():
+    ticks = multiprocessing.Value('d', 0)
+    buckets = make_collection(
+        clock=lambda: ticks.value, capacity=8, stripes=1)
+    try:
+        for i in range(8):
+            buckets.consume('x' + str(i), 0)
+        assert len(buckets) == 8
+        try:
+            buckets.consume('full', 0)
+            assert False, "Should have run out of room"
+        except CapacityError:
+            pass
+
+        ticks.value = 20
+        for i in range(4):
+            buckets.consume('x' + str(i), 1)
+        ticks.value = 40
+        buckets.purge()
+        assert len(buckets) == 4
+        for i in range(8):
+            assert (('x' + str(i)) in buckets) == (i < 4)
+        assert buckets['x0'].tokens == 23
+
+        # A full segment is purged to make room.
+        ticks.value = 60
+        for i in range(8):
+            buckets.consume('y' + str(i), 0)
+        assert len(buckets) == 8
+    finally:
+        buckets.close()
+        buckets.unlink()
+
+
+def _worker(buckets, granted):
+    count = 0
+    for i in range(300):
+        if buckets.consume('k' + str(i % 3), 1):
+            count += 1
+    with granted.get_lock():
+        granted.value += count
+    buckets.close()
+
+
+def test_processes():
+    for method in ('fork', 'spawn'):
+        ctx = multiprocessing.get_context(method)
+        buckets = SharedCollection(
+            rate=0, limit=200, timeout=60, stripes=2, ctx=ctx)
+        granted = ctx.Value('i', 0)
+        try:
+            procs = [
+                ctx.Process(target=_worker, args=(buckets, granted))
+                for _ in range(4)]
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+                assert proc.exitcode == 0
+            # Three keys with a limit of 200 each, shared by every process.
+            assert granted.value == 600
+        finally:
+            buckets.close()
+            buckets.unlink()
@@ -0,0 +1,59 @@
+from bukkit.sketch import SketchCollection
+
+
+def test_single_key():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = SketchCollection(
+        rate=1, limit=10, timeout=30, clock=fake_clock, promote_at=2)
+    assert buckets.consume('x', 6)
+    assert not buckets.consume('x', 5)
+    assert buckets.consume('x', 4)
+    assert not buckets.consume('x', 1)
+    assert not buckets.consume('x', -1)
+    assert buckets.estimate('x') == 10
+    ticks = 3
+    assert buckets.estimate('x') == 7
+    assert not buckets.consume('x', 4)
+    assert buckets.consume('x', 3)
+    ticks = 100
+    assert buckets.estimate('x') == 0
+    assert 'x' not in buckets
+
+
+def test_never_allows_more_than_exact():
+    buckets = SketchCollection(
+        rate=0, limit=5, timeout=30, clock=lambda: 0, width=16, depth=2,
+        promote_at=2)
+    allowed = dict((i, 0) for i in range(200))
+    for _ in range(10):
+        for i in allowed:
+            if buckets.consume(i, 1):
+                allowed[i] += 1
+    # Collisions cause some keys to be denied early, but none may go over.
+    assert max(allowed.values()) <= 5
+    assert min(allowed.values()) < 5
+
+
+def test_promotion():
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = SketchCollection(
+        rate=1, limit=10, timeout=30, clock=fake_clock, max_exact=2)
+    assert buckets.consume('x', 4)
+    assert 'x' not in buckets
+    assert buckets.consume('x', 1)
+    # Promoted with only the tokens the sketch had left.
+    assert 'x' in buckets
+    assert buckets.estimate('x') == 5
+    assert buckets.consume('x', 5)
+    assert not buckets.consume('x', 1)
+
+    # Promoted keys are capped, and expire back into the sketch.
+    for key in ('y', 'z'):
+        buckets.consume(key, 5)
+    assert 'x' not in buckets
+    assert len(buckets.exact) == 2
+    ticks = 31
+    buckets.purge()
+    assert len(buckets.exact) == 0
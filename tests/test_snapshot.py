@@ -0,0 +1,119 @@
+from bukkit import Collection, MonotonicTokenBucket, PrefixResolver
+from bukkit import snapshot
+import os
+import shutil
+import tempfile
+
+
+def cache_order(buckets):
+    order = []
+    node = buckets.tail_node.next_node
+    while node is not buckets.head_node:
+        order.append(buckets.key_map[node])
+        node = node.next_node
+    return order
+
+
+def with_tmpdir(func):
+    def wrapper():
+        tmpdir = tempfile.mkdtemp()
+        try:
+            func(os.path.join(tmpdir, 'snapshot'))
+        finally:
+            shutil.rmtree(tmpdir)
+    wrapper.__name__ = func.__name__
+    return wrapper
+
+
+@with_tmpdir
+def test_round_trip(path):
+    ticks = 0
+    fake_clock = lambda: ticks
+    buckets = Collection(
+        rate=2, limit=20, timeout=15, clock=fake_clock, max_buckets=100)
+    for i in range(5):
+        ticks += 1
+        buckets.consume('x' + str(i), i)
+    buckets.consume('x1', 3)
+    buckets.consume('ünïcode', 0.5)
+
+    snapshot.save(buckets, path)
+    assert not os.path.exists(path + '.tmp')
+    restored = snapshot.load(path, clock=fake_clock)
+
+    for attr in ('rate', 'limit', 'timeout', 'purge_step', 'max_buckets'):
+        assert getattr(buckets, attr) == getattr(restored, attr)
+    assert restored.clock is fake_clock
+    assert cache_order(restored) == cache_order(buckets)
+    for key in buckets.node_map:
+        assert restored[key].ts == buckets[key].ts
+        assert restored[key]._available == buckets[key]._available
+
+    ticks += 1
+    assert restored['x1'].tokens == buckets['x1'].tokens
+    assert restored.consume('x1', 10) == buckets.consume('x1', 10)
+
+
+@with_tmpdir
+def test_monotonic(path):
+    buckets = Collection(
+        rate=0.1, limit=100, timeout=15, bucket_class=MonotonicTokenBucket)
+    buckets.consume('x', 1)
+    buckets.consume('y', 99.5)
+
+    snapshot.save(buckets, path)
+    restored = snapshot.load(path)
+    assert restored.bucket_class is MonotonicTokenBucket
+    assert cache_order(restored) == ['x', 'y']
+    for key in ('x', 'y'):
+        for attr in MonotonicTokenBucket.__slots__:
+            if attr != 'clock':
+                assert (getattr(restored[key], attr) ==
+                        getattr(buckets[key], attr))
+
+
+@with_tmpdir
+def test_resolver(path):
+    buckets = Collection(rate=1, limit=10, timeout=15)
+    resolver = PrefixResolver({'paid:': buckets.policy(10, 100)})
+    buckets.resolver = resolver
+    buckets.consume('paid:x', 50)
+    buckets.consume('free:x', 5)
+
+    snapshot.save(buckets, path)
+    restored = snapshot.load(path, resolver=resolver)
+    assert restored['paid:x'].limit == 100
+    assert restored['free:x'].limit == 10
+    assert restored['paid:x']._available == 50
+    assert restored.resolver is resolver
+
+
+@with_tmpdir
+def test_errors(path):
+    buckets = Collection(rate=1, limit=20, timeout=15)
+    buckets.consume(42, 1)
+    try:
+        snapshot.save(buckets, path)
+        assert False, "Should not be able to save non-string keys"
+    except snapshot.SnapshotError as exc:
+        assert str(exc) == "Key 42 is not a string"
+    assert not os.path.exists(path + '.tmp')
+
+    buckets = Collection(rate=1, limit=20, timeout=15)
+    buckets.consume('x', 1)
+    snapshot.save(buckets, path)
+    with open(path, 'rb') as fh:
+        data = fh.read()
+
+    for corrupt, message in [
+            (b"XXXX" + data[4:], "Not a snapshot"),
+            (b"", "Truncated header"),
+            (data[:10], "Truncated header"),
+            (data[:-1], "Truncated record")]:
+        with open(path, 'wb') as fh:
+            fh.write(corrupt)
+        try:
+            snapshot.load(path)
+            assert False, "Should have rejected snapshot"
+        except snapshot.SnapshotError as exc:
+            assert str(exc) == message